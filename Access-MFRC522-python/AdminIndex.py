@@ -0,0 +1,127 @@
+# Keeps the UIDs of the admin tags in memory, so that checking a tag is a single lookup in a set instead of reading and
+# scanning the admin table (AdminTags.csv) at every tap.
+#
+# The UIDs are those of the "UID" column of the table, as integers (see MFRC522.uid_to_int). The table is read again
+# when its modification time or size changes, which is checked at most every "check_interval" seconds, or right away
+# with load() (e.g. after the table was downloaded). A new set is built and then replaces the old one in one step, so a
+# lookup made while the table is read uses the old set.
+#
+# Running this file measures the time of a lookup for tables of several sizes:
+#   python AdminIndex.py
+
+import csv
+import logging
+import os
+import threading
+import time
+
+
+# Converts a UID of the table into an integer, or returns None when it is not a number. pandas writes the UIDs as
+# "1234.0" when a UID of the table is missing, which is accepted too.
+def canonical_uid(value):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            number = float(value)
+        except ValueError:
+            return None
+        return int(number) if number.is_integer() else None
+
+
+class AdminIndex:
+    def __init__(self, path, check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+        self.uids = frozenset()
+        self.signature = None   # The (modification time, size) of the table that was read.
+        self.checked_at = None
+        self.lock = threading.Lock()
+        self.load()
+
+    # Reads the table and replaces the set of UIDs. Returns the number of UIDs, or None when the table could not be read,
+    # in which case the previous set is kept.
+    def load(self):
+        with self.lock:
+            try:
+                stat = os.stat(self.path)
+                uids = set()
+                with open(self.path, newline="") as f:
+                    for row in csv.DictReader(f):
+                        uid = canonical_uid(row.get("UID") or "")
+                        if uid is not None:
+                            uids.add(uid)
+            except (OSError, csv.Error) as e:
+                logging.info("The admin tag table could not be read: {}".format(e))
+                self.checked_at = time.monotonic()
+                return None
+            self.uids = frozenset(uids)
+            self.signature = (stat.st_mtime_ns, stat.st_size)
+            self.checked_at = time.monotonic()
+            return len(self.uids)
+
+    # Reads the table again if it changed since it was read. The file is only looked at every "check_interval" seconds.
+    def reload_if_changed(self):
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        if (stat.st_mtime_ns, stat.st_size) != self.signature:
+            self.load()
+
+    # Whether the UID (an integer) is the UID of an admin tag.
+    def contains(self, uid_int):
+        self.reload_if_changed()
+        return uid_int in self.uids
+
+    def __contains__(self, uid_int):
+        return self.contains(uid_int)
+
+    def __len__(self):
+        return len(self.uids)
+
+
+# Writes a table of "size" random admin UIDs and measures the mean time of a lookup, for UIDs of the table and UIDs that
+# are not in it. When pandas is installed, the way the table was checked before (reading it with pandas and going over
+# the column) is measured too.
+def benchmark(size, path, lookups=20000):
+    import random
+
+    uids = random.sample(range(10 ** 9, 10 ** 10), size)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Name", "UID", "id"])
+        for (i, uid) in enumerate(uids):
+            writer.writerow(["Admin {}".format(i), uid, i])
+
+    index = AdminIndex(path)
+    probes = [random.choice(uids) if i % 2 else random.randint(0, 10 ** 9 - 1) for i in range(lookups)]
+    start = time.perf_counter()
+    found = sum(1 for uid in probes if uid in index)
+    lookup = (time.perf_counter() - start) / lookups
+
+    try:
+        import pandas as pd
+    except ImportError:
+        return (lookup, None, found)
+    runs = 20
+    start = time.perf_counter()
+    for uid in probes[:runs]:
+        any(i == uid for i in pd.read_csv(path)["UID"])
+    scan = (time.perf_counter() - start) / runs
+    return (lookup, scan, found)
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), "AdminTags.csv")
+    print ("admins  lookup (us)  pandas scan (ms)")
+    for size in [10, 100, 1000, 10000]:
+        (lookup, scan, found) = benchmark(size, path)
+        print ("%6d  %11.2f  %16s" % (size, lookup * 1e6, "-" if scan is None else "%.1f" % (scan * 1000)))
+    os.remove(path)
@@ -0,0 +1,127 @@
+# Keeps the admin tag table of the Pi (AdminTags.csv, see AdminIndex.py) up to date with the table of the server, in
+# the background, so that a new admin tag (AdminTagGenerator.py) works within a few minutes without restarting the Pi.
+#
+# Every "interval" seconds, the thread asks the server for the number of rows of the table and the latest value of its
+# "updated_column", a column that MySQL sets every time a row is added or modified:
+#   ALTER TABLE adminTokens ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+# When neither changed, that single query is all. Otherwise only the rows updated since the last sync are downloaded,
+# and merged into the table by their id. The rows that were deleted cannot be seen this way, so when the number of rows
+# does not add up, the whole table is downloaded again, as it is at the first sync. Without "updated_column" (None),
+# the whole table is downloaded every time.
+#
+# The table is written to a temporary file, which then replaces AdminTags.csv in one step (os.replace), so the file is
+# never half written, and the admin index reads it right away.
+
+import csv
+import logging
+import os
+import threading
+import time
+
+
+class AdminSync:
+    # "index" is the AdminIndex of the table. "database_url" is the SQLAlchemy URL of the server. "on_sync(success)" is
+    # called from the thread after every sync.
+    def __init__(self, index, database_url, table="adminTokens", updated_column="updated_at", interval=300, on_sync=None):
+        self.index = index
+        self.database_url = database_url
+        self.table = table
+        self.updated_column = updated_column
+        self.interval = interval
+        self.on_sync = on_sync
+        self.engine = None
+        self.rows = {}      # The rows of the table, as (Name, UID) by id.
+        self.token = None   # The (number of rows, latest update) of the table at the last sync.
+        self.syncs = 0
+        self.unchanged = 0
+        self.failures = 0
+        self.last_duration = 0.0
+        self.thread = None
+        self.stopped = threading.Event()
+
+    # Syncs the table once. Returns the number of rows that were downloaded (0 when nothing changed). Raises the
+    # exception of SQLAlchemy when the server cannot be reached.
+    def sync(self):
+        # SQLAlchemy takes a while to import, so it is only imported by the thread.
+        from sqlalchemy import create_engine
+        from sqlalchemy.sql import text
+        started = time.monotonic()
+        if self.engine is None:
+            self.engine = create_engine(self.database_url)
+        columns = "id, Name, UID" + ("" if self.updated_column is None else ", " + self.updated_column)
+
+        full = True
+        token = None
+        if self.updated_column is not None:
+            token = tuple(self.engine.execute("SELECT COUNT(*), MAX({}) FROM {}".format(self.updated_column, self.table)).fetchone())
+            if token == self.token:
+                self.syncs += 1
+                self.unchanged += 1
+                self.last_duration = time.monotonic() - started
+                return 0
+            if self.token is not None and self.token[1] is not None:
+                changed = self.engine.execute(text("SELECT {} FROM {} WHERE {} >= :since".format(columns, self.table, self.updated_column)),
+                                              since=self.token[1]).fetchall()
+                rows = dict(self.rows)
+                for row in changed:
+                    rows[row[0]] = (row[1], row[2])
+                full = len(rows) != token[0]
+
+        if full:
+            changed = self.engine.execute("SELECT {} FROM {}".format(columns, self.table)).fetchall()
+            rows = dict((row[0], (row[1], row[2])) for row in changed)
+
+        self.write(rows)
+        self.rows = rows
+        self.token = token
+        self.index.load()   # The admins of the new table are used right away.
+        self.syncs += 1
+        self.last_duration = time.monotonic() - started
+        logging.info("The admin tag table was updated in {:.2f} s: {} rows downloaded ({}), {} admins".format(
+            self.last_duration, len(changed), "whole table" if full else "changes only", len(rows)))
+        return len(changed)
+
+    # Writes the table to a temporary file, and replaces the table of the index with it.
+    def write(self, rows):
+        temporary = self.index.path + ".tmp"
+        with open(temporary, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Name", "UID", "id"])
+            for (row_id, (name, uid)) in sorted(rows.items()):
+                writer.writerow([name, uid, row_id])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.index.path)
+
+    def report(self):
+        return "Admin sync: %d syncs, %d unchanged, %d failed, last one %.2f s, %d admins" % (
+            self.syncs, self.unchanged, self.failures, self.last_duration, len(self.rows))
+
+    # Starts the thread that syncs the table. The first sync is done right away.
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="AdminSync")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        failed = False
+        while not self.stopped.is_set():
+            try:
+                self.sync()
+                success = True
+                if failed:
+                    logging.info("The admin tag table can be updated again.")
+            except Exception as e:
+                # The server cannot be reached, but also SQLAlchemy missing, a wrong database_url or an unexpected row:
+                # the thread keeps going, so that the table is updated as soon as the problem is fixed.
+                self.failures += 1
+                success = False
+                if not failed:
+                    logging.exception("The admin tag table could not be updated: {}".format(e))
+            failed = not success
+            if self.on_sync is not None:
+                self.on_sync(success)
+            self.stopped.wait(self.interval)
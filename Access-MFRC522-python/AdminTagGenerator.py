@@ -8,7 +8,7 @@
 
 import time
 
-import RPi.GPIO as GPIO
+from MFRC522Transport import GPIO
 import MFRC522
 import signal
 
@@ -45,8 +45,8 @@ while continue_reading:
     if status == MIFAREReader.MI_OK:
         print ("Card detected")
 
-    # Get the UID of the card
-    (status, uid) = MIFAREReader.MFRC522_Anticoll()
+    # Get the UID of the card, and select it
+    (status, uid, sak) = MIFAREReader.MFRC522_AnticollSelect()
 
     # If we have the UID, continue
     if status == MIFAREReader.MI_OK:
@@ -54,9 +54,6 @@ while continue_reading:
         # This is the default key for authentication
         key = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
 
-        # Select the scanned tag
-        MIFAREReader.MFRC522_SelectTag(uid)
-
         # Authenticate
         status = MIFAREReader.MFRC522_Auth(MIFAREReader.PICC_AUTHENT1A, 8, key, uid)
         print ("\n")
@@ -64,7 +61,7 @@ while continue_reading:
         # Check if authenticated
         if status == MIFAREReader.MI_OK:
 
-            uid_int = int(''.join(str(e) for e in uid))
+            uid_int = MFRC522.uid_to_int(uid)
 
             write_admin = text("INSERT INTO adminTokens (Name,UID) VALUES (:v1, :v2)")
             engine.execute(write_admin, v1=tag_name, v2=uid_int)
@@ -0,0 +1,400 @@
+# Keeps a record of what happens at the machines (tags tapped, access granted or denied, sessions ended, errors) in a
+# compact binary journal, to answer questions such as "who used machine 267 last week" without reading log files.
+#
+# Every event is one record of about 40 bytes: the time, the kind of event, the duration of the session (for "end"),
+# then the resource id of the machine, the UID of the tag, the Booked ID (both in decimal, as they can be longer than
+# any integer field: a 10 byte UID is up to 30 digits) and a short detail, followed by a CRC32 so that a record cut by
+# a power loss is recognized. Records are only ever appended, after the last valid record: a record cut at the end of
+# the journal is removed when the journal is opened again, so that the records written after it can be read. When the
+# journal reaches "max_bytes" it is renamed to AuditJournal.bin.1 (the older ones to .2, .3, ...) and a new one is
+# started, keeping "backup_count" old files, like the rotating log files of the logging module. A journal of an older version is rotated away the same way.
+#
+# record() only adds the event to a list in memory and returns, and never raises: an event that cannot be recorded is
+# logged and counted instead, so that the journal never stops a tap. A thread writes the events of the last
+# "sync_interval" seconds together, with one fsync, so that the readers never wait for the SD card. Events that could
+# not be written (e.g. the SD card is full) are kept in memory and written with the next ones.
+#
+# Running this file reads journals (with their rotated files, e.g. AuditJournal.bin*), one record at a time, and prints
+# the events that match the filters, or a summary of them:
+#   python AuditJournal.py [--uid UID] [--user BOOKED_ID] [--resource ID] [--since DATE] [--until DATE]
+#                          [--event tap,grant,deny,end,error] [--by user|uid|resource|day] FILE...
+# For example, who used machine 267 last week, and for how long:
+#   python AuditJournal.py --resource 267 --since 2026-10-11 --until 2026-10-18 --event end --by user AuditJournal.bin*
+# and "python AuditJournal.py --benchmark" measures record() and the writes.
+
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+TAP = "tap"
+GRANT = "grant"
+DENY = "deny"
+END = "end"
+ERROR = "error"
+EVENTS = [TAP, GRANT, DENY, END, ERROR]
+
+MAGIC = b"AUDJ2\n"
+# time, event, duration (-1 when none), then the lengths of the resource id, UID, Booked ID and detail that follow
+RECORD = struct.Struct("<dBfBBBH")
+CRC = struct.Struct("<I")
+
+
+# Returns the decimal digits of a UID or Booked ID, or nothing when it is unknown.
+def number_bytes(value):
+    return b"" if value is None else str(value).encode("ascii", "replace")[:255]
+
+
+def read_number(data):
+    text = data.decode("ascii", "replace")
+    if not text:
+        return None
+    return int(text) if text.isdigit() else text
+
+
+# Returns the bytes of one record. Raises an exception when an argument cannot be written (e.g. an unknown event).
+def pack(when, event, resource_id, uid=None, user_id=None, duration=None, detail=""):
+    fields = [str(resource_id).encode("utf-8")[:255], number_bytes(uid), number_bytes(user_id),
+              detail.encode("utf-8")[:65535]]
+    data = RECORD.pack(when, EVENTS.index(event), -1.0 if duration is None else duration,
+                       *[len(field) for field in fields])
+    data += b"".join(fields)
+    return data + CRC.pack(zlib.crc32(data))
+
+
+# Reads the records of an open journal file, after its MAGIC, one at a time. Yields (offset, event) for every record,
+# where "offset" is the byte after the record, then (offset, None) when a record is cut or damaged, "offset" being
+# where that record starts, and stops there.
+def scan(f):
+    while True:
+        start = f.tell()
+        header = f.read(RECORD.size)
+        if not header:
+            return
+        if len(header) == RECORD.size:
+            values = RECORD.unpack(header)
+            (when, event, duration) = values[:3]
+            lengths = values[3:]
+            rest = f.read(sum(lengths) + CRC.size)
+            if len(rest) == sum(lengths) + CRC.size and event < len(EVENTS) and \
+                    CRC.unpack(rest[-CRC.size:])[0] == zlib.crc32(header + rest[:-CRC.size]):
+                fields = []
+                for length in lengths:
+                    fields.append(rest[:length])
+                    rest = rest[length:]
+                yield (f.tell(), {"time": when, "event": EVENTS[event], "uid": read_number(fields[1]),
+                                  "user_id": read_number(fields[2]), "duration": None if duration < 0 else duration,
+                                  "resource_id": fields[0].decode("utf-8", "replace"),
+                                  "detail": fields[3].decode("utf-8", "replace")})
+                continue
+        yield (start, None)
+        return
+
+
+# Reads the records of one journal file, one at a time, as dictionaries. Stops at the first record that is cut or
+# damaged, which is logged.
+def read_file(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            logging.warning("{} is not an audit journal".format(path))
+            return
+        for (offset, event) in scan(f):
+            if event is None:
+                logging.warning("{}: damaged record at byte {}, the rest of the file is skipped".format(path, offset))
+                return
+            yield event
+
+
+# Sorts journal files so that every journal comes after its older rotated files (.3, .2, .1, then the journal).
+def in_order(paths):
+    def key(path):
+        (base, extension) = os.path.splitext(path)
+        if extension[1:].isdigit():
+            return (base, -int(extension[1:]))
+        return (path, 0)
+    return sorted(paths, key=key)
+
+
+# Reads the records of several journal files, oldest file first.
+def read(paths):
+    for path in in_order(paths):
+        for event in read_file(path):
+            yield event
+
+
+class AuditJournal:
+    # "on_error(error)" is called when an event cannot be recorded, e.g. to count it in the metrics.
+    def __init__(self, path, max_bytes=1024 * 1024, backup_count=20, sync_interval=1.0, max_pending=10000,
+                 on_error=None):
+        self.path = path
+        self.on_error = on_error
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.sync_interval = sync_interval
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = []
+        self.file = None
+        self.size = 0
+        self.written = 0
+        self.syncs = 0
+        self.dropped = 0
+        self.errors = 0
+        self.rotations = 0
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    # Adds an event (TAP, GRANT, DENY, END or ERROR) at the machine "resource_id". It is on the SD card within
+    # "sync_interval" seconds. When the SD card cannot keep up, the oldest waiting events are dropped. An event that
+    # cannot be written is logged, counted and passed to on_error.
+    def record(self, event, resource_id, uid=None, user_id=None, duration=None, detail=""):
+        try:
+            data = pack(time.time(), event, resource_id, uid, user_id, duration, detail)
+        except Exception as e:
+            self.errors += 1
+            logging.exception("The {} event of {} could not be recorded".format(event, resource_id))
+            if self.on_error is not None:
+                self.on_error(e)
+            return
+        with self.lock:
+            if len(self.pending) >= self.max_pending:
+                del self.pending[0]
+                self.dropped += 1
+            self.pending.append(data)
+        self.wakeup.set()
+
+    def report(self):
+        with self.lock:
+            return "Audit journal: %d events written, %d waiting, %d fsyncs, %d rotations, %d dropped, %d errors" % (
+                self.written, len(self.pending), self.syncs, self.rotations, self.dropped, self.errors)
+
+    # Opens the journal to add records. A journal of another version is rotated away instead of being added to, and a
+    # record cut at the end of the journal is removed.
+    def open(self):
+        self.file = open(self.path, "ab")
+        self.size = self.file.tell()
+        if self.size > 0:
+            with open(self.path, "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    self.rotate()
+                    return
+                end = len(MAGIC)
+                for (offset, event) in scan(f):
+                    end = offset
+            if end < self.size:
+                logging.warning("{}: damaged record at byte {}, the rest of the file ({} bytes) is removed".format(
+                    self.path, end, self.size - end))
+                self.file.truncate(end)
+                self.size = end
+        if self.size == 0:
+            self.file.write(MAGIC)
+            self.size = len(MAGIC)
+
+    # Renames the journal to .1 (and the older files to .2, .3, ...), dropping the oldest, and starts a new one.
+    def rotate(self):
+        self.file.close()
+        self.file = None
+        for i in range(self.backup_count - 1, 0, -1):
+            older = "%s.%d" % (self.path, i)
+            if os.path.exists(older):
+                os.replace(older, "%s.%d" % (self.path, i + 1))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+        self.open()
+
+    # Writes the waiting events, with one fsync per file. Runs in the thread. When the events cannot be written, the
+    # ones that were not written yet are put back in front of the waiting events, and the exception is raised.
+    def flush(self):
+        with self.lock:
+            batch = self.pending
+            self.pending = []
+        if not batch:
+            return
+        written = 0
+        try:
+            if self.file is None:
+                self.open()
+            records = []
+            for data in batch:
+                if self.size >= self.max_bytes:
+                    self.write(records)
+                    written += len(records)
+                    records = []
+                    self.rotate()
+                records.append(data)
+                self.size += len(data)
+            self.write(records)
+        except Exception:
+            with self.lock:
+                self.pending = batch[written:] + self.pending
+                if len(self.pending) > self.max_pending:
+                    self.dropped += len(self.pending) - self.max_pending
+                    del self.pending[:len(self.pending) - self.max_pending]
+            raise
+
+    def write(self, records):
+        if not records:
+            return
+        self.file.write(b"".join(records))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.written += len(records)
+        self.syncs += 1
+
+    # Starts the thread that writes the events.
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="AuditJournal")
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Writes the events that are still waiting, and stops the thread.
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(5)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait()
+            self.wakeup.clear()
+            # The events that come in the next "sync_interval" seconds are written with this one.
+            self.stopped.wait(self.sync_interval)
+            self.write_pending()
+        self.write_pending()
+
+    # Writes the waiting events. When they cannot be written, the error is logged, counted and passed to on_error, and
+    # the journal is closed, to be opened again for the next events.
+    def write_pending(self):
+        try:
+            self.flush()
+        except Exception as e:
+            self.errors += 1
+            logging.exception("The audit journal could not be written")
+            if self.file is not None:
+                try:
+                    self.file.close()
+                except OSError:
+                    pass
+                self.file = None
+            if self.on_error is not None:
+                self.on_error(e)
+
+
+# Parses a date such as "2026-10-11" or "2026-10-11 14:30" in the time of the computer.
+def parse_date(text):
+    for date_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(text, date_format))
+        except ValueError:
+            pass
+    raise ValueError("Not a date: {!r}".format(text))
+
+
+# Returns the events of "events" that match every filter that is not None.
+def matching(events, uid=None, user_id=None, resource_id=None, since=None, until=None, kinds=None):
+    for event in events:
+        if uid is not None and event["uid"] != uid:
+            continue
+        if user_id is not None and event["user_id"] != user_id:
+            continue
+        if resource_id is not None and event["resource_id"] != resource_id:
+            continue
+        if since is not None and event["time"] < since:
+            continue
+        if until is not None and event["time"] >= until:
+            continue
+        if kinds is not None and event["event"] not in kinds:
+            continue
+        yield event
+
+
+def describe(event):
+    text = "%s  %-5s  %-6s  UID %-11s  BookedId %-6s" % (
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event["time"])), event["event"], event["resource_id"],
+        event["uid"] if event["uid"] is not None else "-", event["user_id"] if event["user_id"] is not None else "-")
+    if event["duration"] is not None:
+        text += "  %6.1f min" % (event["duration"] / 60)
+    if event["detail"]:
+        text += "  " + event["detail"]
+    return text
+
+
+# Counts the events of every group ("user", "uid", "resource" or "day"), and adds up the durations of the sessions.
+def summarize(events, by):
+    groups = {}
+    for event in events:
+        if by == "day":
+            key = time.strftime("%Y-%m-%d", time.localtime(event["time"]))
+        else:
+            key = {"user": event["user_id"], "uid": event["uid"], "resource": event["resource_id"]}[by]
+        counts = groups.setdefault(key, dict((kind, 0) for kind in EVENTS + ["minutes"]))
+        counts[event["event"]] += 1
+        if event["duration"] is not None:
+            counts["minutes"] += event["duration"] / 60
+    return groups
+
+
+def benchmark(runs=20000):
+    import glob
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), "AuditJournal.bin")
+    journal = AuditJournal(path, max_bytes=256 * 1024, backup_count=3, sync_interval=0.2)
+    journal.start()
+    recorded = 0.0
+    for i in range(runs):
+        start = time.perf_counter()
+        journal.record(EVENTS[i % len(EVENTS)], "267", uid=1734516868 + i % 50, user_id=1000 + i % 50,
+                       duration=600.0 if i % 5 == 3 else None, detail="student" if i % 5 == 1 else "")
+        recorded += time.perf_counter() - start
+        if i % 1000 == 999:
+            time.sleep(0.05)    # 1000 taps every 50 ms.
+    journal.stop()
+    paths = glob.glob(path + "*")
+    size = sum(os.path.getsize(journal_path) for journal_path in paths)
+    kept = sum(1 for event in read(paths))
+    print ("record: %.1f us per event, %d events written with %d fsyncs, %d dropped" % (
+        recorded / runs * 1e6, journal.written, journal.syncs, journal.dropped))
+    print ("%.0f bytes per event, %d rotations, the last %d events kept in %d files" % (
+        size / kept, journal.rotations, kept, len(paths)))
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Reads audit journals (with their rotated files).")
+    parser.add_argument("files", nargs="*", help="journal files, e.g. AuditJournal.bin*")
+    parser.add_argument("--uid", type=int, help="UID of the tag, as an integer")
+    parser.add_argument("--user", type=int, help="Booked ID of the user")
+    parser.add_argument("--resource", help="resource id of the machine")
+    parser.add_argument("--since", type=parse_date, help="from this date (YYYY-MM-DD [HH:MM])")
+    parser.add_argument("--until", type=parse_date, help="until this date, not included")
+    parser.add_argument("--event", help="kinds of events, separated by commas: " + ",".join(EVENTS))
+    parser.add_argument("--by", choices=["user", "uid", "resource", "day"], help="count the events by group")
+    parser.add_argument("--benchmark", action="store_true", help="measure the journal, with a temporary file")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+        sys.exit(0)
+    if not args.files:
+        parser.error("no journal file given")
+    kinds = None if args.event is None else set(args.event.split(","))
+    events = matching(read(args.files), uid=args.uid, user_id=args.user, resource_id=args.resource, since=args.since,
+                      until=args.until, kinds=kinds)
+    if args.by is None:
+        for event in events:
+            print (describe(event))
+    else:
+        groups = summarize(events, args.by)
+        print ("%-12s %6s %6s %6s %6s %6s %9s" % tuple([args.by] + EVENTS + ["minutes"]))
+        for (key, counts) in sorted(groups.items(), key=lambda item: str(item[0])):
+            print ("%-12s %6d %6d %6d %6d %6d %9.1f" % tuple([key] + [counts[kind] for kind in EVENTS] + [counts["minutes"]]))
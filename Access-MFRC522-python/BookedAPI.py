@@ -0,0 +1,281 @@
+# Talks to the Booked API for every script of the project.
+#
+# BookedClient has a method for every call the project makes (users, reservations, check in and out). It keeps its
+# connections to Booked open between calls, gives up on a call after a timeout instead of waiting forever, and makes a
+# call again a few times, after a short random delay, when Booked cannot be reached or is overloaded. It also keeps
+# the number of calls and their time for every kind of call (report).
+#
+# Booked gives a session token at every authentication, which has to be sent in the headers of every other call,
+# and which expires after a while (30 minutes by default). Instead of authenticating before every call, the
+# TokenManager authenticates once and keeps the token until shortly before it expires. When its thread is started
+# (start), it gets a new token "refresh_margin" seconds before the token expires, so a call never waits for the
+# authentication. If Booked still answers 401 (e.g. Booked was restarted), the token is dropped and the call is made
+# once more with a new token. When the authentication fails, the calls raise AuthenticationError right away for
+# "retry_delay" seconds instead of each waiting for Booked again, so that a tap is decided offline without delay.
+#
+# The file has to be next to the script using it, with ReservationIndex.py. Scripts in other folders add the folder of
+# this file to sys.path.
+
+import json
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import ReservationIndex
+
+BOOKED_URL = "http://YOUR_BOOKED_DOMAIN/Web/Services/index.php"
+
+
+# Returns the number of seconds from now until a date given by Booked (e.g. "2019-08-04T10:30:00-0700"), or None when
+# the date cannot be read. A date without a time zone is taken in the time of the computer (see ReservationIndex.py).
+def seconds_until(text):
+    try:
+        return (ReservationIndex.parse_booked_time(text) - ReservationIndex.current_time()).total_seconds()
+    except (AttributeError, ValueError):
+        return None
+
+
+# Raised when no session token could be had from Booked: Booked cannot be reached, or refused the authentication. It
+# is a ConnectionError, so that the callers handle it like Booked being down.
+class AuthenticationError(requests.exceptions.ConnectionError):
+    pass
+
+
+# Raised when Booked answers with a server error (5xx) to a call that returns data, after all the tries. It is a
+# ConnectionError too: Booked cannot answer now, and the callers handle it like Booked being down.
+class ServerError(requests.exceptions.ConnectionError):
+    pass
+
+
+class TokenManager:
+    # "username" and "password" are those of a Booked user with admin access. A token is kept at most "lifetime"
+    # seconds, or until the expiry date given by Booked if that comes first. The calls are made with "session" (a
+    # requests.Session), or with new connections every time when there is none, and time out after "timeout" seconds
+    # (see BookedClient). After a failed authentication, the next one is tried after "retry_delay" seconds.
+    def __init__(self, username, password, url=BOOKED_URL, lifetime=1800, refresh_margin=300, session=None,
+                 timeout=(3, 5), retry_delay=10):
+        self.http = requests if session is None else session
+        self.username = username
+        self.password = password
+        self.url = url
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.token_headers = None
+        self.usable_until = 0.0   # time.monotonic() until which the token is used, a minute before it expires.
+        self.refresh_at = 0.0     # time.monotonic() at which the thread gets a new token.
+        self.failed_until = 0.0   # time.monotonic() until which the calls fail without authenticating again.
+        self.authentications = 0
+        self.renew_lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    # Authenticates with Booked and keeps the new token. Returns the headers to send with the other calls. Raises
+    # AuthenticationError when Booked cannot be reached or does not give a token.
+    def authenticate(self):
+        arguments = {"username": self.username, "password": self.password}
+        try:
+            authenticate_response = self.http.post(self.url + "/Authentication/Authenticate", data=json.dumps(arguments),
+                                                   timeout=self.timeout)
+            if authenticate_response.status_code // 100 != 2:
+                raise AuthenticationError("Booked answered %d to the authentication" % authenticate_response.status_code)
+            authenticate_response_json = authenticate_response.json()
+            headers = {"X-Booked-SessionToken": authenticate_response_json["sessionToken"],
+                       "X-Booked-UserId": authenticate_response_json["userId"]}
+            if not headers["X-Booked-SessionToken"]:
+                raise AuthenticationError("Booked refused the authentication")
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+            self.failed_until = time.monotonic() + self.retry_delay
+            if isinstance(e, AuthenticationError):
+                raise
+            raise AuthenticationError("Booked authentication failed: {}".format(e))
+        lifetime = seconds_until(authenticate_response_json.get("sessionExpires"))
+        # Dates in the past or too far away come from a clock that is not on time; the usual lifetime is used instead.
+        if lifetime is None or lifetime <= 0 or lifetime > self.lifetime:
+            lifetime = self.lifetime
+        now = time.monotonic()
+        self.usable_until = now + lifetime - min(60, lifetime / 2)
+        self.refresh_at = now + max(lifetime - self.refresh_margin, lifetime / 2)
+        self.token_headers = headers
+        self.failed_until = 0.0
+        self.authentications += 1
+        return headers
+
+    # Returns the headers with the current token. A new token is only asked for when there is none yet, or when the
+    # current one expires within a minute (which only happens when the thread is not started, or Booked was down).
+    # Raises AuthenticationError without waiting when the last authentication failed less than "retry_delay" ago.
+    def headers(self):
+        headers = self.token_headers
+        if headers is not None and time.monotonic() < self.usable_until:
+            return headers
+        self.check_failed()
+        with self.renew_lock:
+            if self.token_headers is None or time.monotonic() >= self.usable_until:
+                # Another call may have failed to authenticate while this one waited for the lock.
+                self.check_failed()
+                self.authenticate()
+            return self.token_headers
+
+    def check_failed(self):
+        if time.monotonic() < self.failed_until:
+            raise AuthenticationError("Booked authentication failed less than %d seconds ago" % self.retry_delay)
+
+    # Drops the token if it is still the one of "headers", so that the next call authenticates again.
+    def invalidate(self, headers):
+        with self.renew_lock:
+            if self.token_headers is headers:
+                self.token_headers = None
+
+    # Makes a call to Booked with the current token, like requests.request. If Booked answers 401, the call is made
+    # once more with a new token.
+    def request(self, method, url, **kwargs):
+        headers = self.headers()
+        response = self.http.request(method, url, headers=headers, **kwargs)
+        if response.status_code == 401:
+            logging.info("Booked refused the session token, authenticating again.")
+            self.invalidate(headers)
+            response = self.http.request(method, url, headers=self.headers(), **kwargs)
+        return response
+
+    # Starts the thread that gets a new token before the current one expires. When Booked cannot be reached, it tries
+    # again every 10 seconds.
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="TokenManager")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            delay = self.refresh_at - time.monotonic()
+            if self.token_headers is None or delay <= 0:
+                try:
+                    with self.renew_lock:
+                        self.authenticate()
+                    continue
+                except AuthenticationError as e:
+                    logging.info("{}, trying again in {} seconds.".format(e, self.retry_delay))
+                    delay = self.retry_delay
+            self.stopped.wait(delay)
+
+
+class BookedClient:
+    # "timeout" is the time to wait for Booked to accept the connection and to answer, in seconds, as (connect, read).
+    # A call that fails because Booked cannot be reached, does not answer in time or answers 502, 503 or 504 is made
+    # again up to "retries" times, after about "backoff", 2 * "backoff", ... seconds. All the calls of the project can
+    # safely be made twice. "pool_size" is the number of connections kept open. It should be at least the number of
+    # threads that can make calls at the same time: beyond it, the connections are closed after the call, and the
+    # next calls connect again.
+    def __init__(self, username, password, url=BOOKED_URL, timeout=(3, 5), retries=2, backoff=0.25, pool_size=4):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.token = TokenManager(username, password, url, session=self.session, timeout=timeout)
+        self.stats_lock = threading.Lock()
+        self.stats = {}     # The statistics of every kind of call, as [calls, failures, total seconds, longest call].
+
+    # Starts the thread that renews the session token (see TokenManager).
+    def start(self):
+        self.token.start()
+
+    # Makes a call to Booked and returns the response. "endpoint" names the kind of call in the statistics. "body" is
+    # sent as JSON. Raises requests.exceptions.ConnectionError or Timeout when all the tries failed, and
+    # AuthenticationError (a ConnectionError) at once when there is no session token.
+    def call(self, method, path, endpoint, params=None, body=None, timeout=None):
+        data = None if body is None else json.dumps(body)
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                response = self.token.request(method, self.url + path, params=params, data=data,
+                                              timeout=self.timeout if timeout is None else timeout)
+                failed = response.status_code in (502, 503, 504)
+                error = None
+            except AuthenticationError:
+                self.record(endpoint, time.monotonic() - start, True)
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                failed = True
+                error = e
+            self.record(endpoint, time.monotonic() - start, failed)
+            if not failed:
+                return response
+            if attempt >= self.retries:
+                if error is not None:
+                    raise error
+                return response
+            time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+            attempt += 1
+
+    def record(self, endpoint, seconds, failed):
+        with self.stats_lock:
+            stats = self.stats.setdefault(endpoint, [0, 0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += 1 if failed else 0
+            stats[2] += seconds
+            stats[3] = max(stats[3], seconds)
+
+    # Returns the statistics of the calls, one line per kind of call.
+    def report(self):
+        with self.stats_lock:
+            lines = ["%-16s %6d calls %4d failed  mean %6.0f ms  max %6.0f ms" %
+                     (endpoint, stats[0], stats[1], stats[2] / stats[0] * 1000, stats[3] * 1000)
+                     for (endpoint, stats) in sorted(self.stats.items())]
+        return "\n".join(["Booked: %d authentications" % self.token.authentications] + lines)
+
+    # Returns the JSON of an answer of Booked. Raises ServerError when Booked answered with a server error.
+    def result(self, response):
+        if response.status_code >= 500:
+            raise ServerError("Booked answered %d" % response.status_code, response=response)
+        return response.json()
+
+    # Returns the information of a user, or an empty dictionary when the user does not exist.
+    def get_user(self, user_id):
+        return self.result(self.call("GET", "/Users/%s" % user_id, "GET Users"))
+
+    # Returns the UID of a user (the first custom attribute), or False when the user has none.
+    def get_user_uid(self, user_id):
+        user = self.get_user(user_id)
+        try:
+            return int(user["customAttributes"][0]["value"])
+        except (KeyError, IndexError, TypeError, ValueError):
+            return False
+
+    # Updates a user with the fields of "info" (see the Booked API for the fields).
+    def update_user(self, user_id, info):
+        return self.call("POST", "/Users/%s" % user_id, "POST Users", body=info)
+
+    def delete_user(self, user_id):
+        return self.call("DELETE", "/Users/%s" % user_id, "DELETE Users")
+
+    # Returns the reservations of a user and/or a machine (resource), between two datetimes when given (with their
+    # time zone, when they have one).
+    def get_reservations(self, user_id=None, resource_id=None, start=None, end=None, timeout=None):
+        params = {}
+        if user_id is not None:
+            params["userId"] = user_id
+        if resource_id is not None:
+            params["resourceId"] = resource_id
+        if start is not None:
+            params["startDateTime"] = start.strftime("%Y-%m-%dT%H:%M:%S%z")
+        if end is not None:
+            params["endDateTime"] = end.strftime("%Y-%m-%dT%H:%M:%S%z")
+        return self.result(self.call("GET", "/Reservations/", "GET Reservations", params=params, timeout=timeout))["reservations"]
+
+    def check_in(self, reference_number):
+        return self.call("POST", "/Reservations/%s/CheckIn" % reference_number, "POST CheckIn")
+
+    def check_out(self, reference_number):
+        return self.call("POST", "/Reservations/%s/CheckOut" % reference_number, "POST CheckOut")
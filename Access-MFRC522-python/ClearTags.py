@@ -1,7 +1,7 @@
 # Created by Ricardo Rivera
 # Last Edit: Ricardo Rivera, June 24th 2019
 
-import RPi.GPIO as GPIO
+from MFRC522Transport import GPIO
 import MFRC522
 import signal
 
@@ -29,8 +29,8 @@ while continue_reading:
         if status == MIFAREReader.MI_OK:
             print ("Card detected")
 
-        # Get the UID of the card
-        (status, uid) = MIFAREReader.MFRC522_Anticoll()
+        # Get the UID of the card, and select it
+        (status, uid, sak) = MIFAREReader.MFRC522_AnticollSelect()
 
         # If we have the UID, continue
         if status == MIFAREReader.MI_OK:
@@ -38,9 +38,6 @@ while continue_reading:
             # This is the default key for authentication
             key = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
 
-            # Select the scanned tag
-            MIFAREReader.MFRC522_SelectTag(uid)
-
             # Authenticate
             status = MIFAREReader.MFRC522_Auth(MIFAREReader.PICC_AUTHENT1A, 8, key, uid)
             print ("\n")
@@ -53,14 +50,17 @@ while continue_reading:
 
                 print ("Sector 8 looked like this:")
                 # Read block 8
-                MIFAREReader.MFRC522_Read(8)
+                print (MIFAREReader.MFRC522_Read(8))
                 print ("\n")
 
-                MIFAREReader.MFRC522_Write(8, data)
+                if MIFAREReader.MFRC522_Write(8, data) == MIFAREReader.MI_OK:
+                    print ("Data written")
+                else:
+                    print ("Error while writing")
 
                 print ("It now looks like this:")
                 # Check to see if it was written
-                MIFAREReader.MFRC522_Read(8)
+                print (MIFAREReader.MFRC522_Read(8))
                 print ("\n")
 
                 # Stop
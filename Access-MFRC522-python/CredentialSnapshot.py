@@ -0,0 +1,169 @@
+# Keeps on the SD card what a machine needs to decide on a tag without Booked: the UID of every user with a reservation
+# on the machine, and the reservations of the next hours (see ReservationCache.py). When the wi-fi or Booked is down,
+# the tags are checked with the last snapshot, as long as it is not older than the limit given to the cache, and also
+# right after the Pi restarts, before Booked could be reached.
+#
+# A snapshot is written to a temporary file, which then replaces the previous snapshot in one step (os.replace), so
+# a snapshot is never half written, even if the Pi loses power. Every snapshot has a version number, one more than the
+# previous one, and the time it was synced with Booked.
+#
+# The decisions made without Booked are written in a separate file (OfflineDecisions), and checked with Booked once it
+# can be reached again. The result of the check is written in the log file.
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+# Writes "data" as JSON in "path", replacing the previous file only once the new one is completely on the disk.
+def write_atomically(path, data):
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+class CredentialSnapshot:
+    def __init__(self, path):
+        self.path = path
+        self.version = 0
+        self.synced_at = None   # The time.time() at which the data of the snapshot came from Booked.
+        self.saved_at = None    # The time.monotonic() at which the snapshot was last written.
+
+    # Writes a snapshot of "reservations" (as given by Booked) and "user_uids" (a dictionary of the UID of every user,
+    # or False), synced with Booked at "synced_at" (a time.time() value).
+    def save(self, resource_id, reservations, user_uids, synced_at):
+        data = {"version": self.version + 1, "resource_id": str(resource_id), "synced_at": synced_at,
+                "reservations": reservations,
+                "user_uids": dict((str(user_id), uid) for (user_id, uid) in user_uids.items())}
+        write_atomically(self.path, data)
+        self.version = data["version"]
+        self.synced_at = synced_at
+        self.saved_at = time.monotonic()
+
+    # Reads the snapshot, and returns (reservations, user_uids, synced_at), or None when there is no snapshot of the
+    # machine. A snapshot that cannot be read is ignored.
+    def load(self, resource_id):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data["resource_id"] != str(resource_id):
+                return None
+            user_uids = dict((int(user_id), uid) for (user_id, uid) in data["user_uids"].items())
+            result = (data["reservations"], user_uids, float(data["synced_at"]))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logging.info("The snapshot {} could not be read: {}".format(self.path, e))
+            return None
+        self.version = int(data.get("version", 0))
+        self.synced_at = result[2]
+        return result
+
+
+class OfflineDecisions:
+    # "check(decision)" asks Booked whether the user of a decision should have been allowed, and returns True or False.
+    # It is called from the thread of the journal, and raises one of the "unreachable" exceptions while Booked cannot
+    # be reached. The decisions that were not checked yet are tried again every "check_interval" seconds. A decision
+    # whose check raises any other exception can never be checked, so it is logged and dropped.
+    def __init__(self, path, check, check_interval=60, unreachable=(ConnectionError, TimeoutError)):
+        self.path = path
+        self.check = check
+        self.check_interval = check_interval
+        self.unreachable = unreachable
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    # Adds a decision (a dictionary with "time", "resource_id", "uid", "user_id" and "granted") to the journal.
+    def record(self, decision):
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(decision) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    # Returns the decisions that were not checked yet.
+    def pending(self):
+        return self.read()[0]
+
+    # Returns the decisions of the journal, and the number of lines it had.
+    def read(self):
+        with self.lock:
+            try:
+                with open(self.path) as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                return ([], 0)
+        decisions = []
+        for line in lines:
+            try:
+                decisions.append(json.loads(line))
+            except ValueError:
+                pass    # A line cut by a power loss.
+        return (decisions, len(lines))
+
+    # Checks the pending decisions with Booked, logs the result of each, and keeps the ones that could not be checked.
+    # Returns the number of decisions that were checked or dropped.
+    def reconcile(self):
+        (decisions, lines) = self.read()
+        left = []
+        for decision in decisions:
+            if left:
+                left.append(decision)
+                continue
+            try:
+                allowed = self.check(decision)
+            except self.unreachable:
+                left.append(decision)   # Booked is still down, the other decisions wait too.
+                continue
+            except Exception:
+                logging.exception("The offline decision {} could not be checked and is dropped".format(decision))
+                continue
+            when = time.strftime("%d/%m/%Y %H:%M:%S", time.localtime(decision["time"]))
+            if allowed == decision["granted"]:
+                logging.info("Offline decision of {} for BookedId {} on {} confirmed by Booked".format(
+                    when, decision["user_id"], decision["resource_id"]))
+            else:
+                logging.info("Offline decision of {} for BookedId {} on {} does not match Booked: the user was {}, Booked "
+                             "would have {}".format(when, decision["user_id"], decision["resource_id"],
+                                                    "allowed" if decision["granted"] else "refused",
+                                                    "allowed them" if allowed else "refused them"))
+        with self.lock:
+            # Decisions recorded while checking are kept too.
+            try:
+                with open(self.path) as f:
+                    added = f.readlines()[lines:]
+            except FileNotFoundError:
+                added = []
+            temporary = self.path + ".tmp"
+            with open(temporary, "w") as f:
+                for decision in left:
+                    f.write(json.dumps(decision) + "\n")
+                f.writelines(added)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.path)
+        return len(decisions) - len(left)
+
+    # Starts the thread that checks the decisions.
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="OfflineDecisions")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                try:
+                    self.reconcile()
+                except Exception:
+                    logging.exception("The offline decisions could not be checked")
+            self.stopped.wait(self.check_interval)
@@ -0,0 +1,236 @@
+# Decides who the user of a tag is: an admin, a student with a reservation on the machine right now, a student without
+# one, or an unknown tag.
+#
+# The admin table is in memory, so it is checked first, and an admin tag never waits for Booked. For the other tags, the
+# UID of the user and their reservations on the machine are needed. While the reservation cache of the machine is up to
+# date, both come from it, and Booked is only asked for the UID of the users the cache does not know. Otherwise the two
+# calls to Booked are made at the same time, in a pool of threads, so a tap waits for the slowest of them instead of
+# both one after the other. When Booked cannot be reached at all, identify_offline decides with the cache alone, which may
+# then be older (see ReservationCache.usable_offline).
+#
+# Users who are refused often tap again and again. The tags that were refused are remembered for a short time (see
+# NegativeCache), so the taps that follow are answered without Booked.
+#
+# Running this file measures the time to identify a tag with a fake Booked server that takes "delay" seconds to answer
+# every call, when the calls are made one after the other and at the same time:
+#   python Identification.py [delay]
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+# Possible identification status
+UNKNOWN = 0
+ADMIN = 1
+CONFIRMED_STUDENT = 2
+REJECTED_STUDENT = 3
+
+
+class NegativeCache:
+    # Remembers the tags that were refused (UNKNOWN or REJECTED_STUDENT) by (UID, Booked ID), for at most "ttl" seconds,
+    # and never after the next reservation of the user starts or ends, or after the reservations of the machine
+    # changed (the generation of the reservation cache). At most "size" tags are kept; when there are more, the one
+    # used the longest ago is dropped.
+    def __init__(self, ttl=60, size=256):
+        self.ttl = ttl
+        self.size = size
+        self.entries = collections.OrderedDict()   # (status, time.monotonic() it expires, generation), by (uid, user id).
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Returns the status remembered for the tag, or None.
+    def get(self, key, generation):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= now or entry[2] != generation:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, status, ttl, generation):
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (status, time.monotonic() + ttl, generation)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def report(self):
+        with self.lock:
+            return "Negative cache: %d tags, %d hits, %d misses" % (len(self.entries), self.hits, self.misses)
+
+
+class Identifier:
+    # "is_admin(uid)" tells whether a UID is the UID of an admin tag. "find_uid(user_id)" returns the UID of a Booked
+    # user, or False. "find_reservations(user_id, resource_id)" returns the reservations of a user on a machine, and
+    # "find_active(reservations, resource_id)" the one of them that can be used on the machine now, or None.
+    # "pool_size" is the number of calls to Booked that can be made at the same time; with 0 they are made one after
+    # the other. A refused tag is remembered "negative_ttl" seconds (see NegativeCache); with 0 it is not.
+    def __init__(self, is_admin, find_uid, find_reservations, find_active, pool_size=4, negative_ttl=60, negative_size=256):
+        self.is_admin = is_admin
+        self.find_uid = find_uid
+        self.find_reservations = find_reservations
+        self.find_active = find_active
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=pool_size) if pool_size > 0 else None
+        self.negative = NegativeCache(negative_ttl, negative_size) if negative_ttl > 0 else None
+
+    # Returns the reservation and the identification of a tag read at the machine of "cache" (see ReservationCache.py).
+    # The reservation is an empty dictionary unless the identification is CONFIRMED_STUDENT. Raises the exception of a
+    # call to Booked that failed.
+    def identify(self, uid_int, user_id_int, cache):
+        if self.is_admin(uid_int):
+            return ({}, ADMIN)
+        if self.negative is None:
+            return self.lookup(uid_int, user_id_int, cache)
+
+        key = (uid_int, user_id_int)
+        generation = cache.generation
+        status = self.negative.get(key, generation)
+        if status is not None:
+            return ({}, status)
+        (reservation, status) = self.lookup(uid_int, user_id_int, cache)
+        if status == UNKNOWN or status == REJECTED_STUDENT:
+            ttl = self.negative.ttl
+            boundary = cache.next_boundary(user_id_int)
+            if boundary is not None:
+                ttl = min(ttl, boundary)
+            self.negative.put(key, status, ttl, generation)
+        return (reservation, status)
+
+    # Identifies a tag that is not an admin tag, with the cache or Booked.
+    def lookup(self, uid_int, user_id_int, cache):
+        if cache.is_fresh():
+            if cache.user_uid(user_id_int) != uid_int and self.find_uid(user_id_int) != uid_int:
+                return ({}, UNKNOWN)
+            reservation = cache.active_reservation(user_id_int)
+        else:
+            if self.pool is None:
+                if self.find_uid(user_id_int) != uid_int:
+                    return ({}, UNKNOWN)
+                reservations = self.find_reservations(user_id_int, cache.resource_id)
+            else:
+                # The reservations are asked for before knowing whether the UID matches, so they are wasted for an
+                # unknown tag, but a student does not wait for two calls in a row.
+                uid_future = self.pool.submit(self.find_uid, user_id_int)
+                reservations_future = self.pool.submit(self.find_reservations, user_id_int, cache.resource_id)
+                if uid_future.result() != uid_int:
+                    reservations_future.cancel()
+                    return ({}, UNKNOWN)
+                reservations = reservations_future.result()
+            reservation = self.find_active(reservations, cache.resource_id)
+
+        if reservation is None:
+            return ({}, REJECTED_STUDENT)
+        return (reservation, CONFIRMED_STUDENT)
+
+    # Identifies a tag with the admin table and the reservation cache only, when Booked cannot be reached. The cache may
+    # be old (see ReservationCache.usable_offline), and a user it does not know is UNKNOWN.
+    def identify_offline(self, uid_int, user_id_int, cache):
+        if self.is_admin(uid_int):
+            return ({}, ADMIN)
+        if cache.user_uid(user_id_int) != uid_int:
+            return ({}, UNKNOWN)
+        reservation = cache.active_reservation(user_id_int)
+        if reservation is None:
+            return ({}, REJECTED_STUDENT)
+        return (reservation, CONFIRMED_STUDENT)
+
+
+# Identifies "runs" times each kind of tag with an Identifier made of "pool_size" threads, and returns the mean time of
+# each, in seconds. The reservation cache is never refreshed, so every tag that is not an admin tag goes to Booked,
+# unless it was refused and "negative_ttl" is not 0.
+def benchmark(url, pool_size, runs=10, negative_ttl=0):
+    import BookedAPI
+    import ReservationCache
+
+    booked = BookedAPI.BookedClient("user", "password", url=url)
+    booked.token.authenticate()
+
+    def find_active(reservations, resource_id):
+        for reservation in reservations:
+            if str(reservation["resourceId"]) == str(resource_id):
+                return reservation
+        return None
+
+    identifier = Identifier(lambda uid: uid == 999, booked.get_user_uid,
+                            lambda user_id, resource_id: booked.get_reservations(user_id=user_id, resource_id=resource_id),
+                            find_active, pool_size=pool_size, negative_ttl=negative_ttl)
+    cache = ReservationCache.ReservationCache("7", None, None)
+    tags = [("admin", 999, 0), ("student with a reservation", 1111, 1), ("student without one", 2222, 2),
+            ("unknown tag", 5555, 5)]
+    times = []
+    for (name, uid, user_id) in tags:
+        start = time.perf_counter()
+        for i in range(runs):
+            identifier.identify(uid, user_id, cache)
+        times.append((name, (time.perf_counter() - start) / runs))
+    return times
+
+
+# A fake Booked server, which knows users 1 and 2, and a reservation of user 1 on machine 7.
+def fake_booked(delay):
+    import json
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, answer):
+            time.sleep(delay)
+            body = json.dumps(answer).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self.reply({"sessionToken": "token", "userId": "1"})
+
+        def do_GET(self):
+            if self.path.startswith("/Users/"):
+                user_id = self.path.split("/")[2]
+                if user_id in ("1", "2"):
+                    return self.reply({"id": int(user_id), "customAttributes": [{"value": user_id * 4}]})
+                return self.reply({})
+            reservations = []
+            if "userId=1" in self.path:
+                reservations = [{"referenceNumber": "ref1", "userId": "1", "resourceId": "7"}]
+            self.reply({"reservations": reservations})
+
+    class Server(socketserver.ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = Server(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return "http://127.0.0.1:%d" % server.server_address[1]
+
+
+if __name__ == "__main__":
+    import sys
+
+    delay = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+    url = fake_booked(delay)
+    sequential = benchmark(url, 0)
+    concurrent_times = benchmark(url, 4)
+    negative = benchmark(url, 4, negative_ttl=60)
+    print ("Booked answers in %.0f ms" % (delay * 1000))
+    print ("tag                          one after the other (ms)  at the same time (ms)  refused tags remembered (ms)")
+    for ((name, before), (name, after), (name, remembered)) in zip(sequential, concurrent_times, negative):
+        print ("%-27s  %24.0f  %21.0f  %28.1f" % (name, before * 1000, after * 1000, remembered * 1000))
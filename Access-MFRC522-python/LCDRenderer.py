@@ -0,0 +1,228 @@
+# Draws the messages of the stations on the LCD from a background thread, writing only the characters that changed.
+#
+# The LCD is behind an I2C expander, and every character written to it is several I2C transfers, so rewriting the whole
+# screen (clear, then 32 characters) takes long enough to delay the polling of the readers. The renderer keeps the frame
+# that should be on the screen (16x2 characters) and the one that is on it. show(), write() and set_color() only change
+# the frame in memory and return right away; the thread then compares the two frames, moves the cursor to each run of
+# characters that changed, and writes that run only. The screen is only cleared when a new message differs so much that
+# clearing it and writing the message is fewer writes, so it flickers less too.
+#
+# Frames are drawn at most every "min_interval" seconds. The updates that come in between (e.g. the two lines of two
+# stations changing at once) are drawn together, and a message that was replaced before it was drawn is never written.
+# report() tells how many LCD writes (characters and cursor moves) were saved compared to rewriting the screen.
+#
+# Running this file plays the messages of a session on a fake LCD, and compares the writes and the time the caller
+# waits with writing the LCD directly:
+#   python LCDRenderer.py [ms per write]
+
+import logging
+import threading
+import time
+
+
+class LCDRenderer:
+    # "lcd" is the Character_LCD_RGB_I2C of the screen, of "columns" x "rows" characters. "on_draw(seconds)" is called
+    # from the thread with the time every frame took to draw.
+    def __init__(self, lcd, columns=16, rows=2, min_interval=0.05, on_draw=None):
+        self.lcd = lcd
+        self.on_draw = on_draw
+        self.columns = columns
+        self.rows = rows
+        self.min_interval = min_interval
+        self.frame = [" " * columns] * rows    # The frame that should be on the screen.
+        self.shown = None                       # The frame that is on the screen, None when it is not known.
+        self.color = None
+        self.shown_color = None
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.last_draw = 0.0
+        self.updates = 0
+        self.frames = 0
+        self.writes = 0         # The characters and cursor moves sent to the LCD.
+        self.full_writes = 0    # The ones that clearing and rewriting the screen at every update would have sent.
+        self.thread = None
+        self.stopped = threading.Event()
+
+    # Shows a message of up to "rows" lines on the whole screen.
+    def show(self, message):
+        lines = message.split("\n")[:self.rows]
+        with self.lock:
+            for row in range(self.rows):
+                self.frame[row] = self.pad(lines[row] if row < len(lines) else "")
+            self.updates += 1
+            self.full_writes += 1 + len(message)
+        self.changed.set()
+
+    # Writes "text" on one line of the screen, leaving the other lines as they are.
+    def write(self, row, text):
+        with self.lock:
+            self.frame[row] = self.pad(text)
+            self.updates += 1
+            self.full_writes += 1 + self.columns
+        self.changed.set()
+
+    # Sets the color of the backlight, as [red, green, blue].
+    def set_color(self, color):
+        with self.lock:
+            self.color = list(color)
+        self.changed.set()
+
+    def pad(self, text):
+        return text[:self.columns].ljust(self.columns)
+
+    # Returns the runs of characters of "new" that differ from "old", as (column, text). Runs separated by a single
+    # unchanged character are joined, as writing it costs the same as moving the cursor over it.
+    def changes(self, old, new):
+        runs = []
+        column = 0
+        while column < self.columns:
+            if old[column] == new[column]:
+                column += 1
+                continue
+            start = column
+            end = column + 1
+            while end < self.columns and (old[end] != new[end] or (end + 1 < self.columns and old[end + 1] != new[end + 1])):
+                end += 1
+            runs.append((start, new[start:end]))
+            column = end
+        return runs
+
+    # Draws the frame on the screen. Runs in the thread.
+    def draw(self):
+        started = time.monotonic()
+        with self.lock:
+            self.changed.clear()
+            frame = list(self.frame)
+            color = self.color
+        if color is not None and color != self.shown_color:
+            self.lcd.color = color
+            self.shown_color = color
+        runs = []
+        if self.shown is not None:
+            for row in range(self.rows):
+                runs += [(column, row, text) for (column, text) in self.changes(self.shown[row], frame[row])]
+        # A new message often differs everywhere. Clearing the screen and writing the message without its trailing
+        # spaces is then fewer writes than writing the changes. The message then starts at (0, 0), where the LCD puts
+        # the cursor back after every message.
+        message = "\n".join(line.rstrip() for line in frame).rstrip("\n")
+        if self.shown is None or 1 + len(message) < sum(1 + len(text) for (column, row, text) in runs):
+            self.lcd.clear()
+            self.writes += 1 + len(message)
+            if message:
+                self.lcd.message = message
+            runs = []
+        for (column, row, text) in runs:
+            self.lcd.cursor_position(column, row)
+            self.lcd.message = text
+            self.writes += 1 + len(text)
+        self.shown = frame
+        self.frames += 1
+        self.last_draw = time.monotonic()
+        if self.on_draw is not None:
+            self.on_draw(self.last_draw - started)
+
+    def report(self):
+        with self.lock:
+            return "LCD: %d updates, %d frames drawn, %d writes instead of %d (%d saved)" % (
+                self.updates, self.frames, self.writes, self.full_writes, self.full_writes - self.writes)
+
+    # Starts the thread that draws the frames.
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="LCDRenderer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.changed.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.changed.wait()
+            if self.stopped.is_set():
+                break
+            # The updates that come before the next frame is due are drawn with it.
+            self.stopped.wait(max(self.last_draw + self.min_interval - time.monotonic(), 0))
+            try:
+                self.draw()
+            except OSError:
+                # The I2C bus failed; the whole screen is drawn again with the next frame.
+                logging.exception("The LCD could not be written")
+                self.shown = None
+                self.shown_color = None
+                self.last_draw = time.monotonic()
+
+
+# An LCD that takes "delay" seconds for every character or cursor move, and counts them.
+class FakeLCD:
+    def __init__(self, delay):
+        self.delay = delay
+        self.writes = 0
+        self.color = None
+
+    def clear(self):
+        self.writes += 1
+        time.sleep(self.delay)
+
+    def cursor_position(self, column, row):
+        self.writes += 1
+        time.sleep(self.delay)
+
+    @property
+    def message(self):
+        return None
+
+    @message.setter
+    def message(self, text):
+        self.writes += len(text)
+        time.sleep(self.delay * len(text))
+
+
+if __name__ == "__main__":
+    import sys
+
+    delay = (float(sys.argv[1]) if len(sys.argv) > 1 else 1.0) / 1000
+    # A tag refused, a session with the tag taken away and put back, and the end of the session; then two stations
+    # sharing the screen, one line each.
+    messages = ["Ready\nInsert Tag", "No Reservations\nFound", "Ready\nInsert Tag", "Authenticated\nDon't Remove Tag"]
+    messages += ["Ending Session\nIn 60s", "Continue?\nReinsert Tag"] * 4
+    messages += ["Authenticated\nDon't Remove Tag", "Ending Session\nIn 60s", "Ready\nInsert Tag"]
+    lines = [(0, "267 Ready"), (1, "268 Ready"), (0, "267 Authenticated"), (1, "268 No Reservati"), (1, "268 Ready")]
+
+    direct = FakeLCD(delay)
+    start = time.perf_counter()
+    for message in messages:
+        direct.clear()
+        direct.message = message
+    for (row, text) in lines:
+        direct.cursor_position(0, row)
+        direct.message = text[:16].ljust(16)
+    direct_time = time.perf_counter() - start
+
+    fake = FakeLCD(delay)
+    renderer = LCDRenderer(fake, min_interval=0.0)
+    renderer.start()
+    waited = 0.0
+    for message in messages:
+        start = time.perf_counter()
+        renderer.show(message)
+        waited += time.perf_counter() - start
+        time.sleep(0.1)
+    for (row, text) in lines:
+        start = time.perf_counter()
+        renderer.write(row, text)
+        waited += time.perf_counter() - start
+        time.sleep(0.1)
+    print ("%d updates, %.1f ms per LCD write" % (len(messages) + len(lines), delay * 1000))
+    print ("written directly:  %4d writes, caller waited %7.2f ms" % (direct.writes, direct_time * 1000))
+    print ("with the renderer: %4d writes, caller waited %7.2f ms" % (fake.writes, waited * 1000))
+
+    # A burst of updates is drawn as one frame.
+    renderer.min_interval = 0.05
+    frames = renderer.frames
+    time.sleep(0.1)
+    for i in range(20):
+        renderer.show("Burst\n%d" % i)
+    time.sleep(0.3)
+    print ("20 updates in a burst drawn in %d frame(s), screen shows %r" % (renderer.frames - frames, renderer.shown))
+    print (renderer.report())
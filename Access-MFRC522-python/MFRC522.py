@@ -24,12 +24,128 @@
 #    along with MFRC522-Python.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import RPi.GPIO as GPIO
-import spi
+import logging
+import MFRC522Transport
+import os
 import signal
+import threading
 import time
 
 
+# Lookup table for the CRC_A of ISO 14443-3 (polynomial x^16 + x^12 + x^5 + 1). The
+# bytes are sent least significant bit first, so the table uses the reflected
+# polynomial 0x8408.
+def build_crc_a_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for bit in range(8):
+            if crc & 0x0001:
+                crc = (crc >> 1) ^ 0x8408
+            else:
+                crc = crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC_A_TABLE = build_crc_a_table()
+
+
+# Calculates the CRC_A of a frame on the Pi. Returns [low byte, high byte], which is
+# the order in which the CRC is appended to the frame.
+def crc_a(data):
+    crc = 0x6363
+    for byte in data:
+        crc = (crc >> 8) ^ CRC_A_TABLE[(crc ^ byte) & 0xFF]
+    return [crc & 0xFF, crc >> 8]
+
+
+logger = logging.getLogger("MFRC522")
+
+
+# Splits a UID (4, 7 or 10 bytes) into the 5 bytes sent at each cascade level: the
+# cascade tag 0x88 and 3 UID bytes at every level but the last one, which gets the last
+# 4 bytes, each followed by the BCC. A list of 5 bytes is taken as a 4 byte UID followed
+# by its BCC, as returned by MFRC522_Anticoll.
+def uid_cascade(uid):
+    uid = list(uid)
+    if len(uid) == 5:
+        uid = uid[0:4]
+    parts = []
+    while len(uid) > 4:
+        parts.append([0x88] + uid[0:3])
+        uid = uid[3:]
+    parts.append(uid)
+    return [part + [part[0] ^ part[1] ^ part[2] ^ part[3]] for part in parts]
+
+
+# Converts a UID into the integer kept in the UID column of the tables. The scripts have
+# always used the 5 bytes returned by MFRC522_Anticoll, so the BCC is appended to 4 byte
+# UIDs and the tags registered before keep the same number.
+def uid_to_int(uid):
+    uid = list(uid)
+    if len(uid) == 4:
+        uid = uid + [uid[0] ^ uid[1] ^ uid[2] ^ uid[3]]
+    return int(''.join(str(e) for e in uid))
+
+
+# Sorts a value in a histogram of powers of two: bucket 0 counts the zeros, and bucket
+# i > 0 counts the values from 2**(i-1) to 2**i - 1. The last bucket takes everything
+# bigger.
+def log2_bucket(value, buckets):
+    return min(int(value).bit_length(), buckets - 1)
+
+
+# What the driver records about one command when tracing is enabled (see
+# MFRC522_EnableTrace). The SPI transactions and polls of a command include those of
+# the commands it calls, e.g. an Auth includes its CRC.
+class CommandStats:
+    BUCKETS = 24
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.statuses = {}
+        self.spi_transactions = 0
+        self.polls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        # Latency in microseconds and SPI transactions per command.
+        self.latency_histogram = [0] * self.BUCKETS
+        self.spi_histogram = [0] * self.BUCKETS
+
+    def add(self, status, spi_transactions, polls, elapsed):
+        self.count += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.spi_transactions += spi_transactions
+        self.polls += polls
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        self.latency_histogram[log2_bucket(elapsed * 1e6, self.BUCKETS)] += 1
+        self.spi_histogram[log2_bucket(spi_transactions, self.BUCKETS)] += 1
+
+    # Returns the histogram as text, e.g. "<64:3 <128:10", skipping the empty buckets.
+    def format_histogram(self, histogram):
+        text = []
+        for i in range(self.BUCKETS):
+            if histogram[i]:
+                text.append("<%d:%d" % (1 << i, histogram[i]))
+        return " ".join(text)
+
+    def report(self):
+        if self.count == 0:
+            return "%-8s -" % self.name
+        errors = self.count - self.statuses.get(MFRC522.MI_OK, 0)
+        lines = ["%-8s n=%d errors=%d spi/cmd=%.1f polls/cmd=%.1f mean=%.0fus max=%.0fus statuses=%s" %
+                 (self.name, self.count, errors, self.spi_transactions / float(self.count),
+                  self.polls / float(self.count), self.total_time / self.count * 1e6,
+                  self.max_time * 1e6, self.statuses)]
+        lines.append("         latency (us) " + self.format_histogram(self.latency_histogram))
+        lines.append("         spi          " + self.format_histogram(self.spi_histogram))
+        return "\n".join(lines)
+
+
 class MFRC522:
     NRSTPD = 22
 
@@ -47,6 +163,10 @@ class MFRC522:
     PICC_REQALL = 0x52
     PICC_ANTICOLL = 0x93
     PICC_SElECTTAG = 0x93
+    # Select commands of the three cascade levels, and the cascade tag that tells that the
+    # UID goes on at the next level.
+    PICC_CASCADE = [0x93, 0x95, 0x97]
+    PICC_CT = 0x88
     PICC_AUTHENT1A = 0x60
     PICC_AUTHENT1B = 0x61
     PICC_READ = 0x30
@@ -60,6 +180,23 @@ class MFRC522:
     MI_OK = 0
     MI_NOTAGERR = 1
     MI_ERR = 2
+    # The answers of several cards collided (see MFRC522_AnticollLevel).
+    MI_COLL = 3
+
+    # Where the CRC of the frames sent to the card is calculated. CRC_VERIFY uses
+    # the reader and checks every result against the software CRC.
+    CRC_HARDWARE = 0
+    CRC_SOFTWARE = 1
+    CRC_VERIFY = 2
+
+    # The commands recorded when tracing is enabled, and the methods that do them.
+    TRACED_COMMANDS = [("Request", "MFRC522_Request"),
+                       ("Anticoll", "MFRC522_AnticollLevel"),
+                       ("Select", "MFRC522_SelectLevel"),
+                       ("Auth", "MFRC522_Auth"),
+                       ("Read", "MFRC522_ReadBlock"),
+                       ("Write", "MFRC522_Write"),
+                       ("CRC", "CalulateCRC")]
 
     Reserved00 = 0x00
     CommandReg = 0x01
@@ -131,26 +268,181 @@ class MFRC522:
 
     serNum = []
 
-    def __init__(self, dev='/dev/spidev0.0', spd=1000000):
-        self.spi_fd = spi.openSPI(device=dev, speed=spd)
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.NRSTPD, GPIO.OUT)
-        GPIO.output(self.NRSTPD, 1)
+    # "irq" is the GPIO pin (BCM numbering) wired to the IRQ pin of the reader. When it
+    # is given, the driver waits for an edge on that pin instead of polling the
+    # interrupt registers, and gives up after "irq_timeout" seconds.
+    # "crc_mode" is one of the CRC_ constants above; the software CRC is the default.
+    # "transport" replaces the SPI device and GPIO pins of the Pi (see MFRC522Transport),
+    # by default the one selected with the MFRC522_TRANSPORT environment variable.
+    # "trace" enables the per-command statistics (see MFRC522_EnableTrace); by default
+    # they are enabled when the environment variable MFRC522_TRACE is set to 1.
+    # "rst_pin" is the BCM number of the pin wired to the RST pin of the reader. Several
+    # readers on different SPI devices can share it.
+    def __init__(self, dev='/dev/spidev0.0', spd=1000000, irq=None, irq_timeout=0.05,
+                 crc_mode=CRC_SOFTWARE, transport=None, trace=None, rst_pin=NRSTPD):
+        if transport is None:
+            transport = MFRC522Transport.open_transport(dev, spd)
+        self.transport = transport
+        self.gpio = transport.gpio
+        self.crc_mode = crc_mode
+        self.crc_mismatches = 0
+        self.spi_transactions = 0
+        self.bit_framing = 0x00
+        self.irq = irq
+        self.irq_timeout = irq_timeout
+        self.irq_event = threading.Event()
+        # Time in seconds between starting the last command and its completion, and
+        # the number of times the interrupt register was read while waiting for it.
+        self.last_command_time = 0.0
+        self.last_poll_count = 0
+        self.poll_total = 0
+        self.stats = None
+        self.dev = dev
+        self.rst_pin = rst_pin
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setup(self.rst_pin, self.gpio.OUT)
+        self.gpio.output(self.rst_pin, 1)
+        if self.irq is not None:
+            self.transport.setup_irq(self.irq, self.MFRC522_IrqCallback)
+        if trace is None:
+            trace = os.environ.get("MFRC522_TRACE") == "1"
+        if trace:
+            self.MFRC522_EnableTrace()
         self.MFRC522_Init()
 
+    # Starts recording the SPI transactions, polls, status and time of every command in
+    # TRACED_COMMANDS. The methods are wrapped on this object only, so nothing is
+    # measured and the driver runs at full speed while tracing is disabled. Enabling the
+    # trace again after MFRC522_DisableTrace starts new statistics; enabling it while it
+    # is enabled does nothing.
+    def MFRC522_EnableTrace(self):
+        if any(method in self.__dict__ for (name, method) in self.TRACED_COMMANDS):
+            return
+        self.stats = {}
+        for (name, method) in self.TRACED_COMMANDS:
+            self.stats[name] = CommandStats(name)
+            setattr(self, method, self.MFRC522_Traced(self.stats[name], getattr(self, method)))
+
+    # Stops recording. The statistics are kept until the trace is enabled again.
+    def MFRC522_DisableTrace(self):
+        for (name, method) in self.TRACED_COMMANDS:
+            if method in self.__dict__:
+                delattr(self, method)
+
+    def MFRC522_Traced(self, stats, function):
+        def traced(*args, **kwargs):
+            spi_start = self.spi_transactions
+            polls_start = self.poll_total
+            start = time.monotonic()
+            result = function(*args, **kwargs)
+            elapsed = time.monotonic() - start
+            stats.add(self.MFRC522_TraceStatus(stats.name, result),
+                      self.spi_transactions - spi_start, self.poll_total - polls_start, elapsed)
+            return result
+        return traced
+
+    # The status of a command from what its method returns.
+    def MFRC522_TraceStatus(self, name, result):
+        if name == "CRC":
+            return self.MI_OK
+        if isinstance(result, tuple):
+            return result[0]
+        return result
+
+    # Returns the statistics recorded since tracing was enabled as text, one command
+    # after the other, or None if tracing was never enabled.
+    def MFRC522_TraceReport(self):
+        if self.stats is None:
+            return None
+        return "\n".join(self.stats[name].report() for (name, method) in self.TRACED_COMMANDS)
+
     def MFRC522_Reset(self):
         self.Write_MFRC522(self.CommandReg, self.PCD_RESETPHASE)
+        # The soft reset puts every register back to its reset value.
+        self.bit_framing = 0x00
+
+    # Every SPI transaction with the reader goes through here, so that the number of
+    # transactions a command needs can be measured with "spi_transactions".
+    def Transfer_MFRC522(self, data):
+        self.spi_transactions += 1
+        return self.transport.transfer(data)
 
     def Write_MFRC522(self, addr, val):
-        val = spi.transfer(self.spi_fd, ((addr << 1) & 0x7E, val))
+        if addr == self.BitFramingReg:
+            self.bit_framing = val
+        self.Transfer_MFRC522(((addr << 1) & 0x7E, val))
 
     def Read_MFRC522(self, addr):
-        val = spi.transfer(self.spi_fd, (((addr << 1) & 0x7E) | 0x80, 0))
+        val = self.Transfer_MFRC522((((addr << 1) & 0x7E) | 0x80, 0))
         return val[1]
 
+    # Writes several bytes to the same register in a single SPI transaction. The
+    # address byte is only sent once and all the following bytes go to that address,
+    # which is how the FIFO is meant to be filled (datasheet section 8.1.2).
+    def Write_MFRC522_Burst(self, addr, data):
+        if len(data) == 0:
+            return
+        self.Transfer_MFRC522([(addr << 1) & 0x7E] + list(data))
+
+    # Reads several registers in a single SPI transaction. Each byte sent is the
+    # address of the next register to read, and each byte received is the value of the
+    # previous address, so the answer comes back shifted by one byte.
+    def Read_MFRC522_Multi(self, addrs):
+        if len(addrs) == 0:
+            return []
+        tx = [((addr << 1) & 0x7E) | 0x80 for addr in addrs]
+        tx.append(0)
+        val = self.Transfer_MFRC522(tx)
+        return list(val[1:])
+
+    # Reads "count" bytes out of the FIFO in a single SPI transaction.
+    def Read_MFRC522_Burst(self, addr, count):
+        return self.Read_MFRC522_Multi([addr] * count)
+
     def Close_MFRC522(self):
-        spi.closeSPI(self.spi_fd)
-        GPIO.cleanup()
+        self.transport.close()
+        self.gpio.cleanup()
+
+    def MFRC522_IrqCallback(self, channel):
+        self.irq_event.set()
+
+    # Waits until one of the bits in "waitIRq" is set in the interrupt register "reg"
+    # and returns the value of the register, or None if the command did not finish in
+    # time. "start" is the time the command was started. The irq_event has to be
+    # cleared before the command is started, so that an edge that happens before
+    # we start waiting is not lost.
+    def MFRC522_WaitIrq(self, reg, waitIRq, maxPolls, start):
+        n = None
+        polls = 0
+        if self.irq is None:
+            while polls < maxPolls:
+                value = self.Read_MFRC522(reg)
+                polls = polls + 1
+                if value & waitIRq:
+                    n = value
+                    break
+        else:
+            # An edge can come from a bit that does not end the command (e.g. ErrIRq on
+            # a collision, before RxIRq). Such bits are cleared, which releases the IRQ
+            # line for the next edge, and the wait goes on until the deadline.
+            deadline = start + self.irq_timeout
+            while True:
+                self.irq_event.wait(max(deadline - time.monotonic(), 0))
+                self.irq_event.clear()
+                value = self.Read_MFRC522(reg) & 0x7F
+                polls = polls + 1
+                if value & waitIRq:
+                    n = value
+                if value:
+                    # The interrupt bits stay set until they are cleared, and would
+                    # keep the IRQ line asserted for the next command.
+                    self.ClearIrqBits(reg, value)
+                if n is not None or time.monotonic() >= deadline:
+                    break
+        self.last_command_time = time.monotonic() - start
+        self.last_poll_count = polls
+        self.poll_total += polls
+        return n
 
     def SetBitMask(self, reg, mask):
         tmp = self.Read_MFRC522(reg)
@@ -160,10 +452,28 @@ class MFRC522:
         tmp = self.Read_MFRC522(reg)
         self.Write_MFRC522(reg, tmp & (~mask))
 
+    # The following registers do not need a read-modify-write, which halves the
+    # number of SPI transactions:
+    #  - CommIrqReg and DivIrqReg: bit 7 selects whether the marked bits are set or
+    #    cleared, so writing the mask with bit 7 low clears exactly those bits.
+    #  - FIFOLevelReg: only bit 7 (FlushBuffer) is writable.
+    #  - BitFramingReg: the driver is the only one writing it, so its value is known.
+    def ClearIrqBits(self, reg, mask):
+        self.Write_MFRC522(reg, mask & 0x7F)
+
+    def FlushFIFO(self):
+        self.Write_MFRC522(self.FIFOLevelReg, 0x80)
+
+    def StartSend(self):
+        self.Write_MFRC522(self.BitFramingReg, self.bit_framing | 0x80)
+
+    def StopSend(self):
+        self.Write_MFRC522(self.BitFramingReg, self.bit_framing & 0x7F)
+
     def AntennaOn(self):
         temp = self.Read_MFRC522(self.TxControlReg)
-        if (~(temp & 0x03)):
-            self.SetBitMask(self.TxControlReg, 0x03)
+        if (temp & 0x03) != 0x03:
+            self.Write_MFRC522(self.TxControlReg, temp | 0x03)
 
     def AntennaOff(self):
         self.ClearBitMask(self.TxControlReg, 0x03)
@@ -176,7 +486,6 @@ class MFRC522:
         waitIRq = 0x00
         lastBits = None
         n = 0
-        i = 0
 
         if command == self.PCD_AUTHENT:
             irqEn = 0x12
@@ -184,42 +493,57 @@ class MFRC522:
         if command == self.PCD_TRANSCEIVE:
             irqEn = 0x77
             waitIRq = 0x30
+        if command == self.PCD_TRANSMIT:
+            # The Transmit command goes back to idle by itself once the frame is sent.
+            irqEn = 0x10
+            waitIRq = 0x10
 
-        self.Write_MFRC522(self.CommIEnReg, irqEn | 0x80)
-        self.ClearBitMask(self.CommIrqReg, 0x80)
-        self.SetBitMask(self.FIFOLevelReg, 0x80)
+        if self.irq is None:
+            self.Write_MFRC522(self.CommIEnReg, irqEn | 0x80)
+        else:
+            # Only the interrupts that end the command are routed to the IRQ pin
+            # (TxIRq and LoAlertIRq fire in the middle of a transceive, and ErrIRq as
+            # soon as a collision is seen), plus the timer so that a missing card does
+            # not wait for the whole irq_timeout.
+            self.Write_MFRC522(self.CommIEnReg, (irqEn & 0x31) | 0x81)
+        self.ClearIrqBits(self.CommIrqReg, 0x7F)
+        self.FlushFIFO()
 
         self.Write_MFRC522(self.CommandReg, self.PCD_IDLE)
 
-        while (i < len(sendData)):
-            self.Write_MFRC522(self.FIFODataReg, sendData[i])
-            i = i + 1
+        # The whole frame goes into the FIFO in one SPI transaction.
+        self.Write_MFRC522_Burst(self.FIFODataReg, sendData)
 
+        self.irq_event.clear()
+        start = time.monotonic()
         self.Write_MFRC522(self.CommandReg, command)
 
         if command == self.PCD_TRANSCEIVE:
-            self.SetBitMask(self.BitFramingReg, 0x80)
+            self.StartSend()
 
-        # TODO: This is very inelegant and results in blocking behavior. For now just decrease loop iteration count by 10x.
-        i = 200
-        while True:
-            n = self.Read_MFRC522(self.CommIrqReg)
-            i = i - 1
-            if ~((i != 0) and ~(n & 0x01) and ~(n & waitIRq)):
-                break
+        # The command ends when one of the waitIRq bits is set, or when the timer
+        # (TimerIRq, bit 0) runs out because no card answered.
+        n = self.MFRC522_WaitIrq(self.CommIrqReg, waitIRq | 0x01, 200, start)
 
-        self.ClearBitMask(self.BitFramingReg, 0x80)
+        self.StopSend()
 
-        if i != 0:
-            if (self.Read_MFRC522(self.ErrorReg) & 0x1B) == 0x00:
+        if n is not None:
+            # ErrorReg, FIFOLevelReg and ControlReg are read in a single transaction.
+            (error, level, control) = self.Read_MFRC522_Multi(
+                [self.ErrorReg, self.FIFOLevelReg, self.ControlReg])
+            # ProtocolErr, ParityErr and BufferOvfl make the answer useless. With CollErr
+            # the bits up to the collision are still good, which the anticollision needs.
+            if (error & 0x13) == 0x00:
                 status = self.MI_OK
+                if error & 0x08:
+                    status = self.MI_COLL
 
                 if n & irqEn & 0x01:
                     status = self.MI_NOTAGERR
 
                 if command == self.PCD_TRANSCEIVE:
-                    n = self.Read_MFRC522(self.FIFOLevelReg)
-                    lastBits = self.Read_MFRC522(self.ControlReg) & 0x07
+                    n = level
+                    lastBits = control & 0x07
                     if lastBits != 0:
                         backLen = (n - 1) * 8 + lastBits
                     else:
@@ -230,10 +554,7 @@ class MFRC522:
                     if n > self.MAX_LEN:
                         n = self.MAX_LEN
 
-                    i = 0
-                    while i < n:
-                        backData.append(self.Read_MFRC522(self.FIFODataReg))
-                        i = i + 1
+                    backData = self.Read_MFRC522_Burst(self.FIFODataReg, n)
             else:
                 status = self.MI_ERR
 
@@ -250,77 +571,148 @@ class MFRC522:
         (status, backData, backBits) = self.MFRC522_ToCard(self.PCD_TRANSCEIVE,
                                                            TagType)
 
+        # Cards of different types answer with different ATQAs, which collide.
+        if status == self.MI_COLL:
+            status = self.MI_OK
+
         if ((status != self.MI_OK) | (backBits != 0x10)):
             status = self.MI_ERR
 
         return (status, backBits)
 
+    # Gets the 5 bytes of cascade level 1 (the UID and BCC of a card with a 4 byte UID).
+    # MFRC522_AnticollSelect reads UIDs of any length.
     def MFRC522_Anticoll(self):
-        backData = []
-        serNumCheck = 0
+        return self.MFRC522_AnticollLevel(0)
 
-        serNum = []
+    # Runs the anticollision loop of the cascade level "level" (0 to 2). When several
+    # cards answer, the first bit where their UIDs differ is set to 1, and the loop goes on
+    # with the cards that have that bit set. Returns the status and the 5 bytes of the
+    # level: 4 UID bytes, or the cascade tag and 3 UID bytes, followed by the BCC.
+    def MFRC522_AnticollLevel(self, level):
+        serNum = [0, 0, 0, 0, 0]
+        known = 0
 
-        self.Write_MFRC522(self.BitFramingReg, 0x00)
-
-        serNum.append(self.PICC_ANTICOLL)
-        serNum.append(0x20)
+        # With ValuesAfterColl cleared, the bits received after a collision are 0.
+        self.ClearBitMask(self.CollReg, 0x80)
 
-        (status, backData, backBits) = self.MFRC522_ToCard(self.PCD_TRANSCEIVE,
-                                                           serNum)
+        while True:
+            # The known bits are sent back to the cards, which answer with the rest. A
+            # partial byte is sent with TxLastBits, and the answer is received with RxAlign
+            # so that it completes that byte.
+            knownBytes = known // 8
+            knownBits = known % 8
+            buf = [self.PICC_CASCADE[level], 0x20 + (knownBytes << 4) + knownBits]
+            buf += serNum[0:knownBytes + (1 if knownBits else 0)]
+            self.Write_MFRC522(self.BitFramingReg, (knownBits << 4) | knownBits)
+            (status, backData, backLen) = self.MFRC522_ToCard(self.PCD_TRANSCEIVE, buf)
+            if status != self.MI_OK and status != self.MI_COLL:
+                break
 
-        if (status == self.MI_OK):
             i = 0
-            if len(backData) == 5:
-                while i < 4:
-                    serNumCheck = serNumCheck ^ backData[i]
-                    i = i + 1
-                if serNumCheck != backData[i]:
+            while i < len(backData) and knownBytes + i < 5:
+                if i == 0 and knownBits:
+                    mask = (1 << knownBits) - 1
+                    serNum[knownBytes] = (serNum[knownBytes] & mask) | (backData[0] & ~mask & 0xFF)
+                else:
+                    serNum[knownBytes + i] = backData[i]
+                i = i + 1
+
+            if status == self.MI_OK:
+                if len(backData) != 5 - knownBytes or (serNum[0] ^ serNum[1] ^ serNum[2] ^ serNum[3]) != serNum[4]:
                     status = self.MI_ERR
-            else:
+                break
+
+            # CollPos counts from the first bit of the first byte received, 0 meaning 32.
+            # CollPosNotValid is set when the collision is after the 32nd bit, in the BCC.
+            coll = self.Read_MFRC522(self.CollReg)
+            position = knownBytes * 8 + ((coll & 0x1F) or 32)
+            if coll & 0x20 or position <= known or position > 32:
                 status = self.MI_ERR
+                break
+            serNum[(position - 1) // 8] |= 1 << ((position - 1) % 8)
+            known = position
 
-        return (status, backData)
+        self.Write_MFRC522(self.BitFramingReg, 0x00)
+        return (status, serNum)
+
+    # Selects the card with the 5 bytes "serNum" at the cascade level "level". Returns the
+    # status and the SAK of the card, which has bit 2 set when the UID is not complete.
+    def MFRC522_SelectLevel(self, level, serNum):
+        buf = [self.PICC_CASCADE[level], 0x70] + list(serNum[0:5])
+        buf += self.CalulateCRC(buf)
+        (status, backData, backLen) = self.MFRC522_ToCard(self.PCD_TRANSCEIVE, buf)
+        if status == self.MI_OK and backLen == 0x18 and crc_a(backData[0:1]) == backData[1:3]:
+            return (self.MI_OK, backData[0])
+        return (self.MI_ERR, 0)
+
+    # Reads the whole UID of a card that answered MFRC522_Request, going through as many
+    # cascade levels as needed, and selects the card. Returns the status, the UID (4, 7 or
+    # 10 bytes, without the cascade tags and BCCs) and the SAK. When several cards are in
+    # the field, one of them is selected; MFRC522_Enumerate finds them all.
+    def MFRC522_AnticollSelect(self):
+        uid = []
+        for level in range(3):
+            (status, serNum) = self.MFRC522_AnticollLevel(level)
+            if status != self.MI_OK:
+                break
+            (status, sak) = self.MFRC522_SelectLevel(level, serNum)
+            if status != self.MI_OK:
+                break
+            if not (sak & 0x04):
+                return (self.MI_OK, uid + serNum[0:4], sak)
+            if serNum[0] != self.PICC_CT:
+                break
+            uid += serNum[1:4]
+        return (self.MI_ERR, [], 0)
+
+    # Finds every card in the field. All the cards are woken up with WUPA, and selected
+    # one after the other and halted, until no card answers REQA. Returns a list of
+    # (uid, sak); the cards are left halted, and MFRC522_Reselect wakes up one of them.
+    # With reqMode=PICC_REQIDL the cards that are already halted are left out.
+    def MFRC522_Enumerate(self, maxCards=8, reqMode=PICC_REQALL):
+        cards = []
+        for attempt in range(maxCards):
+            (status, backBits) = self.MFRC522_Request(reqMode)
+            if status != self.MI_OK:
+                break
+            reqMode = self.PICC_REQIDL
+            (status, uid, sak) = self.MFRC522_AnticollSelect()
+            if status == self.MI_OK:
+                cards.append((uid, sak))
+            self.MFRC522_Halt()
+        return cards
 
     def CalulateCRC(self, pIndata):
-        self.ClearBitMask(self.DivIrqReg, 0x04)
-        self.SetBitMask(self.FIFOLevelReg, 0x80)
-        i = 0
-        while i < len(pIndata):
-            self.Write_MFRC522(self.FIFODataReg, pIndata[i])
-            i = i + 1
+        if self.crc_mode == self.CRC_SOFTWARE:
+            return crc_a(pIndata)
+        pOutData = self.CalulateCRC_Hardware(pIndata)
+        if self.crc_mode == self.CRC_VERIFY and pOutData != crc_a(pIndata):
+            self.crc_mismatches += 1
+            logger.warning("CRC mismatch for %s: reader %s, software %s",
+                           pIndata, pOutData, crc_a(pIndata))
+        return pOutData
+
+    # Lets the reader calculate the CRC. This takes a dozen SPI transactions.
+    def CalulateCRC_Hardware(self, pIndata):
+        self.ClearIrqBits(self.DivIrqReg, 0x04)
+        self.FlushFIFO()
+        self.Write_MFRC522_Burst(self.FIFODataReg, pIndata)
+        self.irq_event.clear()
+        start = time.monotonic()
         self.Write_MFRC522(self.CommandReg, self.PCD_CALCCRC)
-        i = 0xFF
-        while True:
-            n = self.Read_MFRC522(self.DivIrqReg)
-            i = i - 1
-            if not ((i != 0) and not (n & 0x04)):
-                break
-        pOutData = []
-        pOutData.append(self.Read_MFRC522(self.CRCResultRegL))
-        pOutData.append(self.Read_MFRC522(self.CRCResultRegM))
+        self.MFRC522_WaitIrq(self.DivIrqReg, 0x04, 0xFF, start)
+        pOutData = self.Read_MFRC522_Multi([self.CRCResultRegL, self.CRCResultRegM])
         return pOutData
 
+    # Selects the card with a 4 byte UID "serNum" (as returned by MFRC522_Anticoll) and
+    # returns its SAK, or 0 if it did not answer.
     def MFRC522_SelectTag(self, serNum):
-        backData = []
-        buf = []
-        buf.append(self.PICC_SElECTTAG)
-        buf.append(0x70)
-        i = 0
-        while i < 5:
-            buf.append(serNum[i])
-            i = i + 1
-        pOut = self.CalulateCRC(buf)
-        buf.append(pOut[0])
-        buf.append(pOut[1])
-        (status, backData, backLen) = self.MFRC522_ToCard(self.PCD_TRANSCEIVE,
-                                                          buf)
-
-        if (status == self.MI_OK) and (backLen == 0x18):
-            print ("Size: " + str(backData[0]))
-            return backData[0]
-        else:
-            return 0
+        (status, sak) = self.MFRC522_SelectLevel(0, serNum)
+        if status == self.MI_OK:
+            logger.debug("Size: %d", sak)
+            return sak
+        return 0
 
     def MFRC522_Auth(self, authMode, BlockAddr, Sectorkey, serNum):
         buff = []
@@ -336,12 +728,13 @@ class MFRC522:
         while (i < len(Sectorkey)):
             buff.append(Sectorkey[i])
             i = i + 1
-        i = 0
 
-        # Next we append the first 4 bytes of the UID
-        while (i < 4):
-            buff.append(serNum[i])
-            i = i + 1
+        # Next we append 4 bytes of the UID: the first ones for a 4 byte UID (with or
+        # without the BCC), and the last ones for the 7 and 10 byte UIDs.
+        if len(serNum) == 7 or len(serNum) == 10:
+            buff += serNum[-4:]
+        else:
+            buff += serNum[0:4]
 
         # Now we start the authentication itself
         (status, backData, backLen) = self.MFRC522_ToCard(self.PCD_AUTHENT,
@@ -349,32 +742,76 @@ class MFRC522:
 
         # Check if an error occurred
         if not (status == self.MI_OK):
-            print ("AUTH ERROR!!")
+            logger.debug("Auth error for block %d", BlockAddr)
+        # The command also ends without an error when the card does not answer (wrong
+        # key), so the authentication only succeeded if MFCrypto1On is set.
         if not (self.Read_MFRC522(self.Status2Reg) & 0x08) != 0:
-            print ("AUTH ERROR(status2reg & 0x08) != 0")
+            logger.debug("Auth error for block %d: MFCrypto1On not set", BlockAddr)
+            status = self.MI_ERR
 
         # Return the status
         return status
 
-    def MFRC522_StopCrypto1(self):
-        self.ClearBitMask(self.Status2Reg, 0x08)
+    # Sends HLTA. The card does not answer, so the frame is only transmitted.
+    def MFRC522_Halt(self):
+        buf = [self.PICC_HALT, 0x00]
+        buf += self.CalulateCRC(buf)
+        (status, backData, backLen) = self.MFRC522_ToCard(self.PCD_TRANSMIT, buf)
+        return status
 
-    def MFRC522_Read(self, blockAddr):
-        recvData = []
-        recvData.append(self.PICC_READ)
-        recvData.append(blockAddr)
-        pOut = self.CalulateCRC(recvData)
-        recvData.append(pOut[0])
-        recvData.append(pOut[1])
+    # Wakes up the tag with WUPA (also if it is halted) and selects it again, at every
+    # cascade level of its UID. Returns True if the tag with the UID "serNum" answered.
+    # The other cards in the field do not answer a select with a UID that is not theirs.
+    def MFRC522_Reselect(self, serNum):
+        (status, backBits) = self.MFRC522_Request(self.PICC_REQALL)
+        if status != self.MI_OK:
+            return False
+        # WUPA is a short frame of 7 bits; the select frame uses whole bytes.
+        self.Write_MFRC522(self.BitFramingReg, 0x00)
+        parts = uid_cascade(serNum)
+        for level in range(len(parts)):
+            (status, sak) = self.MFRC522_SelectLevel(level, parts[level])
+            if status != self.MI_OK:
+                return False
+        return True
+
+    # Checks whether the card with the UID "serNum" (as returned by MFRC522_Anticoll)
+    # is still near the reader. It is cheap enough to be called several times per
+    # second: the card is halted, woken up with WUPA and selected directly with its
+    # UID, without going through the anticollision loop. Halting first makes this
+    # work whatever state the card was left in, even when it is still authenticated
+    # (the card then sees the plain HLTA as garbage and goes back to idle, where WUPA
+    # also wakes it up).
+    def MFRC522_IsPresent(self, serNum):
+        self.MFRC522_StopCrypto1()
+        self.MFRC522_Halt()
+        return self.MFRC522_Reselect(serNum)
+
+    def MFRC522_StopCrypto1(self):
+        # Apart from MFCrypto1On, the writable bits of Status2Reg are only used for
+        # the temperature sensor and I2C, which the driver never sets.
+        self.Write_MFRC522(self.Status2Reg, 0x00)
+
+    # Reads one block of 16 bytes without printing it. Returns the status and the data.
+    def MFRC522_ReadBlock(self, blockAddr):
+        recvData = [self.PICC_READ, blockAddr]
+        recvData += self.CalulateCRC(recvData)
         (status, backData, backLen) = self.MFRC522_ToCard(self.PCD_TRANSCEIVE,
                                                           recvData)
+        if status != self.MI_OK or len(backData) != 16:
+            return (self.MI_ERR, None)
+        return (self.MI_OK, backData)
+
+    # Returns the 16 bytes of the block, or None if it could not be read.
+    def MFRC522_Read(self, blockAddr):
+        (status, backData) = self.MFRC522_ReadBlock(blockAddr)
         if not (status == self.MI_OK):
-            print ("Error while reading!")
-        i = 0
-        if len(backData) == 16:
-            print ("Sector " + str(blockAddr) + " " + str(backData))
-            return backData
+            logger.debug("Error while reading block %d", blockAddr)
+            return None
+        logger.debug("Block %d %s", blockAddr, backData)
+        return backData
 
+    # Writes 16 bytes to a block. Returns MI_OK if the card acknowledged the data.
     def MFRC522_Write(self, blockAddr, writeData):
         buff = []
         buff.append(self.PICC_WRITE)
@@ -387,8 +824,8 @@ class MFRC522:
         if not (status == self.MI_OK) or not (backLen == 4) or not (
                 (backData[0] & 0x0F) == 0x0A):
             status = self.MI_ERR
+            logger.debug("Block %d: write refused by the card", blockAddr)
 
-        print ("%s backdata &0x0F == 0x0A %s" % (backLen, backData[0] & 0x0F))
         if status == self.MI_OK:
             i = 0
             buf = []
@@ -402,20 +839,59 @@ class MFRC522:
                 self.PCD_TRANSCEIVE, buf)
             if not (status == self.MI_OK) or not (backLen == 4) or not (
                     (backData[0] & 0x0F) == 0x0A):
-                print ("Error while writing")
-            if status == self.MI_OK:
-                print ("Data written")
+                status = self.MI_ERR
+                logger.debug("Block %d: error while writing", blockAddr)
+            else:
+                logger.debug("Block %d: data written", blockAddr)
+        return status
 
-    def MFRC522_DumpClassic1K(self, key, uid):
-        i = 0
-        while i < 64:
-            status = self.MFRC522_Auth(self.PICC_AUTHENT1A, i, key, uid)
-            # Check if authenticated
-            if status == self.MI_OK:
-                self.MFRC522_Read(i)
+    # Reads the sectors from "firstSector" to "lastSector" (both included) of a MIFARE
+    # Classic 1K tag, authenticating once per sector instead of once per block.
+    # "keys" is either one key of 6 bytes used for every sector, or a dictionary
+    # {sector: key}; sectors without a key are skipped. The tag must be selected.
+    # Returns a bytearray with the 64 bytes of every sector read (zeros for the sectors
+    # that could not be read) and a dictionary {sector: MI_OK or MI_ERR}.
+    def MFRC522_ReadSectors(self, uid, keys, firstSector=0, lastSector=15, authMode=PICC_AUTHENT1A):
+        image = bytearray(64 * (lastSector - firstSector + 1))
+        sectorStatus = {}
+        for sector in range(firstSector, lastSector + 1):
+            if isinstance(keys, dict):
+                key = keys.get(sector)
             else:
-                print ("Authentication error")
-            i = i + 1
+                key = keys
+            sectorStatus[sector] = self.MI_ERR
+            if key is None:
+                continue
+            # A failed authentication sends the tag back to idle, so it has to be
+            # woken up and selected again before the next sector.
+            if self.MFRC522_Auth(authMode, sector * 4 + 3, key, uid) != self.MI_OK:
+                self.MFRC522_StopCrypto1()
+                self.MFRC522_Reselect(uid)
+                continue
+            offset = 64 * (sector - firstSector)
+            for block in range(4):
+                (status, backData) = self.MFRC522_ReadBlock(sector * 4 + block)
+                if status != self.MI_OK:
+                    break
+                image[offset + 16 * block:offset + 16 * (block + 1)] = bytearray(backData)
+            else:
+                sectorStatus[sector] = self.MI_OK
+                continue
+            # A failed read leaves the tag in an unknown state.
+            self.MFRC522_StopCrypto1()
+            self.MFRC522_Reselect(uid)
+        return (image, sectorStatus)
+
+    def MFRC522_DumpClassic1K(self, key, uid):
+        (image, sectorStatus) = self.MFRC522_ReadSectors(uid, key)
+        for sector in range(16):
+            for block in range(4):
+                if sectorStatus[sector] == self.MI_OK:
+                    i = sector * 4 + block
+                    print ("Sector " + str(i) + " " + str(list(image[16 * i:16 * (i + 1)])))
+                else:
+                    print ("Authentication error")
+        return image
 
     def MFRC522_Init(self):
         self.MFRC522_Reset()
@@ -427,4 +903,9 @@ class MFRC522:
 
         self.Write_MFRC522(self.TxAutoReg, 0x40)
         self.Write_MFRC522(self.ModeReg, 0x3D)
+
+        if self.irq is not None:
+            # Drives the IRQ pin as a push-pull output and routes CRCIRq to it.
+            self.Write_MFRC522(self.DivlEnReg, 0x84)
+
         self.AntennaOn()
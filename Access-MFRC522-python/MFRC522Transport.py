@@ -0,0 +1,64 @@
+# Transports used by the MFRC522 driver to talk to the reader.
+#
+# SPITransport uses SPI-Py and RPi.GPIO, and only works on a Raspberry Pi with a reader
+# connected. VirtualTransport (see VirtualMFRC522.py) talks to a software model of the
+# reader with emulated MIFARE Classic cards, so that the driver and the scripts built
+# on it can run on any computer.
+#
+# A transport has:
+#   gpio                    an object with the same interface as RPi.GPIO.
+#   transfer(data)          does one SPI transaction and returns the bytes received.
+#   setup_irq(pin, callback) calls "callback" on every falling edge of the IRQ pin.
+#   close()                 releases the SPI device.
+#
+# The environment variable MFRC522_TRANSPORT selects the transport: "spi" (default) or
+# "virtual". The scripts import GPIO from this module instead of RPi.GPIO, so that the
+# relay, LEDs and buzzer are emulated as well when the virtual transport is used.
+
+import os
+
+try:
+    import RPi.GPIO
+    import spi
+except ImportError:     # Not running on a Raspberry Pi.
+    RPi = None
+    spi = None
+
+TRANSPORT = os.environ.get("MFRC522_TRANSPORT", "spi")
+
+if TRANSPORT == "virtual":
+    import VirtualMFRC522
+    GPIO = VirtualMFRC522.GPIO
+elif RPi is not None:
+    GPIO = RPi.GPIO
+else:
+    GPIO = None
+
+
+class SPITransport:
+    def __init__(self, dev='/dev/spidev0.0', spd=1000000):
+        if spi is None:
+            raise ImportError("SPI-Py and RPi.GPIO are needed to use the reader. Set MFRC522_TRANSPORT=virtual to use the virtual reader instead.")
+        self.gpio = RPi.GPIO
+        self.irq = None
+        self.spi_fd = spi.openSPI(device=dev, speed=spd)
+
+    def transfer(self, data):
+        return spi.transfer(self.spi_fd, tuple(data))
+
+    def setup_irq(self, pin, callback):
+        self.irq = pin
+        self.gpio.setup(pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self.gpio.add_event_detect(pin, self.gpio.FALLING, callback=callback)
+
+    def close(self):
+        if self.irq is not None:
+            self.gpio.remove_event_detect(self.irq)
+        spi.closeSPI(self.spi_fd)
+
+
+# Opens the transport selected with MFRC522_TRANSPORT for the given SPI device.
+def open_transport(dev='/dev/spidev0.0', spd=1000000):
+    if TRANSPORT == "virtual":
+        return VirtualMFRC522.open_transport(dev, spd)
+    return SPITransport(dev, spd)
@@ -0,0 +1,221 @@
+# Counts what happens at the machines and measures how long each stage of a tap takes, and exports it in the text format
+# of Prometheus, so that the Pis of the whole shop can be watched on one dashboard, and a change that makes taps slower
+# is seen on every Pi at once.
+#
+# observe(stage, seconds) adds a duration to the histogram of a stage (e.g. reading the tag, asking Booked for the UID,
+# from the tap to the relay), and count(event, resource_id) adds one to a counter (taps, grants, denials, errors, network
+# failures). Gauges are functions that are called when the metrics are exported (e.g. the number of check ins waiting in
+# the outbox). All of them are safe to call from any thread, and only take a lock for a few microseconds.
+#
+# A thread writes the metrics every "interval" seconds to "path", through a temporary file that then replaces it, so
+# that the textfile collector of the node exporter never reads half a file (start the node exporter with
+# --collector.textfile.directory set to the folder of "path"; the file name must end with ".prom"). With a "port", the
+# metrics are also served over HTTP, at http://<pi>:<port>/metrics, for Prometheus to scrape directly.
+#
+# Running this file measures observe() and prints the metrics of a few fake taps:
+#   python Metrics.py
+
+import logging
+import os
+import threading
+import time
+
+# The upper bounds of the buckets of the histograms, in seconds.
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf.
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    # Returns the lines of the histogram, with the counts of the buckets added up as Prometheus wants them.
+    def lines(self, name, labels):
+        lines = []
+        total = 0
+        for (bound, count) in zip([format_value(bound) for bound in self.buckets] + ["+Inf"], self.counts):
+            total += count
+            lines.append("%s_bucket{%s,le=\"%s\"} %d" % (name, labels, bound, total))
+        lines.append("%s_sum{%s} %s" % (name, labels, format_value(self.sum)))
+        lines.append("%s_count{%s} %d" % (name, labels, self.count))
+        return lines
+
+
+def format_value(value):
+    return repr(float(value))
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Metrics:
+    # The names of the metrics start with "prefix". "path" is the file for the node exporter, or None; "port" the port of
+    # the HTTP endpoint, or None.
+    def __init__(self, path=None, port=None, interval=15, prefix="access", buckets=BUCKETS):
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self.prefix = prefix
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = {}    # The Histogram of every stage.
+        self.counters = {}      # The counters, by (event, resource id).
+        self.gauges = []        # (name, help, function returning {labels: value} or a number).
+        self.started = time.time()
+        self.exports = 0
+        self.server = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def count(self, event, resource_id="", amount=1):
+        key = (event, str(resource_id))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    # Adds a gauge. "function()" returns its value, or a dictionary of values by label value (e.g. by resource id) for
+    # the label "label".
+    def gauge(self, name, help_text, function, label=None):
+        self.gauges.append((name, help_text, function, label))
+
+    # Returns the metrics in the text format of Prometheus.
+    def render(self):
+        with self.lock:
+            histograms = [(stage, histogram.lines("%s_stage_seconds" % self.prefix, "stage=\"%s\"" % escape(stage)))
+                          for (stage, histogram) in sorted(self.histograms.items())]
+            counters = sorted(self.counters.items())
+        lines = ["# HELP %s_stage_seconds Time taken by each stage of a tap, in seconds." % self.prefix,
+                 "# TYPE %s_stage_seconds histogram" % self.prefix]
+        for (stage, histogram_lines) in histograms:
+            lines += histogram_lines
+        lines += ["# HELP %s_events_total Taps, grants, denials, errors and network failures." % self.prefix,
+                  "# TYPE %s_events_total counter" % self.prefix]
+        for ((event, resource_id), value) in counters:
+            lines.append("%s_events_total{event=\"%s\",resource=\"%s\"} %d" % (self.prefix, escape(event), escape(resource_id), value))
+        for (name, help_text, function, label) in self.gauges:
+            try:
+                value = function()
+            except Exception as e:
+                logging.info("The metric {} could not be read: {}".format(name, e))
+                continue
+            if value is None:
+                continue
+            lines += ["# HELP %s_%s %s" % (self.prefix, name, help_text), "# TYPE %s_%s gauge" % (self.prefix, name)]
+            if label is None:
+                lines.append("%s_%s %s" % (self.prefix, name, format_value(value)))
+            else:
+                for (label_value, item) in sorted(value.items()):
+                    if item is not None:
+                        lines.append("%s_%s{%s=\"%s\"} %s" % (self.prefix, name, label, escape(label_value), format_value(item)))
+        lines += ["# HELP %s_start_time_seconds When the program started, in seconds since 1970." % self.prefix,
+                  "# TYPE %s_start_time_seconds gauge" % self.prefix,
+                  "%s_start_time_seconds %s" % (self.prefix, format_value(self.started))]
+        return "\n".join(lines) + "\n"
+
+    # Writes the metrics to "path", replacing the previous file in one step.
+    def write(self):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            f.write(self.render())
+        os.replace(temporary, self.path)
+        self.exports += 1
+
+    def report(self):
+        with self.lock:
+            parts = ["%s %d, mean %.0f ms" % (stage, histogram.count, histogram.sum / histogram.count * 1000)
+                     for (stage, histogram) in sorted(self.histograms.items()) if histogram.count]
+        return "Metrics: " + ("; ".join(parts) if parts else "no taps yet")
+
+    # Starts the thread that writes the file, and the HTTP endpoint.
+    def start(self):
+        if self.port is not None:
+            self.serve()
+        if self.path is not None:
+            self.thread = threading.Thread(target=self.run, name="Metrics")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+
+    def run(self):
+        failed = False
+        while not self.stopped.is_set():
+            try:
+                self.write()
+                failed = False
+            except OSError as e:
+                if not failed:
+                    logging.info("The metrics could not be written to {}: {}".format(self.path, e))
+                failed = True
+            self.stopped.wait(self.interval)
+
+    def serve(self):
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = HTTPServer(("", self.port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever, name="MetricsServer")
+        thread.daemon = True
+        thread.start()
+
+
+if __name__ == "__main__":
+    import random
+
+    metrics = Metrics()
+    runs = 100000
+    start = time.perf_counter()
+    for i in range(runs):
+        metrics.observe("read", 0.01)
+    print ("observe: %.2f us" % ((time.perf_counter() - start) / runs * 1e6))
+
+    metrics = Metrics()
+    metrics.gauge("outbox_depth", "Check ins and check outs waiting to be sent to Booked.", lambda: 2)
+    metrics.gauge("sync_age_seconds", "Seconds since the reservations of each machine came from Booked.",
+                  lambda: {"267": 42.0, "268": None}, label="resource")
+    for i in range(20):
+        metrics.count("tap", "267")
+        metrics.observe("read", random.uniform(0.005, 0.02))
+        metrics.observe("identify", random.uniform(0.0, 0.3))
+        if i % 4:
+            metrics.count("grant", "267")
+            metrics.observe("tap_to_relay", random.uniform(0.05, 0.4))
+        else:
+            metrics.count("deny", "267")
+    print (metrics.render())
+    print (metrics.report())
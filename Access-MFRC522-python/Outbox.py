@@ -0,0 +1,171 @@
+# Keeps the check ins and check outs that have to be written in Booked in a small SQLite database on the SD card, and
+# sends them from a background thread, so that a session never waits for Booked, and no check in or check out is lost
+# when the wi-fi is down or the Pi is restarted.
+#
+# add() writes the event in the database and wakes the thread up. The thread sends the events that are due in the
+# order they were added, up to "batch_size" at a time, and removes the ones that were sent in one transaction. An event
+# that could not be sent is tried again after "backoff", 2 * "backoff", ... seconds (at most "max_backoff", with some
+# randomness so that several Pis do not all come back at once). The events of a reservation are always sent in order: a
+# check out waits while the check in of the same reservation has not been sent. Events older than "max_age" seconds
+# are dropped, as Booked would refuse them anyway.
+#
+# depth(), oldest_age() and report() tell how many events are waiting and for how long.
+#
+# Running this file measures the time to add an event, and sends events to a fake Booked that fails half of the calls:
+#   python Outbox.py
+
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+CHECK_IN = "CheckIn"
+CHECK_OUT = "CheckOut"
+
+
+class Outbox:
+    # "send(kind, reference_number)" makes the call to Booked. It returns True when the event is done with (written in
+    # Booked, or refused for good by Booked), and False or raises an exception when it has to be tried again.
+    def __init__(self, path, send, batch_size=20, backoff=5, max_backoff=300, max_age=7 * 24 * 3600):
+        self.path = path
+        self.send = send
+        self.batch_size = batch_size
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+                                "reference_number TEXT NOT NULL, created REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+                                "next_try REAL NOT NULL)")
+        self.connection.commit()
+        self.sent = 0
+        self.failures = 0
+        self.dropped = 0
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    # Adds an event of "kind" (CHECK_IN or CHECK_OUT) for a reservation. It is in the database when add() returns.
+    def add(self, kind, reference_number):
+        now = time.time()
+        with self.lock:
+            self.connection.execute("INSERT INTO events (kind, reference_number, created, next_try) VALUES (?, ?, ?, ?)",
+                                    (kind, reference_number, now, now))
+            self.connection.commit()
+        self.wakeup.set()
+
+    # The number of events waiting to be sent.
+    def depth(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    # The seconds since the oldest waiting event was added, or 0 when there is none.
+    def oldest_age(self):
+        with self.lock:
+            oldest = self.connection.execute("SELECT MIN(created) FROM events").fetchone()[0]
+        return 0.0 if oldest is None else max(time.time() - oldest, 0.0)
+
+    def report(self):
+        return "Outbox: %d waiting, oldest %.0f s, %d sent, %d failed tries, %d dropped" % (
+            self.depth(), self.oldest_age(), self.sent, self.failures, self.dropped)
+
+    # Sends the events that are due, at most "batch_size" of them. Returns the time.time() at which the next waiting
+    # event is due, or None when there is none.
+    def drain(self):
+        now = time.time()
+        with self.lock:
+            rows = self.connection.execute("SELECT id, kind, reference_number, created, attempts, next_try FROM events "
+                                           "ORDER BY id").fetchall()
+        done = []
+        retries = []
+        blocked = set()     # The reservations with an earlier event that is still waiting.
+        next_due = None
+        for (event_id, kind, reference_number, created, attempts, next_try) in rows:
+            if now - created > self.max_age:
+                logging.info("Outbox: the {} of {} could not be sent for {:.0f} hours, dropped".format(
+                    kind, reference_number, (now - created) / 3600))
+                self.dropped += 1
+                done.append((event_id,))
+                continue
+            if reference_number in blocked:
+                continue
+            if next_try > now or len(done) + len(retries) >= self.batch_size:
+                blocked.add(reference_number)
+                next_due = next_try if next_due is None else min(next_due, next_try)
+                continue
+            try:
+                delivered = self.send(kind, reference_number)
+            except Exception as e:
+                logging.info("Outbox: the {} of {} could not be sent: {}".format(kind, reference_number, e))
+                delivered = False
+            if delivered:
+                self.sent += 1
+                done.append((event_id,))
+            else:
+                self.failures += 1
+                delay = min(self.backoff * (2 ** attempts), self.max_backoff) * random.uniform(0.8, 1.2)
+                retries.append((attempts + 1, now + delay, event_id))
+                blocked.add(reference_number)
+                next_due = now + delay if next_due is None else min(next_due, now + delay)
+        if done or retries:
+            with self.lock:
+                self.connection.executemany("DELETE FROM events WHERE id = ?", done)
+                self.connection.executemany("UPDATE events SET attempts = ?, next_try = ? WHERE id = ?", retries)
+                self.connection.commit()
+        return next_due
+
+    # Starts the thread that sends the events. The events left from before a restart are sent right away.
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="Outbox")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wakeup.clear()
+            try:
+                next_due = self.drain()
+            except sqlite3.Error:
+                logging.exception("Outbox: the database could not be read")
+                next_due = time.time() + 10
+            if next_due is None:
+                self.wakeup.wait()
+            else:
+                self.wakeup.wait(max(next_due - time.time(), 0))
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), "Outbox.sqlite")
+    calls = []
+
+    def send(kind, reference_number):
+        calls.append((kind, reference_number))
+        return random.random() < 0.5
+
+    outbox = Outbox(path, send, backoff=0.05, max_backoff=0.2)
+    runs = 200
+    start = time.perf_counter()
+    for i in range(runs):
+        outbox.add(CHECK_IN if i % 2 == 0 else CHECK_OUT, "ref%d" % (i // 2))
+    print ("add: %.2f ms per event" % ((time.perf_counter() - start) / runs * 1000))
+
+    outbox.start()
+    start = time.monotonic()
+    while outbox.depth() and time.monotonic() - start < 30:
+        time.sleep(0.05)
+    print ("sent %d events in %.1f s with %d calls" % (runs, time.monotonic() - start, len(calls)))
+    print (outbox.report())
+    last_check_in = dict((reference_number, i) for (i, (kind, reference_number)) in enumerate(calls) if kind == CHECK_IN)
+    order_ok = all(calls.index((CHECK_OUT, reference_number)) > i for (reference_number, i) in last_check_in.items())
+    print ("every check in sent before its check out: %s" % order_ok)
+    os.remove(path)
@@ -0,0 +1,281 @@
+# Polls several MFRC522 readers connected to the same Pi, for rooms where one Pi controls
+# several machines. Each reader is on its own SPI device (e.g. /dev/spidev0.0 and
+# /dev/spidev0.1 for the two chip selects of bus 0, /dev/spidev1.x for bus 1).
+#
+# Every reader belongs to a Station, which also has the relay of its machine and its
+# line of the LCD. The scheduler polls the stations in turn and reports when a tag
+# arrives at a station and when it is taken away:
+#   - A station without a tag is scanned with WUPA and anticollision. WUPA also wakes up
+#     halted tags, so a tag that was left on the reader is found again. When several
+#     cards are in the field (e.g. a lanyard with a building card), the first MIFARE
+#     Classic card found is the one reported.
+#   - A station without a tag is scanned every "scan_interval" seconds after a tag
+#     arrived or was taken away, as the next tap often comes soon after. Once nothing
+#     happened for "idle_after" seconds, the interval doubles at every scan up to
+#     "target_latency", the longest a tap may wait to be noticed, so that an idle Pi
+#     barely uses the CPU.
+#   - A station with a tag checks every "presence_interval" seconds that the tag is
+#     still there (MFRC522_IsPresent), and reports it removed after more than
+#     "allowed_misses" failed checks in a row.
+# The stations are polled when their time comes, starting with a different station
+# every round, so a busy station cannot starve the others. Polling a station takes at
+# most one command timeout of its reader (about 25 ms), so a tag is detected at most
+# "target_latency" plus one poll of every other station after it arrives. When the IRQ
+# pins of the readers are connected, the commands wait for the interrupt instead of
+# polling the reader, and the CPU sleeps while a reader waits for an answer.
+#
+# Running this file runs a benchmark with virtual readers (see VirtualMFRC522.py):
+#   python ReaderScheduler.py [max readers] [seconds per run] [irq]
+# and with "adaptive", the CPU time and detection latency of one idle reader for several
+# values of target_latency:
+#   python ReaderScheduler.py adaptive [seconds per run]
+
+import random
+import sys
+import time
+
+import MFRC522
+
+ARRIVED = "arrived"
+REMOVED = "removed"
+
+
+class Station:
+    # "relay" is the pin of the relay of the machine. "lcd" is the LCDRenderer of the LCD
+    # of the station and "lcd_line" the line of it that the station uses, or None when the
+    # station has the whole screen.
+    def __init__(self, name, reader, relay=None, lcd=None, lcd_line=None):
+        self.name = name
+        self.reader = reader
+        self.relay = relay
+        self.lcd = lcd
+        self.lcd_line = lcd_line
+        self.uid = None     # The tag on the reader, None when there is no tag.
+        self.misses = 0
+        self.next_poll = 0.0
+        self.interval = 0.0
+        self.last_activity = time.monotonic()
+        self.last_scan = None
+        self.lcd_text = None
+        # Free for the program using the scheduler, e.g. the session on the machine.
+        self.session = None
+
+    # Shows a message of one or two lines. A station with one line of the LCD only shows
+    # the first line, after its name. The message is drawn by the renderer's thread, so
+    # this never waits for the LCD.
+    def show(self, message):
+        if self.lcd is None or message == self.lcd_text:
+            return
+        self.lcd_text = message
+        if self.lcd_line is None:
+            self.lcd.show(message)
+        else:
+            self.lcd.write(self.lcd_line, self.name + " " + message.split("\n")[0])
+
+
+class ReaderScheduler:
+    def __init__(self, stations, scan_interval=0.05, presence_interval=0.25, allowed_misses=2,
+                 target_latency=0.3, idle_after=30):
+        self.stations = list(stations)
+        self.scan_interval = scan_interval
+        self.presence_interval = presence_interval
+        self.allowed_misses = allowed_misses
+        self.target_latency = max(target_latency, scan_interval)
+        self.idle_after = idle_after
+        self.turn = 0
+        self.polls = 0
+        for station in self.stations:
+            station.interval = scan_interval
+        # For report(). The latency of a detection is estimated as half the time since the
+        # previous scan of the station, plus the time the scan took.
+        self.detections = 0
+        self.detection_latency = 0.0
+        self.started = time.monotonic()
+        self.cpu_started = time.process_time()
+
+    # Polls every station whose time has come, and returns the list of events that
+    # happened, as (ARRIVED or REMOVED, station, uid) tuples. The uid is the whole UID of
+    # the card (see MFRC522_AnticollSelect), and the card is selected on ARRIVED.
+    def poll(self):
+        events = []
+        n = len(self.stations)
+        for i in range(n):
+            station = self.stations[(self.turn + i) % n]
+            if time.monotonic() >= station.next_poll:
+                event = self.poll_station(station)
+                if event is not None:
+                    events.append(event)
+        self.turn = (self.turn + 1) % n
+        return events
+
+    def poll_station(self, station):
+        reader = station.reader
+        self.polls += 1
+        if station.uid is None:
+            start = time.monotonic()
+            last_scan = station.last_scan
+            station.last_scan = start
+            station.next_poll = start + station.interval
+            (status, TagType) = reader.MFRC522_Request(reader.PICC_REQALL)
+            if status == reader.MI_OK:
+                (status, uid, sak) = reader.MFRC522_AnticollSelect()
+            if status != reader.MI_OK:
+                if start - station.last_activity >= self.idle_after:
+                    station.interval = min(station.interval * 2, self.target_latency)
+                return None
+            if not (sak & 0x08):
+                # Not a MIFARE Classic card: it is halted, and the other cards in the field
+                # are searched for a MIFARE Classic card. Otherwise the first card is kept.
+                reader.MFRC522_Halt()
+                for (card_uid, card_sak) in reader.MFRC522_Enumerate(reqMode=reader.PICC_REQIDL):
+                    if card_sak & 0x08:
+                        uid = card_uid
+                        break
+                if not reader.MFRC522_Reselect(uid):
+                    return None
+            station.uid = uid
+            station.misses = 0
+            if last_scan is not None:
+                self.detections += 1
+                self.detection_latency += (start - last_scan) / 2 + (time.monotonic() - start)
+            self.activity(station)
+            return (ARRIVED, station, uid)
+
+        station.next_poll = time.monotonic() + self.presence_interval
+        if reader.MFRC522_IsPresent(station.uid):
+            station.misses = 0
+            return None
+        station.misses += 1
+        if station.misses <= self.allowed_misses:
+            return None
+        uid = station.uid
+        station.uid = None
+        self.activity(station)
+        return (REMOVED, station, uid)
+
+    # Goes back to scanning the station every "scan_interval" seconds, as if a tag had just
+    # arrived or left.
+    def activity(self, station):
+        station.last_activity = time.monotonic()
+        station.interval = self.scan_interval
+        station.next_poll = min(station.next_poll, station.last_activity + self.scan_interval)
+
+    # Forgets the tag on the station, so that it is reported again if it is still there
+    # after "delay" seconds. Used when the tag could not be read.
+    def release(self, station, delay=0):
+        station.uid = None
+        station.last_scan = None
+        station.next_poll = time.monotonic() + delay
+
+    # Returns the CPU time used by the process in seconds per hour, and the mean detection
+    # latency in seconds, since the scheduler was created.
+    def statistics(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        cpu_per_hour = (time.process_time() - self.cpu_started) / elapsed * 3600
+        mean_latency = self.detection_latency / self.detections if self.detections else 0.0
+        return (cpu_per_hour, mean_latency)
+
+    def report(self):
+        (cpu_per_hour, mean_latency) = self.statistics()
+        return "%d polls, CPU %.1f s per hour, mean detection latency %.0f ms (%d tags)" % (
+            self.polls, cpu_per_hour, mean_latency * 1000, self.detections)
+
+    # Returns the time (a time.monotonic() value) at which the next station has to be polled.
+    def next_poll(self):
+        return min(station.next_poll for station in self.stations)
+
+    # Sleeps until the next station has to be polled, or until "until" (a time.monotonic()
+    # value) if that comes first.
+    def wait(self, until=None):
+        deadline = self.next_poll()
+        if until is not None:
+            deadline = min(deadline, until)
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Runs the scheduler for "seconds" with "readers" virtual readers, on which virtual tags
+# are put and taken away at random, and returns the statistics of the run.
+def benchmark(readers, seconds, irq=False, target_latency=0.3, idle_after=30, gap=(1.0, 2.0)):
+    import VirtualMFRC522
+
+    stations = []
+    for i in range(readers):
+        dev = "/dev/spidev%d.%d" % (i // 2, i % 2)
+        model = VirtualMFRC522.VirtualMFRC522()
+        transport = VirtualMFRC522.VirtualTransport(model)
+        reader = MFRC522.MFRC522(dev, transport=transport, irq=(5 + i) if irq else None)
+        stations.append(Station(dev, reader))
+    scheduler = ReaderScheduler(stations, target_latency=target_latency, idle_after=idle_after)
+
+    # Every reader gets a tag that stays between 0.3 and 1 s, and the next tag comes at
+    # least 1 s after the previous one was taken away, once its removal was reported.
+    inserted = {}
+    removed = {}
+    start = time.monotonic()
+    for (n, station) in enumerate(stations):
+        script = []
+        at = random.uniform(0, 1)
+        while at < seconds - 1.5:
+            hold = random.uniform(0.3, 1.0)
+            uid = [n, len(script) // 256, len(script) % 256, random.randint(0, 255)]
+            card = VirtualMFRC522.VirtualCard(uid)
+            script.append((at, "insert", card))
+            script.append((at + hold, "remove", card))
+            inserted[(station.name, tuple(uid))] = start + at
+            removed[(station.name, tuple(uid))] = start + at + hold
+            at += hold + random.uniform(gap[0], gap[1])
+        station.reader.transport.model.run_script(script)
+
+    arrivals = []
+    removals = []
+    cpu_start = time.process_time()
+    end = start + seconds
+    while time.monotonic() < end:
+        for (event, station, uid) in scheduler.poll():
+            key = (station.name, tuple(uid[0:4]))
+            if event == ARRIVED:
+                arrivals.append(time.monotonic() - inserted[key])
+            else:
+                removals.append(time.monotonic() - removed[key])
+        scheduler.wait(end)
+    cpu = time.process_time() - cpu_start
+
+    for station in stations:
+        station.reader.transport.close()
+    (cpu_per_hour, estimated_latency) = scheduler.statistics()
+    return {"readers": readers,
+            "estimated_latency": estimated_latency,
+            "tags": len(inserted),
+            "detected": len(arrivals),
+            "polls_per_second": scheduler.polls / float(seconds),
+            "cpu": cpu / seconds,
+            "arrival_mean": sum(arrivals) / max(len(arrivals), 1),
+            "arrival_max": max(arrivals) if arrivals else 0.0,
+            "removal_mean": sum(removals) / max(len(removals), 1)}
+
+
+# Measures one reader that gets a tag every 5 to 15 seconds, for several target latencies.
+def adaptive_benchmark(seconds):
+    print ("target (ms)  cpu (s/hour)  arrival mean/max (ms)  estimated mean (ms)")
+    for target_latency in [0.05, 0.1, 0.2, 0.3, 0.5, 1.0]:
+        result = benchmark(1, seconds, target_latency=target_latency, idle_after=2, gap=(5.0, 15.0))
+        print ("%11.0f  %12.0f  %10.0f / %-8.0f  %19.0f" %
+               (target_latency * 1000, result["cpu"] * 3600, result["arrival_mean"] * 1000,
+                result["arrival_max"] * 1000, result["estimated_latency"] * 1000))
+
+
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == "adaptive":
+    adaptive_benchmark(float(sys.argv[2]) if len(sys.argv) > 2 else 60)
+elif __name__ == "__main__":
+    max_readers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    irq = len(sys.argv) > 3 and sys.argv[3] == "irq"
+    print ("readers  tags  detected  polls/s   cpu   arrival mean/max (ms)  removal mean (ms)")
+    for readers in range(1, max_readers + 1):
+        result = benchmark(readers, seconds, irq)
+        print ("%7d  %4d  %8d  %7.0f  %4.0f%%  %10.0f / %-8.0f  %10.0f" %
+               (result["readers"], result["tags"], result["detected"], result["polls_per_second"],
+                result["cpu"] * 100, result["arrival_mean"] * 1000, result["arrival_max"] * 1000,
+                result["removal_mean"] * 1000))
@@ -0,0 +1,224 @@
+# Keeps in memory the reservations of one machine (a Booked resource) for the next hours, so that a tag can be
+# checked without waiting for Booked. A background thread fetches all the reservations of the machine for the
+# next "hours" hours every "refresh_interval" seconds, in one call, together with the UID of every user that has
+# one of them. A tap then only looks in memory.
+#
+# The reservations are merged by their reference number at every refresh: new and modified reservations are
+# added, and the ones that were cancelled or that ended are dropped. Only the users whose reservations changed are
+# indexed again, and the UID of a user is fetched again after "max_age" seconds, so a user who got a new tag is
+# not refused for long (and a lost tag is not accepted for long).
+# The cache is only trusted while the last successful refresh is less than "max_age" seconds old (is_fresh). When
+# Booked cannot be reached for longer, the caller has to ask Booked directly, as it did before the cache existed.
+#
+# With a "snapshot" (see CredentialSnapshot.py), the cache is also written to the SD card after the refreshes that
+# changed it (and at least every "max_age" seconds), and read back when the cache is started, e.g. after a restart. When
+# Booked cannot be reached at all, the caller may still use the cache while its data is less than "offline_max_age"
+# seconds old (usable_offline).
+#
+# The reservations of every user are kept in a ReservationIndex (see ReservationIndex.py), which compares the dates with
+# their time zone, and remembers its answer until the window of a reservation starts or ends.
+
+import datetime
+import logging
+import threading
+import time
+
+import ReservationIndex
+
+
+class ReservationCache:
+    # "get_reservations(resource_id, start, end)" returns the reservations of the machine between two datetimes,
+    # as given by Booked. "get_user_uids(user_ids)" returns a dictionary with the UID of each user, or False
+    # when the user has no UID. Both are called from the background thread and may raise an exception when
+    # Booked cannot be reached. A reservation may be used "early_minutes" minutes before it starts.
+    def __init__(self, resource_id, get_reservations, get_user_uids, hours=12, refresh_interval=60, max_age=300,
+                 early_minutes=10, snapshot=None, offline_max_age=6 * 3600):
+        self.resource_id = resource_id
+        self.get_reservations = get_reservations
+        self.get_user_uids = get_user_uids
+        self.hours = hours
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.early_minutes = early_minutes
+        self.snapshot = snapshot
+        self.offline_max_age = offline_max_age
+        self.lock = threading.Lock()
+        self.reservations = {}  # The reservations by reference number, as (user id, start, end, reservation).
+        self.by_user = {}       # The ReservationIndex of the reservations of every user.
+        self.user_uids = {}     # The UID of every user that has a reservation, as (uid, time.monotonic() it was fetched).
+        self.updated_at = None
+        self.synced_at = None   # The time.time() at which the data of the cache came from Booked.
+        self.generation = 0     # Goes up every time the reservations change.
+        self.thread = None
+        self.stopped = threading.Event()
+
+    # Fetches the reservations from Booked and merges them into the cache. Returns the number of reservations that
+    # were added, modified or dropped.
+    def refresh(self):
+        now = ReservationIndex.current_time()
+        fetched = self.entries(self.get_reservations(self.resource_id, now, now + datetime.timedelta(hours=self.hours)), now)
+
+        changed_users = set()
+        changes = 0
+        for (ref_num, entry) in fetched.items():
+            old = self.reservations.get(ref_num)
+            if old is None or old[0:3] != entry[0:3]:
+                changes += 1
+                changed_users.add(entry[0])
+                if old is not None:
+                    changed_users.add(old[0])
+        for (ref_num, old) in self.reservations.items():
+            if ref_num not in fetched:
+                changes += 1
+                changed_users.add(old[0])
+
+        by_user = self.index(fetched, changed_users, self.by_user)
+
+        # The UIDs of the new users, and of the users fetched more than "max_age" seconds ago.
+        monotonic = time.monotonic()
+        user_uids = dict((user_id, self.user_uids[user_id]) for user_id in by_user if user_id in self.user_uids and
+                         monotonic - self.user_uids[user_id][1] < self.max_age)
+        missing = [user_id for user_id in by_user if user_id not in user_uids]
+        if missing:
+            for (user_id, uid) in self.get_user_uids(missing).items():
+                user_uids[user_id] = (uid, monotonic)
+
+        with self.lock:
+            self.reservations = fetched
+            self.by_user = by_user
+            self.user_uids = user_uids
+            self.updated_at = time.monotonic()
+            self.synced_at = time.time()
+            if changes:
+                self.generation += 1
+        if changes:
+            logging.info("Reservation cache of {}: {} reservations, {} changed".format(self.resource_id, len(fetched), changes))
+        if self.snapshot is not None and (changes or self.snapshot.saved_at is None or
+                                          time.monotonic() - self.snapshot.saved_at >= self.max_age):
+            self.save_snapshot()
+        return changes
+
+    # Returns the reservations of the machine that did not end at "now", by reference number, as (user id, start, end,
+    # reservation).
+    def entries(self, reservations, now):
+        fetched = {}
+        for reservation in reservations:
+            if str(reservation["resourceId"]) != str(self.resource_id):
+                continue
+            end = ReservationIndex.parse_booked_time(reservation["endDate"])
+            if end <= now:
+                continue
+            fetched[reservation["referenceNumber"]] = (int(reservation["userId"]),
+                                                     ReservationIndex.parse_booked_time(reservation["startDate"]), end, reservation)
+        return fetched
+
+    # Returns a copy of "by_user" in which the reservations of "user_ids" are taken again from "fetched".
+    def index(self, fetched, user_ids, by_user):
+        by_user = dict(by_user)
+        for user_id in user_ids:
+            intervals = [(self.resource_id, start, end, reservation) for (entry_user, start, end, reservation) in fetched.values()
+                         if entry_user == user_id]
+            if intervals:
+                by_user[user_id] = ReservationIndex.ReservationIndex(intervals, self.early_minutes)
+            else:
+                by_user.pop(user_id, None)
+        return by_user
+
+    def save_snapshot(self):
+        with self.lock:
+            reservations = [entry[3] for entry in self.reservations.values()]
+            user_uids = dict((user_id, entry[0]) for (user_id, entry) in self.user_uids.items())
+            synced_at = self.synced_at
+        try:
+            self.snapshot.save(self.resource_id, reservations, user_uids, synced_at)
+        except OSError as e:
+            logging.info("The snapshot of {} could not be written: {}".format(self.resource_id, e))
+
+    # Fills the cache with the snapshot. The cache is not fresh, so Booked is still asked at every tap until the first
+    # refresh, but the snapshot is used when Booked cannot be reached. Returns whether there was a snapshot.
+    def load_snapshot(self):
+        loaded = self.snapshot.load(self.resource_id)
+        if loaded is None:
+            return False
+        (reservations, uids, synced_at) = loaded
+        fetched = self.entries(reservations, ReservationIndex.current_time())
+        by_user = self.index(fetched, set(entry[0] for entry in fetched.values()), {})
+        # The UIDs are fetched again at the first refresh.
+        fetched_at = time.monotonic() - self.max_age
+        user_uids = dict((user_id, (uid, fetched_at)) for (user_id, uid) in uids.items())
+        with self.lock:
+            self.reservations = fetched
+            self.by_user = by_user
+            self.user_uids = user_uids
+            self.synced_at = synced_at
+            self.generation += 1
+        logging.info("Reservation cache of {}: {} reservations from the snapshot of {:.0f} minutes ago (version {})".format(
+            self.resource_id, len(fetched), self.sync_age() / 60, self.snapshot.version))
+        return True
+
+    # Whether the cache can be trusted, i.e. it was refreshed less than "max_age" seconds ago.
+    def is_fresh(self):
+        updated_at = self.updated_at
+        return updated_at is not None and time.monotonic() - updated_at < self.max_age
+
+    # The seconds since the data of the cache came from Booked, or None when it never did.
+    def sync_age(self):
+        synced_at = self.synced_at
+        return None if synced_at is None else time.time() - synced_at
+
+    # Whether the cache may be used when Booked cannot be reached, i.e. its data is less than "offline_max_age" seconds
+    # old. A clock that went back (e.g. a Pi that restarted without the time from the network) does not count.
+    def usable_offline(self):
+        age = self.sync_age()
+        return age is not None and 0 <= age < self.offline_max_age
+
+    # Returns the UID of a user that has a reservation on the machine, or None when the cache does not know it.
+    def user_uid(self, user_id):
+        with self.lock:
+            entry = self.user_uids.get(user_id)
+        return None if entry is None else entry[0]
+
+    # Returns the reservation of the user that is active at "now" (a datetime with a time zone, by default the current
+    # time), or None.
+    def active_reservation(self, user_id, now=None):
+        with self.lock:
+            index = self.by_user.get(user_id)
+        return None if index is None else index.active(self.resource_id, now)
+
+    # Returns the seconds until the next time a reservation of the user becomes usable or ends, or None when the user has
+    # no reservation coming. Until then, the answer of active_reservation for the user does not change.
+    def next_boundary(self, user_id, now=None):
+        if now is None:
+            now = ReservationIndex.current_time()
+        with self.lock:
+            index = self.by_user.get(user_id)
+        if index is None:
+            return None
+        until = index.window(self.resource_id, now)[1]
+        return None if until is None else (until - now).total_seconds()
+
+    # Starts the thread that keeps the cache up to date, after reading the snapshot if there is one. The first refresh
+    # is done right away. When Booked cannot be reached, the refresh is tried again after 10 seconds.
+    def start(self):
+        if self.snapshot is not None:
+            self.load_snapshot()
+        self.thread = threading.Thread(target=self.run, name="ReservationCache-{}".format(self.resource_id))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.refresh()
+                delay = self.refresh_interval
+            except OSError as e:
+                # Booked cannot be reached (the exceptions of requests are OSErrors).
+                logging.info("The reservations of {} could not be updated: {}".format(self.resource_id, e))
+                delay = min(10, self.refresh_interval)
+            except Exception:
+                logging.exception("The reservations of {} could not be updated".format(self.resource_id))
+                delay = min(10, self.refresh_interval)
+            self.stopped.wait(delay)
@@ -0,0 +1,139 @@
+# Finds the reservation that can be used on a machine at a given time, among all the reservations of a user (or of
+# several machines).
+#
+# The dates of Booked (e.g. "2019-08-04T10:00:00-0700") are read once, with their time zone, so that a reservation made
+# in another time zone, or that crosses a change of daylight saving time, is compared with the time it really is. The
+# reservations are then indexed by machine (resource id) and sorted by the time they become usable ("early_minutes"
+# before they start), so that finding the one that is usable now is a binary search (bisect) instead of a look at
+# every reservation.
+#
+# The answer for a machine stays the same until a reservation becomes usable or the one found ends, so it is kept
+# until then: the taps that follow in the same window do not search again.
+#
+# The edge cases (the 10 minutes before a reservation, its end, time zones and daylight saving time) are tested in
+# tests/test_reservation_index.py:
+#   python -m pytest tests
+# Running this file measures a search among many reservations:
+#   python ReservationIndex.py
+
+import bisect
+import datetime
+import re
+import time
+
+BOOKED_TIME = re.compile(r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d)(?::(\d\d)(?:\.\d+)?)?(Z|[+-]\d\d:?\d\d)?$")
+
+
+# Converts a date given by Booked (e.g. "2019-08-04T10:00:00-0700") into a datetime with its time zone. A date without
+# a time zone is in the time of the Pi. Raises ValueError when the text is not a date.
+def parse_booked_time(text):
+    match = BOOKED_TIME.match(text.strip())
+    if match is None:
+        raise ValueError("Not a date of Booked: {!r}".format(text))
+    (year, month, day, hour, minute, second, offset) = match.groups()
+    moment = datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second or 0))
+    if offset is None:
+        # mktime knows whether daylight saving time applies at that time on the Pi.
+        return datetime.datetime.fromtimestamp(time.mktime(moment.timetuple()), datetime.timezone.utc)
+    if offset == "Z":
+        return moment.replace(tzinfo=datetime.timezone.utc)
+    offset = offset.replace(":", "")
+    minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+    return moment.replace(tzinfo=datetime.timezone(datetime.timedelta(minutes=minutes if offset[0] == "+" else -minutes)))
+
+
+# The current time, as a datetime with a time zone, to compare with the dates of Booked.
+def current_time():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+# Returns the reservations given by Booked as (resource id, start, end, reservation).
+def parse_reservations(reservations):
+    return [(str(reservation["resourceId"]), parse_booked_time(reservation["startDate"]),
+             parse_booked_time(reservation["endDate"]), reservation) for reservation in reservations]
+
+
+class ReservationIndex:
+    # "intervals" are (resource id, start, end, reservation), see parse_reservations. A reservation is usable from
+    # "early_minutes" minutes before its start until its end.
+    def __init__(self, intervals, early_minutes=10):
+        early = datetime.timedelta(minutes=early_minutes)
+        windows = {}
+        for (resource_id, start, end, reservation) in intervals:
+            windows.setdefault(str(resource_id), []).append((start - early, end, reservation))
+        # For every resource, the windows sorted by their start, as four lists: the starts, the ends, the latest end
+        # of the windows up to each one, and the reservations.
+        self.resources = {}
+        for (resource_id, resource_windows) in windows.items():
+            resource_windows.sort(key=lambda window: window[0])
+            ends = [window[1] for window in resource_windows]
+            latest_ends = []
+            for end in ends:
+                latest_ends.append(end if not latest_ends else max(latest_ends[-1], end))
+            self.resources[resource_id] = ([window[0] for window in resource_windows], ends, latest_ends,
+                                           [window[2] for window in resource_windows])
+        self.memo = {}      # The last answer for every resource, as (time asked, time it changes, reservation).
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self):
+        return sum(len(windows[0]) for windows in self.resources.values())
+
+    # Returns the reservation usable on the resource at "now" (a datetime with a time zone, by default the current
+    # time), or None.
+    def active(self, resource_id, now=None):
+        return self.window(resource_id, now)[0]
+
+    # Returns (reservation, until): the reservation usable on the resource at "now", or None, and the time until which
+    # the answer stays the same, or None when it does not change anymore.
+    def window(self, resource_id, now=None):
+        if now is None:
+            now = current_time()
+        resource_id = str(resource_id)
+        self.lookups += 1
+        memo = self.memo.get(resource_id)
+        if memo is not None and memo[0] <= now and (memo[1] is None or now < memo[1]):
+            self.hits += 1
+            return (memo[2], memo[1])
+        (reservation, until) = self.search(resource_id, now)
+        self.memo[resource_id] = (now, until, reservation)
+        return (reservation, until)
+
+    def search(self, resource_id, now):
+        windows = self.resources.get(resource_id)
+        if windows is None:
+            return (None, None)
+        (starts, ends, latest_ends, reservations) = windows
+        # The windows before "after" started before now. Going back from the last of them, the ones that did not end
+        # are found until the latest end is before now. When several are usable, the one that started first is the one.
+        after = bisect.bisect_left(starts, now)
+        found = None
+        i = after - 1
+        while i >= 0 and latest_ends[i] > now:
+            if ends[i] > now:
+                found = i
+            i -= 1
+        if found is not None:
+            return (reservations[found], ends[found])
+        return (None, starts[after] if after < len(starts) else None)
+
+
+if __name__ == "__main__":
+    # A user with a reservation every hour for a year.
+    start = parse_booked_time("2026-01-01T00:00:00-0800")
+    intervals = [("7", start + datetime.timedelta(hours=i), start + datetime.timedelta(hours=i, minutes=45), {"n": i})
+                 for i in range(365 * 24)]
+    index = ReservationIndex(intervals)
+    moments = [start + datetime.timedelta(minutes=i * 7919 % (365 * 24 * 60)) for i in range(10000)]
+    begin = time.perf_counter()
+    for moment in moments:
+        index.search("7", moment)
+    searched = time.perf_counter() - begin
+    begin = time.perf_counter()
+    for moment in moments:
+        for (resource_id, window_start, end, reservation) in intervals:
+            if window_start - datetime.timedelta(minutes=10) < moment < end:
+                break
+    scanned = time.perf_counter() - begin
+    print ("%d reservations: %.1f us per search, %.1f us looking at every reservation" % (
+        len(index), searched / len(moments) * 1e6, scanned / len(moments) * 1e6))
@@ -0,0 +1,271 @@
+# The session of one machine, as a state machine run by an asyncio event loop:
+#
+#   IDLE --tag arrived--> IDENTIFYING --access granted--> ACTIVE --tag removed--> CRITICAL --critical_time--> ENDED --> IDLE
+#                              |                             ^                      |
+#                              +--refused or error--> IDLE   +----tag put back------+
+#
+# The reader of the machine sends the events (tag_arrived and tag_removed, from ReaderScheduler). Nothing sleeps:
+# the messages, the buzzer and critical mode end with timers of the loop (loop.call_later), and the calls to Booked
+# (identifying the tag, checking out) run in the threads of the loop's executor, so that while Booked answers, the
+# loop keeps polling the readers, updating the screen and running the other machines.
+#
+# The work of the transitions is done by "hooks", an object with these methods:
+#   read_tag(station, uid)            Reads the tag that arrived, returns (uid_int, user_id_int), or None when it could
+#                                     not be read (the tag is then released to the scheduler by the hook).
+#   authorize(station, session)       Runs in a thread. Identifies the user of the session, and checks in. Returns None
+#                                     when the session may start, or the message to show when it may not.
+#   failed(station, session, error)   Called when authorize raised "error". Returns the message to show.
+#   relay(station, on)                Turns the relay of the machine on or off.
+#   end(station, session)             Runs in a thread when the session ended. Checks out.
+#   idle_message(station)             The message shown while there is no session.
+#   buzzer(on)                        Turns the buzzer on or off.
+#
+# The current state, the time left on every timer (timers) and the last transitions (history) can be read at any time,
+# and describe() puts them in one line for the log file.
+#
+# Running this file plays a session with fake hooks and prints its transitions:
+#   python SessionMachine.py
+# The transitions are tested in tests/test_session_machine.py:
+#   python -m pytest tests
+
+import asyncio
+import collections
+import logging
+
+IDLE = "idle"
+IDENTIFYING = "identifying"
+ACTIVE = "active"
+CRITICAL = "critical"
+ENDED = "ended"
+
+
+class SessionMachine:
+    # "station" is the ReaderScheduler.Station of the machine and "scheduler" the ReaderScheduler polling it. A refusal
+    # or an error stays on the screen "message_time" seconds. When the tag is taken away during a session, the buzzer
+    # sounds for "buzzer_time" seconds, the two messages of critical mode alternate every "alternate_time" seconds, and
+    # the session ends if the tag is not put back within "critical_time" seconds.
+    def __init__(self, station, scheduler, hooks, loop, critical_time=60, message_time=3, buzzer_time=3,
+                 alternate_time=2.5, history_size=50):
+        self.station = station
+        self.scheduler = scheduler
+        self.hooks = hooks
+        self.loop = loop
+        self.critical_time = critical_time
+        self.message_time = message_time
+        self.buzzer_time = buzzer_time
+        self.alternate_time = alternate_time
+        self.state = IDLE
+        self.session = None
+        self.history = collections.deque(maxlen=history_size)  # The last transitions, as (loop.time(), from, to, event).
+        self.timer_handles = {}     # The running timers by name, as (loop.time() at which it fires, handle).
+        self.tasks = set()          # The calls to Booked running in threads.
+        self.alternate = 0
+
+    def transition(self, state, event):
+        self.history.append((self.loop.time(), self.state, state, event))
+        logging.debug("Station {}: {} -> {} ({})".format(self.station.name, self.state, state, event))
+        self.state = state
+
+    # Runs "callback" in "delay" seconds, replacing the timer of the same name.
+    def set_timer(self, name, delay, callback):
+        self.cancel_timer(name)
+        handle = self.loop.call_later(delay, self.fire, name, callback)
+        self.timer_handles[name] = (self.loop.time() + delay, handle)
+
+    def fire(self, name, callback):
+        self.timer_handles.pop(name, None)
+        callback()
+
+    def cancel_timer(self, name):
+        timer = self.timer_handles.pop(name, None)
+        if timer is not None:
+            timer[1].cancel()
+
+    # Returns the seconds left on every running timer, by name.
+    def timers(self):
+        now = self.loop.time()
+        return dict((name, max(at - now, 0.0)) for (name, (at, handle)) in self.timer_handles.items())
+
+    def describe(self):
+        timers = ", ".join("%s in %.1f s" % (name, left) for (name, left) in sorted(self.timers().items()))
+        return "{}: {}{}".format(self.station.name, self.state, " (" + timers + ")" if timers else "")
+
+    # Runs "function(*args)" in a thread of the executor, and "done(result, error)" on the loop when it returns.
+    def run_in_thread(self, done, function, *args):
+        async def call():
+            try:
+                result = await self.loop.run_in_executor(None, function, *args)
+            except Exception as e:
+                done(None, e)
+            else:
+                done(result, None)
+        task = self.loop.create_task(call())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    # Shows a message for "message_time" seconds, then the idle message if there is still no session.
+    def show_message(self, message):
+        self.station.show(message)
+        self.set_timer("message", self.message_time, self.refresh)
+
+    # Shows the idle message when there is no session and no message on the screen, e.g. after the admin table was
+    # downloaded.
+    def refresh(self):
+        if self.state == IDLE and "message" not in self.timer_handles:
+            self.station.show(self.hooks.idle_message(self.station))
+
+    # "at" is the loop.time() at which the reader noticed the tag, by default now. It is kept in the session as "arrived",
+    # before the tag is read, so that the time from the tap to the relay includes reading the tag.
+    def tag_arrived(self, uid, at=None):
+        if self.state == IDLE:
+            arrived = self.loop.time() if at is None else at
+            tag = self.hooks.read_tag(self.station, uid)
+            if tag is None:
+                return
+            self.cancel_timer("message")
+            self.session = {"uid": uid, "uid_int": tag[0], "user_id_int": tag[1], "removed": False, "arrived": arrived}
+            self.transition(IDENTIFYING, "tag arrived")
+            self.run_in_thread(self.authorized, self.hooks.authorize, self.station, self.session)
+        elif self.state in (IDENTIFYING, CRITICAL) and uid == self.session["uid"]:
+            self.session["removed"] = False
+            if self.state == CRITICAL:
+                self.cancel_timer("critical")
+                self.cancel_timer("alternate")
+                self.transition(ACTIVE, "tag put back")
+                self.station.show("Authenticated\nDon't Remove Tag")
+        else:
+            # Another tag was put on a machine that has a session. It is ignored, and the reader keeps looking for the
+            # tag of the session.
+            self.scheduler.release(self.station, self.scheduler.presence_interval)
+
+    def tag_removed(self):
+        if self.state == IDENTIFYING:
+            # Critical mode starts if access is granted.
+            self.session["removed"] = True
+        elif self.state == ACTIVE:
+            self.start_critical()
+
+    def authorized(self, refusal, error):
+        session = self.session
+        if error is not None:
+            self.session = None
+            self.transition(IDLE, "error")
+            self.show_message(self.hooks.failed(self.station, session, error))
+        elif refusal is not None:
+            self.session = None
+            self.transition(IDLE, "refused")
+            self.show_message(refusal)
+        else:
+            self.transition(ACTIVE, "access granted")
+            self.station.show("Authenticated\nDon't Remove Tag")
+            self.hooks.relay(self.station, True)
+            if session["removed"]:
+                self.start_critical()
+
+    def start_critical(self):
+        self.transition(CRITICAL, "tag removed")
+        self.hooks.buzzer(True)
+        self.set_timer("buzzer", self.buzzer_time, lambda: self.hooks.buzzer(False))
+        self.set_timer("critical", self.critical_time, self.end_session)
+        self.alternate = 0
+        self.alternate_message()
+
+    # Shows the two messages of critical mode in turn. The reader keeps scanning fast, so that the tag is noticed as soon
+    # as it is put back.
+    def alternate_message(self):
+        if self.alternate % 2 == 0:
+            self.station.show("Ending Session\nIn %ds" % self.critical_time)
+        else:
+            self.station.show("Continue?\nReinsert Tag")
+        self.alternate += 1
+        self.scheduler.activity(self.station)
+        self.set_timer("alternate", self.alternate_time, self.alternate_message)
+
+    def end_session(self):
+        session = self.session
+        self.session = None
+        self.cancel_timer("alternate")
+        self.transition(ENDED, "critical time over")
+        self.hooks.relay(self.station, False)
+        self.run_in_thread(self.checked_out, self.hooks.end, self.station, session)
+        # The machine takes a new tag right away, while Booked is told about the end of the session.
+        self.transition(IDLE, "session over")
+        self.refresh()
+
+    def checked_out(self, result, error):
+        if error is not None:
+            logging.info("The end of the session on {} could not be written in Booked: {}".format(self.station.name, error))
+
+
+# Hooks for the simulation: the second tag is not allowed, and Booked answers in 0.2 seconds.
+class FakeHooks:
+    def __init__(self):
+        self.log = []
+
+    def read_tag(self, station, uid):
+        return (uid[0], uid[0] * 10)
+
+    def authorize(self, station, session):
+        import time
+        time.sleep(0.2)
+        return None if session["uid_int"] == 1 else "No Reservations\nFound"
+
+    def failed(self, station, session, error):
+        return "No Wifi\nRestart Pi"
+
+    def relay(self, station, on):
+        self.log.append("relay " + ("on" if on else "off"))
+
+    def end(self, station, session):
+        self.log.append("check out")
+
+    def idle_message(self, station):
+        return "Ready\nInsert Tag"
+
+    def buzzer(self, on):
+        self.log.append("buzzer " + ("on" if on else "off"))
+
+
+class FakeScheduler:
+    presence_interval = 0.25
+
+    def release(self, station, delay=0):
+        pass
+
+    def activity(self, station):
+        pass
+
+
+class FakeStation:
+    name = "machine"
+
+    def __init__(self, hooks):
+        self.hooks = hooks
+
+    def show(self, message):
+        self.hooks.log.append("screen " + repr(message))
+
+
+# Plays a session in which a tag is refused, another one is allowed, taken away, put back, and taken away for good.
+def simulate():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    hooks = FakeHooks()
+    machine = SessionMachine(FakeStation(hooks), FakeScheduler(), hooks, loop, critical_time=1.0, message_time=0.3,
+                             buzzer_time=0.3, alternate_time=0.4)
+    script = [(0.0, "arrived", [2]), (0.4, "removed", None), (0.6, "arrived", [1]), (1.0, "removed", None),
+              (1.5, "arrived", [1]), (1.7, "removed", None)]
+    for (at, event, uid) in script:
+        loop.call_later(at, machine.tag_arrived if event == "arrived" else machine.tag_removed, *([uid] if uid else []))
+    loop.call_later(2.0, lambda: print ("at 2.0 s: " + machine.describe()))
+    loop.run_until_complete(asyncio.sleep(3.0))
+    loop.close()
+    start = machine.history[0][0]
+    for (at, old, new, event) in machine.history:
+        print ("%5.2f s  %-11s -> %-11s %s" % (at - start, old, new, event))
+    print (", ".join(hooks.log))
+
+
+if __name__ == "__main__":
+    simulate()
@@ -0,0 +1,646 @@
+# Register-level software model of the MFRC522 reader, with emulated MIFARE Classic 1K
+# cards in its field. It is used through MFRC522Transport to run the driver, and the
+# scripts built on it, on computers without a reader.
+#
+# The model keeps the registers and the FIFO of the reader, executes the Transceive,
+# Transmit, MFAuthent, CalcCRC and SoftReset commands, and drives the IRQ line. The
+# cards follow the ISO 14443-3 states (idle, ready, active, halt), answer REQA/WUPA,
+# anticollision and select at every cascade level, and keep their UID, sector keys,
+# Crypto1 authentication state and block contents. Frames sent while the Crypto1
+# state of the reader and the card do not agree are garbage to the card, just like
+# with a real card.
+#
+# The following environment variables configure the virtual readers:
+#   MFRC522_VIRTUAL_LATENCY     seconds added to every SPI transaction (default 0).
+#   MFRC522_VIRTUAL_TIME_SCALE  multiplies the RF timings of the reader; 0 makes every
+#                               command complete instantly (default 1).
+#   MFRC522_VIRTUAL_SCRIPT      JSON file with card insertions and removals, e.g.
+#       [{"at": 2, "action": "insert", "uid": [18, 52, 86, 120],
+#         "blocks": {"8": [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 2, 3, 4]}},
+#        {"at": 30, "action": "remove", "uid": [18, 52, 86, 120]}]
+#   Each event may also name the "device" of the reader (default /dev/spidev0.0).
+#
+# From Python, reader(dev) returns the model of a virtual reader, on which cards can
+# be inserted and removed directly or with run_script().
+
+import json
+import os
+import threading
+import time
+
+
+# Bit by bit implementation of CRC_A. It is deliberately independent from the lookup
+# table in MFRC522.py, so that CRC_VERIFY compares two different implementations.
+def crc_a(data):
+    crc = 0x6363
+    for b in data:
+        b = (b ^ crc) & 0xFF
+        b = (b ^ (b << 4)) & 0xFF
+        crc = ((crc >> 8) ^ (b << 8) ^ (b << 3) ^ (b >> 4)) & 0xFFFF
+    return [crc & 0xFF, crc >> 8]
+
+
+def bytes_to_bits(data, last_bits=0):
+    bits = []
+    for i, byte in enumerate(data):
+        count = 8
+        if i == len(data) - 1 and last_bits:
+            count = last_bits
+        for bit in range(count):
+            bits.append((byte >> bit) & 1)
+    return bits
+
+
+def bits_to_bytes(bits):
+    data = []
+    for i in range(0, len(bits), 8):
+        byte = 0
+        for bit, value in enumerate(bits[i:i + 8]):
+            byte |= value << bit
+        data.append(byte)
+    return data
+
+
+# A MIFARE Classic 1K card. "uid" has 4, 7 or 10 bytes, "blocks" maps block numbers to
+# their 16 bytes, and "keys" maps sector numbers to (key A, key B).
+class VirtualCard:
+    IDLE = 0
+    READY = 1
+    ACTIVE = 2
+    HALT = 3
+
+    DEFAULT_KEY = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
+    DEFAULT_ACCESS = [0xFF, 0x07, 0x80, 0x69]
+
+    def __init__(self, uid, blocks=None, keys=None, sak=0x08, atqa=(0x04, 0x00)):
+        self.uid = list(uid)
+        self.sak = sak
+        self.atqa = list(atqa)
+        self.blocks = [[0] * 16 for i in range(64)]
+        for sector in range(16):
+            key_a, key_b = self.DEFAULT_KEY, self.DEFAULT_KEY
+            if keys is not None and sector in keys:
+                key_a, key_b = keys[sector]
+            self.blocks[sector * 4 + 3] = list(key_a) + self.DEFAULT_ACCESS + list(key_b)
+        if len(self.uid) == 4:
+            self.blocks[0][0:5] = self.uid + [self.uid[0] ^ self.uid[1] ^ self.uid[2] ^ self.uid[3]]
+        else:
+            self.blocks[0][0:len(self.uid)] = self.uid
+        if blocks is not None:
+            for addr, data in blocks.items():
+                self.blocks[addr] = list(data)
+        self.power_off()
+
+    def power_off(self):
+        self.state = self.IDLE
+        self.halted = False
+        self.crypto = False
+        self.auth_sector = None
+        self.cascade = 0
+        self.pending_write = None
+
+    # UID bytes sent at each cascade level, including the cascade tag and the BCC.
+    def cascade_bytes(self, level):
+        uid = self.uid
+        if len(uid) == 4:
+            parts = [uid]
+        elif len(uid) == 7:
+            parts = [[0x88] + uid[0:3], uid[3:7]]
+        else:
+            parts = [[0x88] + uid[0:3], [0x88] + uid[3:6], uid[6:10]]
+        part = parts[level]
+        return part + [part[0] ^ part[1] ^ part[2] ^ part[3]]
+
+    def auth_uid(self):
+        return self.uid[-4:]
+
+    def idle(self):
+        self.state = self.HALT if self.halted else self.IDLE
+        self.crypto = False
+        self.auth_sector = None
+        self.pending_write = None
+
+    # Returns the response of the card as a list of bits, or None if it stays silent.
+    def receive(self, bits, reader_crypto):
+        if self.crypto != reader_crypto:
+            # The frame is encrypted for one side and not for the other, so the card
+            # sees garbage and falls back to idle.
+            self.idle()
+            return None
+        data = bits_to_bytes(bits)
+        if len(bits) == 7:
+            if data[0] == 0x26 and self.state == self.IDLE or data[0] == 0x52 and self.state in (self.IDLE, self.HALT):
+                self.state = self.READY
+                self.cascade = 0
+                return bytes_to_bits(self.atqa)
+            self.idle()
+            return None
+        if len(bits) < 16:
+            self.idle()
+            return None
+        if self.state == self.READY and data[0] in (0x93, 0x95, 0x97):
+            return self.anticollision(bits, data)
+        if self.state != self.ACTIVE:
+            self.idle()
+            return None
+        if len(bits) % 8 != 0 or crc_a(data[:-2]) != data[-2:]:
+            self.idle()
+            return None
+        frame = data[:-2]
+        if self.pending_write is not None:
+            addr = self.pending_write
+            self.pending_write = None
+            if len(frame) != 16:
+                return bytes_to_bits([0x04], 4)
+            self.blocks[addr] = list(frame)
+            return bytes_to_bits([0x0A], 4)
+        if frame[0] == 0x50 and len(frame) == 2:
+            self.halted = True
+            self.idle()
+            return None
+        if frame[0] in (0x30, 0xA0) and len(frame) == 2:
+            addr = frame[1]
+            if not self.crypto or addr // 4 != self.auth_sector or addr > 63:
+                self.idle()
+                return bytes_to_bits([0x04], 4)
+            if frame[0] == 0x30:
+                block = list(self.blocks[addr])
+                if addr % 4 == 3:
+                    block[0:6] = [0] * 6
+                return bytes_to_bits(block + crc_a(block))
+            if addr == 0:
+                return bytes_to_bits([0x04], 4)
+            self.pending_write = addr
+            return bytes_to_bits([0x0A], 4)
+        self.idle()
+        return bytes_to_bits([0x04], 4)
+
+    def anticollision(self, bits, data):
+        level = (data[0] - 0x93) // 2
+        if level != self.cascade:
+            self.idle()
+            return None
+        uid_bits = bytes_to_bits(self.cascade_bytes(level))
+        nvb = data[1]
+        if nvb == 0x70:
+            if len(bits) != 72 or crc_a(data[:-2]) != data[-2:]:
+                return None
+            if data[2:7] != self.cascade_bytes(level):
+                return None
+            if level < self.cascade_levels() - 1:
+                self.cascade = level + 1
+                sak = [0x04]
+            else:
+                self.state = self.ACTIVE
+                sak = [self.sak]
+            return bytes_to_bits(sak + crc_a(sak))
+        known = ((nvb >> 4) - 2) * 8 + (nvb & 0x0F)
+        if known < 0 or known > 40 or bits[16:16 + known] != uid_bits[:known]:
+            return None
+        return uid_bits[known:]
+
+    def cascade_levels(self):
+        return {4: 1, 7: 2, 10: 3}[len(self.uid)]
+
+    # Called by the reader model when the MFAuthent command is executed.
+    def authenticate(self, mode, addr, key, uid):
+        if self.state != self.ACTIVE or uid != self.auth_uid() or addr > 63:
+            self.idle()
+            return False
+        trailer = self.blocks[(addr // 4) * 4 + 3]
+        expected = trailer[0:6] if mode == 0x60 else trailer[10:16]
+        if list(key) != expected:
+            self.idle()
+            return False
+        self.crypto = True
+        self.auth_sector = addr // 4
+        return True
+
+
+# The reader. Commands take as long as they would over the air, and the timer expires
+# after the period set in TModeReg/TPrescalerReg/TReloadReg when no card answers.
+class VirtualMFRC522:
+    CommandReg = 0x01
+    CommIEnReg = 0x02
+    DivIEnReg = 0x03
+    CommIrqReg = 0x04
+    DivIrqReg = 0x05
+    ErrorReg = 0x06
+    Status2Reg = 0x08
+    FIFODataReg = 0x09
+    FIFOLevelReg = 0x0A
+    ControlReg = 0x0C
+    BitFramingReg = 0x0D
+    CollReg = 0x0E
+    TxControlReg = 0x14
+    CRCResultRegM = 0x21
+    CRCResultRegL = 0x22
+    TModeReg = 0x2A
+    TPrescalerReg = 0x2B
+    TReloadRegH = 0x2C
+    TReloadRegL = 0x2D
+    VersionReg = 0x37
+
+    PCD_IDLE = 0x00
+    PCD_CALCCRC = 0x03
+    PCD_TRANSMIT = 0x04
+    PCD_RECEIVE = 0x08
+    PCD_TRANSCEIVE = 0x0C
+    PCD_AUTHENT = 0x0E
+    PCD_RESETPHASE = 0x0F
+
+    RESET_VALUES = {0x01: 0x20, 0x02: 0x80, 0x04: 0x14, 0x0C: 0x10, 0x0E: 0x80,
+                    0x11: 0x3F, 0x14: 0x80, 0x15: 0x00, 0x18: 0x84, 0x19: 0x4D,
+                    0x21: 0xFF, 0x22: 0xFF, 0x24: 0x26, 0x26: 0x48, 0x27: 0x88,
+                    0x28: 0x20, 0x29: 0x20, 0x37: 0x92}
+
+    # "time_scale" stretches or shrinks the simulated RF timings (0 makes every command
+    # complete instantly).
+    def __init__(self, time_scale=1.0):
+        self.time_scale = time_scale
+        self.cards = []
+        self.script = []
+        self.lock = threading.RLock()
+        self.transactions = 0
+        self.irq_callbacks = []
+        self.irq_line = 1
+        self.soft_reset()
+
+    def soft_reset(self):
+        self.regs = [0] * 64
+        for addr, value in self.RESET_VALUES.items():
+            self.regs[addr] = value
+        self.fifo = []
+        self.pending = None
+        self.done_at = 0.0
+        for card in self.cards:
+            card.power_off()
+
+    def insert(self, card):
+        with self.lock:
+            card.power_off()
+            if card not in self.cards:
+                self.cards.append(card)
+
+    def remove(self, card):
+        with self.lock:
+            if card in self.cards:
+                self.cards.remove(card)
+                card.power_off()
+
+    # Schedules card insertions and removals. "events" is a list of
+    # (seconds from now, "insert" or "remove", card) tuples.
+    def run_script(self, events):
+        now = time.monotonic()
+        with self.lock:
+            for (delay, action, card) in events:
+                self.script.append((now + delay, action, card))
+            self.script.sort(key=lambda event: event[0])
+
+    def advance(self):
+        now = time.monotonic()
+        while self.script and self.script[0][0] <= now:
+            (when, action, card) = self.script.pop(0)
+            if action == "insert":
+                self.insert(card)
+            else:
+                self.remove(card)
+        if self.pending is not None and now >= self.done_at:
+            pending = self.pending
+            self.pending = None
+            pending()
+
+    def transfer(self, data):
+        with self.lock:
+            self.transactions += 1
+            self.advance()
+            data = list(data)
+            if data[0] & 0x80:
+                return tuple(self.read_sequence(data))
+            addr = (data[0] >> 1) & 0x3F
+            for value in data[1:]:
+                self.write(addr, value)
+            self.update_irq()
+            return tuple([0] * len(data))
+
+    def read_sequence(self, data):
+        reply = [0]
+        for i in range(1, len(data)):
+            reply.append(self.read((data[i - 1] >> 1) & 0x3F))
+        return reply
+
+    def read(self, addr):
+        if addr == self.FIFODataReg:
+            return self.fifo.pop(0) if self.fifo else 0
+        if addr == self.FIFOLevelReg:
+            return len(self.fifo)
+        return self.regs[addr]
+
+    def write(self, addr, value):
+        if addr == self.FIFODataReg:
+            if len(self.fifo) < 64:
+                self.fifo.append(value)
+        elif addr == self.FIFOLevelReg:
+            if value & 0x80:
+                self.fifo = []
+        elif addr in (self.CommIrqReg, self.DivIrqReg):
+            if value & 0x80:
+                self.regs[addr] |= value & 0x7F
+            else:
+                self.regs[addr] &= ~value & 0x7F
+        elif addr == self.CommandReg:
+            self.regs[addr] = (self.regs[addr] & 0xF0) | (value & 0x0F)
+            self.command(value & 0x0F)
+        elif addr == self.BitFramingReg:
+            self.regs[addr] = value
+            if value & 0x80 and self.regs[self.CommandReg] & 0x0F == self.PCD_TRANSCEIVE:
+                self.transmit()
+        elif addr == self.Status2Reg:
+            self.regs[addr] = (self.regs[addr] & 0x07) | (value & 0xC8)
+        elif addr == self.CollReg:
+            self.regs[addr] = (self.regs[addr] & 0x7F) | (value & 0x80)
+        elif addr not in (self.ErrorReg, self.VersionReg):
+            self.regs[addr] = value
+        if addr == self.TxControlReg and value & 0x03 == 0:
+            for card in self.cards:
+                card.power_off()
+
+    # Interrupt line (active low, as set up by IRqInv).
+    def irq_asserted(self):
+        with self.lock:
+            comm = self.regs[self.CommIrqReg] & self.regs[self.CommIEnReg] & 0x7F
+            div = self.regs[self.DivIrqReg] & self.regs[self.DivIEnReg] & 0x14
+            return bool(comm or div)
+
+    def irq_level(self):
+        with self.lock:
+            self.advance()
+            active = self.irq_asserted()
+            if self.regs[self.CommIEnReg] & 0x80:
+                return 0 if active else 1
+            return 1 if active else 0
+
+    # Calls the registered callbacks on a falling edge of the IRQ line.
+    def update_irq(self):
+        level = self.irq_level()
+        falling = self.irq_line == 1 and level == 0
+        self.irq_line = level
+        if falling:
+            for callback in self.irq_callbacks:
+                callback()
+
+    # Time left until the running command finishes, or None when nothing is running.
+    def time_to_completion(self):
+        with self.lock:
+            if self.pending is None:
+                return None
+            return max(0.0, self.done_at - time.monotonic())
+
+    def finish_after(self, seconds, action):
+        self.pending = action
+        self.done_at = time.monotonic() + seconds * self.time_scale
+        if self.time_scale == 0:
+            self.advance()
+        else:
+            timer = threading.Timer(seconds * self.time_scale, self.complete)
+            timer.daemon = True
+            timer.start()
+
+    def complete(self):
+        with self.lock:
+            self.advance()
+            self.update_irq()
+
+    def timer_period(self):
+        prescaler = ((self.regs[self.TModeReg] & 0x0F) << 8) | self.regs[self.TPrescalerReg]
+        reload = (self.regs[self.TReloadRegH] << 8) | self.regs[self.TReloadRegL]
+        return (2 * prescaler + 1) * (reload + 1) / 13.56e6
+
+    def command(self, command):
+        self.pending = None
+        if command == self.PCD_RESETPHASE:
+            self.soft_reset()
+        elif command == self.PCD_CALCCRC:
+            data = list(self.fifo)
+            self.fifo = []
+
+            def done():
+                crc = crc_a(data)
+                self.regs[self.CRCResultRegL] = crc[0]
+                self.regs[self.CRCResultRegM] = crc[1]
+                self.regs[self.DivIrqReg] |= 0x04
+            self.finish_after(len(data) * 1e-6, done)
+        elif command == self.PCD_AUTHENT:
+            self.authenticate()
+        elif command == self.PCD_TRANSMIT:
+            self.transmit()
+
+    def field_on(self):
+        return self.regs[self.TxControlReg] & 0x03 == 0x03
+
+    def transmit(self):
+        command = self.regs[self.CommandReg] & 0x0F
+        framing = self.regs[self.BitFramingReg]
+        tx_bits = bytes_to_bits(self.fifo, framing & 0x07)
+        self.fifo = []
+        self.regs[self.ErrorReg] = 0
+        reader_crypto = bool(self.regs[self.Status2Reg] & 0x08)
+        responses = []
+        if self.field_on():
+            for card in self.cards:
+                response = card.receive(tx_bits, reader_crypto)
+                if response is not None:
+                    responses.append(response)
+        tx_time = len(tx_bits) * 9.44e-6
+
+        if command == self.PCD_TRANSMIT:
+            def sent():
+                self.regs[self.CommIrqReg] |= 0x50
+                self.regs[self.CommandReg] &= 0xF0
+            self.finish_after(tx_time, sent)
+            return
+
+        if not responses:
+            def timeout():
+                self.regs[self.CommIrqReg] |= 0x41
+            self.finish_after(tx_time + self.timer_period(), timeout)
+            return
+
+        length = max(len(r) for r in responses)
+        bits = []
+        collision = None
+        after_coll_cleared = not (self.regs[self.CollReg] & 0x80)
+        for i in range(length):
+            values = set(r[i] for r in responses if i < len(r))
+            if len(values) > 1 and collision is None:
+                collision = i
+            if collision is not None and after_coll_cleared:
+                bits.append(0)
+            else:
+                bits.append(max(values))
+        align = (framing >> 4) & 0x07
+        packed = bits_to_bytes([0] * align + bits)
+        rx_last = (align + len(bits)) % 8
+
+        def received():
+            self.fifo = packed[:64]
+            self.regs[self.ControlReg] = (self.regs[self.ControlReg] & 0xF8) | rx_last
+            if collision is not None:
+                self.regs[self.ErrorReg] |= 0x08
+                # CollPos counts from the first bit of the first byte in the FIFO, so it
+                # includes the bits of the partial byte given by RxAlign.
+                pos = align + collision + 1
+                self.regs[self.CollReg] = (self.regs[self.CollReg] & 0x80) | (pos & 0x1F if pos <= 32 else 0x20)
+            else:
+                self.regs[self.CollReg] = (self.regs[self.CollReg] & 0x80) | 0x20
+            self.regs[self.CommIrqReg] |= 0x60
+        self.finish_after(tx_time + length * 9.44e-6 + 100e-6, received)
+
+    def authenticate(self):
+        data = list(self.fifo)
+        self.fifo = []
+        reader_crypto = bool(self.regs[self.Status2Reg] & 0x08)
+        ok = False
+        if len(data) == 12 and self.field_on():
+            for card in self.cards:
+                if card.state == VirtualCard.ACTIVE and card.crypto == reader_crypto:
+                    ok = card.authenticate(data[0], data[1], data[2:8], data[8:12]) or ok
+                elif card.state == VirtualCard.ACTIVE:
+                    card.idle()
+
+        if ok:
+            def done():
+                self.regs[self.Status2Reg] |= 0x08
+                self.regs[self.CommIrqReg] |= 0x10
+                self.regs[self.CommandReg] &= 0xF0
+            self.finish_after(2e-3, done)
+        else:
+            def failed():
+                self.regs[self.Status2Reg] &= ~0x08
+                self.regs[self.CommIrqReg] |= 0x01
+            self.finish_after(self.timer_period(), failed)
+
+
+# Emulates the RPi.GPIO module. Output pins keep the last value written to them, so the
+# state of the relay, LEDs and buzzer can be checked in "pins".
+class VirtualGPIO:
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.mode = None
+        self.pins = {}
+        self.irq_models = {}
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def getmode(self):
+        return self.mode
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        if direction == self.OUT:
+            self.pins[pin] = initial if initial is not None else self.LOW
+        elif pull_up_down == self.PUD_UP:
+            self.pins[pin] = self.HIGH
+        else:
+            self.pins[pin] = self.pins.get(pin, self.LOW)
+
+    def output(self, pin, value):
+        self.pins[pin] = int(bool(value))
+
+    def input(self, pin):
+        if pin in self.irq_models:
+            return self.irq_models[pin].irq_level()
+        return self.pins.get(pin, self.LOW)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        if pin in self.irq_models and callback is not None:
+            self.irq_models[pin].irq_callbacks.append(lambda: callback(pin))
+
+    def remove_event_detect(self, pin):
+        if pin in self.irq_models:
+            self.irq_models[pin].irq_callbacks = []
+
+    def cleanup(self, *pins):
+        self.pins = {}
+
+
+GPIO = VirtualGPIO()
+
+
+class VirtualTransport:
+    # Each transaction takes "latency" seconds plus the time needed to shift the bytes
+    # at "spd" bits per second.
+    def __init__(self, model, spd=1000000, latency=0.0):
+        self.model = model
+        self.gpio = GPIO
+        self.spd = spd
+        self.latency = latency
+        self.irq = None
+
+    def transfer(self, data):
+        delay = self.latency + len(data) * 8.0 / self.spd
+        if delay > 0:
+            time.sleep(delay)
+        return self.model.transfer(data)
+
+    def setup_irq(self, pin, callback):
+        self.irq = pin
+        self.gpio.irq_models[pin] = self.model
+        self.gpio.add_event_detect(pin, self.gpio.FALLING, callback=callback)
+
+    def close(self):
+        if self.irq is not None:
+            self.gpio.remove_event_detect(self.irq)
+            del self.gpio.irq_models[self.irq]
+
+
+READERS = {}
+
+
+# Returns the model of the virtual reader on SPI device "dev", creating it if needed.
+def reader(dev='/dev/spidev0.0'):
+    if dev not in READERS:
+        scale = float(os.environ.get("MFRC522_VIRTUAL_TIME_SCALE", "1"))
+        READERS[dev] = VirtualMFRC522(time_scale=scale)
+    return READERS[dev]
+
+
+def open_transport(dev='/dev/spidev0.0', spd=1000000):
+    latency = float(os.environ.get("MFRC522_VIRTUAL_LATENCY", "0"))
+    return VirtualTransport(reader(dev), spd, latency)
+
+
+# Loads the card insertions and removals of a JSON script (see the top of this file).
+def load_script(path):
+    with open(path) as script_file:
+        events = json.load(script_file)
+    cards = {}
+    timeline = {}
+    for event in events:
+        uid = tuple(event["uid"])
+        if uid not in cards:
+            blocks = dict((int(addr), data) for addr, data in event.get("blocks", {}).items())
+            cards[uid] = VirtualCard(uid, blocks=blocks)
+        dev = event.get("device", "/dev/spidev0.0")
+        timeline.setdefault(dev, []).append((event["at"], event["action"], cards[uid]))
+    for dev, events in timeline.items():
+        reader(dev).run_script(events)
+
+
+if os.environ.get("MFRC522_VIRTUAL_SCRIPT"):
+    load_script(os.environ["MFRC522_VIRTUAL_SCRIPT"])
@@ -0,0 +1,6 @@
+# The scripts of the project import each other from their folder, as they do when they run on the Pi.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,106 @@
+# The records of AuditJournal: they are read back as they were written, whatever the size of the UID and Booked ID,
+# and record() never raises.
+
+import os
+
+import AuditJournal
+
+# The Booked ID of a tag whose block 8 holds [255] * 16, and the UID of a 10 byte tag, as uid_to_int gives them.
+HUGE_USER_ID = int("255" * 16)
+LONG_UID = int("".join(str(byte) for byte in [136, 4, 221, 170, 187, 204, 221, 238, 255, 100]))
+
+
+def write(path, events, **kwargs):
+    journal = AuditJournal.AuditJournal(path, sync_interval=0.01, **kwargs)
+    journal.start()
+    for event in events:
+        journal.record(*event[:2], **event[2])
+    journal.stop()
+    return journal
+
+
+def test_records_are_read_back(tmp_path):
+    path = str(tmp_path / "AuditJournal.bin")
+    write(path, [(AuditJournal.TAP, "267", {"uid": 1734516868, "user_id": 1042}),
+                 (AuditJournal.END, 267, {"uid": 1734516868, "user_id": 1042, "duration": 600.0, "detail": "student"}),
+                 (AuditJournal.ERROR, "268", {"detail": "Authentication error"})])
+    events = list(AuditJournal.read([path]))
+    assert [event["event"] for event in events] == [AuditJournal.TAP, AuditJournal.END, AuditJournal.ERROR]
+    assert events[0]["uid"] == 1734516868 and events[0]["user_id"] == 1042 and events[0]["duration"] is None
+    assert events[1]["resource_id"] == "267" and events[1]["duration"] == 600.0 and events[1]["detail"] == "student"
+    assert events[2]["uid"] is None and events[2]["user_id"] is None
+
+
+def test_huge_user_id_and_long_uid_are_kept(tmp_path):
+    path = str(tmp_path / "AuditJournal.bin")
+    journal = write(path, [(AuditJournal.TAP, "267", {"uid": LONG_UID, "user_id": HUGE_USER_ID})])
+    assert journal.errors == 0
+    (event,) = AuditJournal.read([path])
+    assert event["uid"] == LONG_UID
+    assert event["user_id"] == HUGE_USER_ID
+    assert list(AuditJournal.matching([event], uid=LONG_UID, user_id=HUGE_USER_ID)) == [event]
+
+
+def test_record_does_not_raise(tmp_path):
+    errors = []
+    path = str(tmp_path / "AuditJournal.bin")
+    journal = write(path, [("unknown event", "267", {}), (AuditJournal.END, "267", {"duration": 1e300}),
+                           (AuditJournal.TAP, "267", {"uid": 1})], on_error=errors.append)
+    assert journal.errors == 2
+    assert len(errors) == 2
+    assert [event["uid"] for event in AuditJournal.read([path])] == [1]
+
+
+def test_damaged_record_stops_the_reading(tmp_path):
+    path = str(tmp_path / "AuditJournal.bin")
+    write(path, [(AuditJournal.TAP, "267", {"uid": i}) for i in range(3)])
+    with open(path, "r+b") as f:
+        f.seek(-3, os.SEEK_END)
+        f.write(b"\x00\x00\x00")
+    assert [event["uid"] for event in AuditJournal.read([path])] == [0, 1]
+
+
+def test_rotation_keeps_the_events_in_order(tmp_path):
+    path = str(tmp_path / "AuditJournal.bin")
+    journal = write(path, [(AuditJournal.TAP, "267", {"uid": i}) for i in range(200)], max_bytes=1024, backup_count=50)
+    assert journal.rotations > 0
+    paths = [str(tmp_path / name) for name in os.listdir(str(tmp_path))]
+    assert [event["uid"] for event in AuditJournal.read(paths)] == list(range(200))
+
+
+def test_journal_of_another_version_is_rotated_away(tmp_path):
+    path = str(tmp_path / "AuditJournal.bin")
+    with open(path, "wb") as f:
+        f.write(b"AUDJ1\n" + b"\x00" * 40)
+    write(path, [(AuditJournal.TAP, "267", {"uid": 5})])
+    assert [event["uid"] for event in AuditJournal.read([path])] == [5]
+    assert os.path.exists(path + ".1")
+
+
+def test_records_after_a_cut_record_are_kept(tmp_path):
+    path = str(tmp_path / "AuditJournal.bin")
+    write(path, [(AuditJournal.TAP, "267", {"uid": 1})])
+    with open(path, "ab") as f:
+        f.write(AuditJournal.pack(0.0, AuditJournal.TAP, "267", uid=2)[:10])     # The Pi lost power while writing.
+    write(path, [(AuditJournal.TAP, "267", {"uid": 3}), (AuditJournal.END, "267", {"uid": 3, "duration": 60.0})])
+    assert [event["uid"] for event in AuditJournal.read([path])] == [1, 3, 3]
+    assert not os.path.exists(path + ".1")
+
+
+def test_events_that_could_not_be_written_are_kept(tmp_path):
+    errors = []
+    path = str(tmp_path / "AuditJournal.bin")
+    journal = AuditJournal.AuditJournal(path, max_pending=3, on_error=errors.append)
+    journal.open()
+    journal.file.close()     # Every write fails, like on an SD card that went read-only.
+    for uid in range(4):
+        journal.record(AuditJournal.TAP, "267", uid=uid)
+    journal.write_pending()
+    assert journal.errors == 1 and len(errors) == 1
+    assert journal.file is None
+    assert (len(journal.pending), journal.dropped) == (3, 1)
+    journal.record(AuditJournal.TAP, "267", uid=4)
+    assert (len(journal.pending), journal.dropped) == (3, 2)
+    journal.write_pending()
+    assert journal.errors == 1
+    assert [event["uid"] for event in AuditJournal.read([path])] == [2, 3, 4]
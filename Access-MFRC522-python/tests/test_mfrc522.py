@@ -0,0 +1,132 @@
+# The MFRC522 driver, run on the virtual reader of VirtualMFRC522.py with its RF timings turned off.
+
+import pytest
+
+import MFRC522
+import VirtualMFRC522
+
+IRQ_PIN = 24
+
+
+# Returns a driver and the model of its virtual reader, in polling mode or IRQ mode.
+@pytest.fixture(params=[None, IRQ_PIN], ids=["polling", "irq"])
+def reader(request):
+    model = VirtualMFRC522.VirtualMFRC522(time_scale=0)
+    driver = MFRC522.MFRC522(transport=VirtualMFRC522.VirtualTransport(model), irq=request.param, trace=False)
+    yield (driver, model)
+    driver.transport.close()
+
+
+def test_trace_can_be_enabled_again(reader):
+    (driver, model) = reader
+    model.insert(VirtualMFRC522.VirtualCard([1, 2, 3, 4]))
+    driver.MFRC522_EnableTrace()
+    driver.MFRC522_Request(driver.PICC_REQALL)
+    assert driver.stats["Request"].count == 1
+    driver.MFRC522_DisableTrace()
+    driver.MFRC522_Request(driver.PICC_REQALL)
+    assert driver.stats["Request"].count == 1     # Kept while the trace is disabled.
+    driver.MFRC522_EnableTrace()
+    assert driver.stats["Request"].count == 0
+    driver.MFRC522_Request(reqMode=driver.PICC_REQALL)
+    driver.MFRC522_EnableTrace()    # Already enabled, the statistics go on.
+    driver.MFRC522_Request(driver.PICC_REQALL)
+    assert driver.stats["Request"].count == 2
+
+
+def insert(model, *uids):
+    for uid in uids:
+        model.insert(VirtualMFRC522.VirtualCard(uid))
+
+
+@pytest.mark.parametrize("uid", [[0x12, 0x34, 0x56, 0x78],
+                                 [0x04, 0x11, 0x22, 0x33, 0x44, 0x55, 0x66],
+                                 [0x04, 0xA1, 0xB2, 0xC3, 0xD4, 0xE5, 0xF6, 0x07, 0x18, 0x29]],
+                         ids=["4 bytes", "7 bytes", "10 bytes"])
+def test_anticoll_select_reads_the_whole_uid(reader, uid):
+    (driver, model) = reader
+    insert(model, uid)
+    assert driver.MFRC522_Request(driver.PICC_REQIDL)[0] == driver.MI_OK
+    assert driver.MFRC522_AnticollSelect() == (driver.MI_OK, uid, 0x08)
+
+
+def test_anticoll_level_of_a_4_byte_uid(reader):
+    (driver, model) = reader
+    insert(model, [0x12, 0x34, 0x56, 0x78])
+    driver.MFRC522_Request(driver.PICC_REQIDL)
+    assert driver.MFRC522_Anticoll() == (driver.MI_OK, [0x12, 0x34, 0x56, 0x78, 0x12 ^ 0x34 ^ 0x56 ^ 0x78])
+
+
+def test_colliding_cards_select_the_one_with_the_bit_set(reader):
+    (driver, model) = reader
+    # The UIDs only differ in the lowest bit of the third byte.
+    insert(model, [0x12, 0x34, 0x56, 0x78], [0x12, 0x34, 0x57, 0x78])
+    driver.MFRC522_Request(driver.PICC_REQIDL)
+    assert driver.MFRC522_AnticollSelect() == (driver.MI_OK, [0x12, 0x34, 0x57, 0x78], 0x08)
+
+
+@pytest.mark.parametrize("uids", [
+    # Collisions in the first bit, in the middle of a byte and in the last bit before the BCC.
+    [[0x00, 0x00, 0x00, 0x00], [0x01, 0x00, 0x00, 0x00], [0x00, 0x10, 0x00, 0x00], [0x00, 0x00, 0x00, 0x80]],
+    # 7 byte UIDs that only differ at cascade level 2, and a 4 byte UID that only differs from
+    # their cascade tag in its last bit.
+    [[0x04, 0x11, 0x22, 0x33, 0x44, 0x55, 0x66], [0x04, 0x11, 0x22, 0x33, 0x44, 0x55, 0x67],
+     [0x04, 0x11, 0x22, 0x34, 0x44, 0x55, 0x66], [0x89, 0x04, 0x11, 0x22]],
+    # 10 byte UIDs that only differ at cascade level 3, with 7 and 4 byte UIDs sharing their first bytes.
+    [[0x04, 0xA1, 0xB2, 0xC3, 0xD4, 0xE5, 0xF6, 0x07, 0x18, 0x29],
+     [0x04, 0xA1, 0xB2, 0xC3, 0xD4, 0xE5, 0xF6, 0x07, 0x18, 0x2A],
+     [0x04, 0xA1, 0xB2, 0xC3, 0xD4, 0xE5, 0xF7],
+     [0x04, 0xA1, 0xB2, 0xC3]],
+], ids=["4 bytes", "7 bytes", "10 bytes"])
+def test_enumerate_finds_every_card(reader, uids):
+    (driver, model) = reader
+    insert(model, *uids)
+    cards = driver.MFRC522_Enumerate()
+    assert sorted(cards) == sorted((uid, 0x08) for uid in uids)
+    # The cards are left halted: they do not answer REQA, and each one can be woken up and selected again.
+    assert driver.MFRC522_Request(driver.PICC_REQIDL)[0] == driver.MI_ERR
+    for (uid, sak) in cards:
+        assert driver.MFRC522_Reselect(uid)
+        driver.MFRC522_Halt()
+
+
+def test_enumerate_stops_at_max_cards(reader):
+    (driver, model) = reader
+    insert(model, *[[0x10, 0x20, 0x30, i] for i in range(5)])
+    assert len(driver.MFRC522_Enumerate(maxCards=3)) == 3
+    assert len(driver.MFRC522_Enumerate(maxCards=3, reqMode=driver.PICC_REQIDL)) == 2
+
+
+def test_enumerate_without_cards(reader):
+    (driver, model) = reader
+    assert driver.MFRC522_Enumerate() == []
+
+
+# The examples of ISO 14443-3 Annex B: the CRC_A of 00 00 is A0 1E, and of 12 34 is 26 CF.
+@pytest.mark.parametrize("data, crc", [([0x00, 0x00], [0xA0, 0x1E]), ([0x12, 0x34], [0x26, 0xCF])])
+def test_crc_a_matches_the_examples_of_the_standard(data, crc):
+    assert MFRC522.crc_a(data) == crc
+    assert VirtualMFRC522.crc_a(data) == crc
+
+
+def test_crc_a_table_matches_the_bit_by_bit_crc():
+    frames = [[], [0x26], [0x93, 0x70, 0x12, 0x34, 0x56, 0x78, 0x08], [0x30, 0x08], list(range(256))]
+    for frame in frames:
+        assert MFRC522.crc_a(frame) == VirtualMFRC522.crc_a(frame)
+
+
+def test_crc_verify_agrees_with_the_reader(reader):
+    (driver, model) = reader
+    uid = [0x04, 0x11, 0x22, 0x33, 0x44, 0x55, 0x66]
+    block = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 2, 3, 4]
+    model.insert(VirtualMFRC522.VirtualCard(uid, blocks={8: block}))
+    driver.crc_mode = driver.CRC_VERIFY
+    for data in ([0x00, 0x00], [0x12, 0x34], [0x93, 0x70, 0x12, 0x34, 0x56, 0x78, 0x08]):
+        assert driver.CalulateCRC(data) == MFRC522.crc_a(data)
+    # Select, authentication and read: every frame sent to the card carries the CRC of the reader.
+    driver.MFRC522_Request(driver.PICC_REQIDL)
+    assert driver.MFRC522_AnticollSelect() == (driver.MI_OK, uid, 0x08)
+    assert driver.MFRC522_Auth(driver.PICC_AUTHENT1A, 8, VirtualMFRC522.VirtualCard.DEFAULT_KEY, uid[-4:]) == driver.MI_OK
+    assert driver.MFRC522_Read(8) == block
+    driver.MFRC522_StopCrypto1()
+    assert driver.crc_mismatches == 0
@@ -0,0 +1,70 @@
+# The reconciliation of OfflineDecisions: a decision that can never be checked is dropped, and only Booked being down
+# keeps the decisions for the next try.
+
+import json
+
+import requests
+
+import CredentialSnapshot
+
+UNREACHABLE = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+def decision(user_id, granted=True):
+    return {"time": 1760000000.0, "resource_id": "267", "uid": 1734516868, "user_id": user_id, "granted": granted}
+
+
+def lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_poison_decision_is_dropped(tmp_path):
+    path = str(tmp_path / "OfflineDecisions.jsonl")
+    checked = []
+
+    def check(d):
+        if d["user_id"] == 1:
+            raise KeyError("reservations")
+        checked.append(d["user_id"])
+        return True
+
+    journal = CredentialSnapshot.OfflineDecisions(path, check, unreachable=UNREACHABLE)
+    journal.record(decision(1))
+    journal.record(decision(2))
+    assert journal.reconcile() == 2
+    assert checked == [2]
+    assert lines(path) == []
+
+
+def test_unreachable_booked_keeps_the_decisions(tmp_path):
+    path = str(tmp_path / "OfflineDecisions.jsonl")
+
+    def check(d):
+        raise requests.exceptions.Timeout()
+
+    journal = CredentialSnapshot.OfflineDecisions(path, check, unreachable=UNREACHABLE)
+    journal.record(decision(1))
+    journal.record(decision(2))
+    assert journal.reconcile() == 0
+    assert [d["user_id"] for d in lines(path)] == [1, 2]
+
+
+def test_decisions_after_an_outage_wait(tmp_path):
+    path = str(tmp_path / "OfflineDecisions.jsonl")
+    answers = {1: True, 2: requests.exceptions.ConnectionError(), 3: True}
+    checked = []
+
+    def check(d):
+        answer = answers[d["user_id"]]
+        if isinstance(answer, Exception):
+            raise answer
+        checked.append(d["user_id"])
+        return answer
+
+    journal = CredentialSnapshot.OfflineDecisions(path, check, unreachable=UNREACHABLE)
+    for user_id in (1, 2, 3):
+        journal.record(decision(user_id))
+    assert journal.reconcile() == 1
+    assert checked == [1]
+    assert [d["user_id"] for d in lines(path)] == [2, 3]
@@ -0,0 +1,116 @@
+# The edge cases of ReservationIndex: the minutes before a reservation, its end, time zones and daylight saving time.
+
+import datetime
+
+import pytest
+
+import BookedAPI
+import ReservationIndex
+from ReservationIndex import parse_booked_time
+
+
+def reservation(ref, start, end, resource_id="7"):
+    return {"referenceNumber": ref, "resourceId": resource_id, "startDate": start, "endDate": end}
+
+
+RESERVATIONS = [
+    reservation("other machine first", "2026-06-01T09:00:00-0700", "2026-06-01T12:00:00-0700", "8"),
+    reservation("morning", "2026-06-01T10:00:00-0700", "2026-06-01T11:00:00-0700"),
+    reservation("right after", "2026-06-01T11:05:00-0700", "2026-06-01T12:00:00-0700"),
+    reservation("utc", "2026-06-01T20:00:00Z", "2026-06-01T21:00:00+00:00"),
+    # Daylight saving time ends in the US on 1 November 2026: 01:30 PDT and 01:30 PST are one hour apart. Read with
+    # the old slicing of the date, this reservation started and ended at the same minute and could never be used.
+    reservation("fall back", "2026-11-01T01:30:00-0700", "2026-11-01T01:30:00-0800"),
+    # It starts on 14 March 2027: 01:30 PST and 03:30 PDT are one hour apart.
+    reservation("spring forward", "2027-03-14T01:30:00-0800", "2027-03-14T03:30:00-0700"),
+]
+
+
+@pytest.fixture
+def index():
+    return ReservationIndex.ReservationIndex(ReservationIndex.parse_reservations(RESERVATIONS))
+
+
+@pytest.mark.parametrize("resource_id, now, expected", [
+    ("7", "2026-06-01T09:49:00-0700", None),                    # 11 minutes before
+    ("7", "2026-06-01T09:50:00-0700", None),                    # 10 minutes before
+    ("7", "2026-06-01T09:51:00-0700", "morning"),               # 9 minutes before
+    ("7", "2026-06-01T17:30:00Z", "morning"),                   # during, in another time zone
+    ("7", "2026-06-01T10:58:00-0700", "morning"),               # both usable: the one that started first
+    ("7", "2026-06-01T11:00:00-0700", "right after"),           # at the end
+    ("7", "2026-06-01T12:00:00-0700", None),                    # end of the last one
+    ("8", "2026-06-01T09:30:00-0700", "other machine first"),
+    ("9", "2026-06-01T10:30:00-0700", None),                    # machine without reservations
+    ("7", "2026-06-01T13:30:00-0700", "utc"),                   # Z and +00:00
+    ("7", "2026-11-01T01:45:00-0700", "fall back"),             # fall back, in PDT
+    ("7", "2026-11-01T01:15:00-0800", "fall back"),             # fall back, in PST
+    ("7", "2026-11-01T01:31:00-0800", None),                    # fall back, after the end
+    ("7", "2027-03-14T01:15:00-0800", None),                    # spring forward, before
+    ("7", "2027-03-14T03:15:00-0700", "spring forward"),        # spring forward, during
+])
+def test_active(index, resource_id, now, expected):
+    found = index.active(resource_id, parse_booked_time(now))
+    assert (None if found is None else found["referenceNumber"]) == expected
+
+
+def test_resource_id_can_be_a_number(index):
+    assert index.active(7, parse_booked_time("2026-06-01T10:30:00-0700"))["referenceNumber"] == "morning"
+
+
+def test_second_tap_in_the_same_window_does_not_search_again(index):
+    (found, until) = index.window("7", parse_booked_time("2026-06-01T10:30:00-0700"))
+    assert found["referenceNumber"] == "morning"
+    assert until == parse_booked_time("2026-06-01T11:00:00-0700")
+    hits = index.hits
+    index.active("7", parse_booked_time("2026-06-01T10:40:00-0700"))
+    assert index.hits == hits + 1
+
+
+def test_window_without_reservation_lasts_until_the_next_one(index):
+    (found, until) = index.window("7", parse_booked_time("2026-06-01T09:00:00-0700"))
+    assert found is None
+    assert until == parse_booked_time("2026-06-01T09:50:00-0700")
+    assert index.window("7", parse_booked_time("2027-03-14T04:00:00-0700")) == (None, None)
+
+
+def test_earlier_time_than_the_remembered_answer_searches_again(index):
+    index.active("7", parse_booked_time("2026-06-01T10:30:00-0700"))
+    assert index.active("7", parse_booked_time("2026-06-01T09:00:00-0700")) is None
+
+
+def test_early_minutes(index):
+    early = ReservationIndex.ReservationIndex(ReservationIndex.parse_reservations(RESERVATIONS), early_minutes=0)
+    assert early.active("7", parse_booked_time("2026-06-01T09:55:00-0700")) is None
+    assert index.active("7", parse_booked_time("2026-06-01T09:55:00-0700"))["referenceNumber"] == "morning"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("2026-06-01T10:00:00-0700", datetime.datetime(2026, 6, 1, 17, 0, tzinfo=datetime.timezone.utc)),
+    ("2026-06-01T10:00:00-07:00", datetime.datetime(2026, 6, 1, 17, 0, tzinfo=datetime.timezone.utc)),
+    ("2026-06-01T10:00:00+0530", datetime.datetime(2026, 6, 1, 4, 30, tzinfo=datetime.timezone.utc)),
+    ("2026-06-01T10:00:00Z", datetime.datetime(2026, 6, 1, 10, 0, tzinfo=datetime.timezone.utc)),
+    ("2026-06-01T10:00:00.123Z", datetime.datetime(2026, 6, 1, 10, 0, tzinfo=datetime.timezone.utc)),
+    ("2026-06-01T10:00Z", datetime.datetime(2026, 6, 1, 10, 0, tzinfo=datetime.timezone.utc)),
+])
+def test_parse_booked_time(text, expected):
+    assert parse_booked_time(text) == expected
+
+
+def test_parse_booked_time_without_time_zone_is_local_time():
+    moment = parse_booked_time("2026-06-01T10:00:00")
+    assert moment.tzinfo is not None
+    assert moment == datetime.datetime(2026, 6, 1, 10, 0).astimezone()
+
+
+@pytest.mark.parametrize("text", ["", "garbage", "2026-06-01", "2026-06-01T10:00:00-07"])
+def test_parse_booked_time_refuses_other_text(text):
+    with pytest.raises(ValueError):
+        parse_booked_time(text)
+
+
+def test_seconds_until_uses_the_time_zone():
+    soon = (ReservationIndex.current_time() + datetime.timedelta(minutes=30)).astimezone(
+        datetime.timezone(datetime.timedelta(hours=-7)))
+    assert abs(BookedAPI.seconds_until(soon.strftime("%Y-%m-%dT%H:%M:%S%z")) - 1800) < 5
+    assert BookedAPI.seconds_until(None) is None
+    assert BookedAPI.seconds_until("garbage") is None
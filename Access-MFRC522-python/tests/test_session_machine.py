@@ -0,0 +1,194 @@
+# The transitions of SessionMachine, with hooks that record what the machine does. The timers are a few tenths of a
+# second long, and the loop is run until they fired.
+
+import asyncio
+
+import pytest
+
+import SessionMachine
+
+
+class Hooks:
+    def __init__(self):
+        self.log = []
+        self.refusal = None
+        self.error = None
+        self.unreadable = False
+
+    def read_tag(self, station, uid):
+        return None if self.unreadable else (uid[0], uid[0] * 10)
+
+    def authorize(self, station, session):
+        if self.error is not None:
+            raise self.error
+        return self.refusal
+
+    def failed(self, station, session, error):
+        return "No Wifi\nRestart Pi"
+
+    def relay(self, station, on):
+        self.log.append("relay on" if on else "relay off")
+
+    def end(self, station, session):
+        self.log.append("check out %d" % session["uid_int"])
+
+    def idle_message(self, station):
+        return "Ready\nInsert Tag"
+
+    def buzzer(self, on):
+        self.log.append("buzzer on" if on else "buzzer off")
+
+
+class Scheduler:
+    presence_interval = 0.25
+
+    def __init__(self):
+        self.released = []
+
+    def release(self, station, delay=0):
+        self.released.append(delay)
+
+    def activity(self, station):
+        pass
+
+
+class Station:
+    name = "267"
+
+    def __init__(self):
+        self.screen = []
+
+    def show(self, message):
+        self.screen.append(message)
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def machine(loop):
+    return SessionMachine.SessionMachine(Station(), Scheduler(), Hooks(), loop, critical_time=0.4, message_time=0.2,
+                                         buzzer_time=0.1, alternate_time=0.15)
+
+
+def run(loop, seconds):
+    loop.run_until_complete(asyncio.sleep(seconds))
+
+
+def events(machine):
+    return [event for (at, old, new, event) in machine.history]
+
+
+def test_granted_session_turns_the_relay_on(loop, machine):
+    machine.tag_arrived([1])
+    assert machine.state == SessionMachine.IDENTIFYING
+    run(loop, 0.05)
+    assert machine.state == SessionMachine.ACTIVE
+    assert machine.hooks.log == ["relay on"]
+    assert machine.station.screen[-1] == "Authenticated\nDon't Remove Tag"
+
+
+def test_refused_tag_shows_the_refusal_then_the_idle_message(loop, machine):
+    machine.hooks.refusal = "No Reservations\nFound"
+    machine.tag_arrived([2])
+    run(loop, 0.05)
+    assert machine.state == SessionMachine.IDLE
+    assert machine.session is None
+    assert machine.station.screen == ["No Reservations\nFound"]
+    run(loop, 0.25)
+    assert machine.station.screen[-1] == "Ready\nInsert Tag"
+    assert "relay on" not in machine.hooks.log
+
+
+def test_error_shows_the_message_of_failed(loop, machine):
+    machine.hooks.error = OSError("Booked cannot be reached")
+    machine.tag_arrived([1])
+    run(loop, 0.05)
+    assert machine.state == SessionMachine.IDLE
+    assert events(machine) == ["tag arrived", "error"]
+    assert machine.station.screen == ["No Wifi\nRestart Pi"]
+
+
+def test_unreadable_tag_starts_no_session(loop, machine):
+    machine.hooks.unreadable = True
+    machine.tag_arrived([1])
+    assert machine.state == SessionMachine.IDLE
+    assert machine.session is None
+    assert len(machine.history) == 0
+
+
+def test_tag_put_back_during_critical_mode_keeps_the_session(loop, machine):
+    machine.tag_arrived([1])
+    run(loop, 0.05)
+    machine.tag_removed()
+    assert machine.state == SessionMachine.CRITICAL
+    assert sorted(machine.timers()) == ["alternate", "buzzer", "critical"]
+    run(loop, 0.2)
+    machine.tag_arrived([1])
+    assert machine.state == SessionMachine.ACTIVE
+    assert sorted(machine.timers()) == []
+    run(loop, 0.5)
+    assert machine.state == SessionMachine.ACTIVE
+    assert machine.hooks.log == ["relay on", "buzzer on", "buzzer off"]
+
+
+def test_session_ends_when_the_tag_is_not_put_back(loop, machine):
+    machine.tag_arrived([1])
+    run(loop, 0.05)
+    machine.tag_removed()
+    run(loop, 0.3)
+    assert machine.state == SessionMachine.CRITICAL
+    assert "Continue?\nReinsert Tag" in machine.station.screen
+    run(loop, 0.2)
+    assert machine.state == SessionMachine.IDLE
+    assert events(machine) == ["tag arrived", "access granted", "tag removed", "critical time over", "session over"]
+    assert machine.hooks.log == ["relay on", "buzzer on", "buzzer off", "relay off", "check out 1"]
+    assert machine.station.screen[-1] == "Ready\nInsert Tag"
+
+
+def test_tag_removed_while_identifying_starts_critical_mode_when_granted(loop, machine):
+    machine.tag_arrived([1])
+    machine.tag_removed()
+    run(loop, 0.05)
+    assert machine.state == SessionMachine.CRITICAL
+    assert machine.hooks.log == ["relay on", "buzzer on"]
+
+
+def test_other_tag_during_a_session_is_ignored(loop, machine):
+    machine.tag_arrived([1])
+    run(loop, 0.05)
+    machine.tag_arrived([3])
+    assert machine.state == SessionMachine.ACTIVE
+    assert machine.session["uid"] == [1]
+    assert machine.scheduler.released == [Scheduler.presence_interval]
+
+
+def test_critical_message_shows_the_critical_time(loop):
+    machine = SessionMachine.SessionMachine(Station(), Scheduler(), Hooks(), loop, critical_time=90)
+    machine.tag_arrived([1])
+    run(loop, 0.05)
+    machine.tag_removed()
+    assert machine.station.screen[-1] == "Ending Session\nIn 90s"
+    for name in list(machine.timers()):
+        machine.cancel_timer(name)
+
+
+def test_arrival_time_is_taken_before_the_tag_is_read(loop, machine):
+    read_at = []
+    read_tag = machine.hooks.read_tag
+    machine.hooks.read_tag = lambda station, uid: read_at.append(loop.time()) or read_tag(station, uid)
+    machine.tag_arrived([1], at=12.5)
+    assert machine.session["arrived"] == 12.5
+    machine.tag_removed()
+    run(loop, 0.05)
+    machine.tag_arrived([1])
+    assert machine.session["arrived"] == 12.5
+    machine.end_session()
+    run(loop, 0.05)
+    machine.tag_arrived([2])
+    assert machine.session["arrived"] <= read_at[-1]
+    run(loop, 0.05)
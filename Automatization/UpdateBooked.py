@@ -7,24 +7,18 @@
 # from the table, the user is also removed from Booked.
 
 from sqlalchemy import create_engine
-import json
-import requests
+import os
+import sys
 from sqlalchemy.sql import text
 import pandas as pd
 
-def authenticateBookedAdmin():
-    authenticate_url = "http://YOUR_BOOKED_DOMAIN_NAME/Web/Services/index.php/Authentication/Authenticate"
-    admin_username = "BOOKED_ADMIN_USERNAME"
-    admin_password = "BOOKED_ADMIN_PASSWORD"
-    arguments = {"username": admin_username, "password": admin_password}  # The variable is a dictionary or JSON
-    arguments_str = json.dumps(arguments)  # Transforms arguments into a string
-    authenticate_response = requests.post(authenticate_url, data=arguments_str)
-    authenticate_response_json = authenticate_response.json()  # Makes the response a json object, easier to parse
-    session_token = authenticate_response_json["sessionToken"]
-    user_id = authenticate_response_json["userId"]
-    return ({"X-Booked-SessionToken": session_token, "X-Booked-UserId": user_id})
+# BookedAPI.py is in the folder of the scripts of the Pi. If this script is on another computer, copy BookedAPI.py next to it.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Access-MFRC522-python"))
+import BookedAPI
 
-auth_headers = authenticateBookedAdmin()
+# Authenticates with Booked once, on the first call, and again only if the session token expires or is refused. All the calls
+# reuse the same connection, and a call to Booked that does not answer gives up after a timeout instead of blocking the script.
+booked = BookedAPI.BookedClient("BOOKED_ADMIN_USERNAME", "BOOKED_ADMIN_PASSWORD")
 
 
 # In the following block of code we find which fields have been manually changed in the database table, and update those fields in "Booked".
@@ -41,10 +35,7 @@ for i in modified_table.index:
     #If the user has just been created and has no UID assigned yet, for the code not to crash, it writes the value "0" in this field
     update_info = {"firstName": row["GivenName"], "lastName": row["Surname"], "emailAddress": row["Email"], "userName": row["BookedUsername"],
     "timezone": "America/Vancouver", "customAttributes": [{"attributeId": "10", "attributeValue": int(row["UID"])}], "groups": [int(row["GroupId"])]}
-
-    update_info_str = json.dumps(update_info)
-    update_user_url = "http://YOUR_BOOKED_DOMAIN/Web/Services/index.php/Users/%i" % row["BookedID"]
-    requests.post(update_user_url, data=update_info_str, headers=auth_headers)
+    booked.update_user(int(row["BookedID"]), update_info)
 
     erase_flag = text("UPDATE mechStudents SET Modified = 0 WHERE id = :v1") # Since "Booked" has been updated, we erase the flag from the table
     engine.execute(erase_flag, v1=int(row["id"]))
@@ -58,8 +49,7 @@ deleted_table = pd.DataFrame(deleted_rows, columns=["id", "GivenName", "Surname"
 for ii in deleted_table.index:
     row = deleted_table.iloc[ii]
 
-    delete_url = "http://YOUR_BOOKED_DOMAIN/Web/Services/index.php/Users/%i" % row["BookedID"]
-    requests.delete(delete_url, headers=auth_headers)
+    booked.delete_user(int(row["BookedID"]))
 
     erase_user = text("DELETE FROM deleted WHERE id = :w1")   # We delete the user from the "deleted" table
     engine.execute(erase_user, w1=int(row["id"]))